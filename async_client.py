@@ -0,0 +1,254 @@
+import asyncio
+import logging
+
+from client import _default_options, _receive_packet_types
+from packet.connack_packet import ConnackPacket
+from packet.connect_packet import ConnectPacket
+from packet.pingreq_packet import PingreqPacket
+from packet.pingresp_packet import PingrespPacket
+from packet.puback_packet import PubackPacket
+from packet.pubcomp_packet import PubcompPacket
+from packet.publish_packet import PublishPacket
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from packet.suback_packet import SubackPacket
+from packet.subscribe_packet import SubscribePacket
+from util.common import random_str, merge_dict
+from util.frame_decoder import FrameDecoder
+from util.packet_id import PacketIdAllocator
+
+# message_queue_size: max number of received messages waiting in messages(), 0 means unbounded
+_default_async_options = dict(_default_options, message_queue_size=0)
+
+
+class AsyncClient:
+    """MQTT client on asyncio streams
+
+    ``publish`` and ``subscribe`` return futures, so one event loop can keep many requests in flight. A PINGREQ is
+    sent every ``ping_interval`` seconds (at most ``keepalive``), the connection is closed when its PINGRESP does not
+    arrive within ``ping_timeout``::
+
+        client = AsyncClient('127.0.0.1')
+        await client.connect()
+        await client.subscribe('sensor/#', 1)
+        await asyncio.gather(*(client.publish('sensor/1', b'1', 1) for _ in range(100)))
+        async for message in client.messages():
+            ...
+    """
+
+    def __init__(self, host, port=1883, client_id=None, username=None, password=None, **options):
+        self._host = host
+        self._port = port
+        self._username = username
+        self._password = password
+        self._client_id = client_id or random_str(6)
+        self._options = merge_dict(_default_async_options, options)
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._ping_task = None
+        # resolved by the PINGRESP of the last PINGREQ
+        self._pingresp_future = None
+        self._decoder = None
+        self._packet_ids = PacketIdAllocator()
+        self._connack_future = None
+        # packet id -> future, resolved by PUBACK/PUBCOMP/SUBACK
+        self._publish_futures = {}
+        self._subscribe_futures = {}
+        # packet ids of received QoS 2 messages waiting for PUBREL
+        self._unack_package_ids = set()
+        self._messages = asyncio.Queue(self._options['message_queue_size'])
+
+    async def connect(self):
+        """connect MQTT broker, return the ConnackPacket"""
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        self._decoder = FrameDecoder(self._options['recv_buffer_size'])
+        self._connack_future = asyncio.get_running_loop().create_future()
+        packet = ConnectPacket(self._client_id, self._username, self._password, self._options['keepalive'],
+                               self._options['will_topic'], self._options['will_message'], self._options['will_retain'],
+                               self._options['will_qos'], self._options['clean_session'])
+        self._send_packet(packet)
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        interval = self._ping_interval()
+        if interval:
+            self._ping_task = asyncio.ensure_future(self._ping_loop(interval))
+        return await self._connack_future
+
+    async def close(self):
+        """close connection and fail every pending request"""
+        self._cancel_ping()
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._writer = None
+        self._connection_lost(ConnectionError('connection is closed'))
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def publish(self, topic: str, message: bytes, qos: int = 0, retain: bool = False):
+        """发布消息, return a future resolved on PUBACK (QoS 1) or PUBCOMP (QoS 2), QoS 0 resolves at once
+        """
+        future = asyncio.get_running_loop().create_future()
+        packet_id = self._packet_ids.allocate() if qos else None
+        self._send_packet(PublishPacket(False, qos, retain, topic, packet_id, message))
+        if qos:
+            self._publish_futures[packet_id] = future
+        else:
+            future.set_result(None)
+        return future
+
+    def subscribe(self, topic: str, qos=0, *others_topic_qos):
+        """订阅消息, return a future resolved with the SubackPacket
+        """
+        future = asyncio.get_running_loop().create_future()
+        packet_id = self._packet_ids.allocate()
+        self._send_packet(SubscribePacket(packet_id, topic, qos, *others_topic_qos))
+        self._subscribe_futures[packet_id] = future
+        return future
+
+    async def drain(self):
+        """wait until the write buffer is flushed to the socket"""
+        await self._writer.drain()
+
+    async def messages(self):
+        """iterate over received PublishPackets until the connection is closed"""
+        while True:
+            packet = await self._messages.get()
+            if packet is None:
+                return
+            yield packet
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self._reader.read(self._options['recv_buffer_size'])
+                if not data:
+                    raise ConnectionError('connection is closed')
+                for packet_type, flags, packet_bytes in self._decoder.feed(data):
+                    await self._handle_packet(packet_type, packet_bytes)
+        except ConnectionError as e:
+            logging.warning("%s", e)
+            self._connection_lost(e)
+        except ValueError as e:
+            # a malformed frame, the stream is out of sync
+            logging.warning("%s", e)
+            self._writer.close()
+            self._connection_lost(ConnectionError(str(e)))
+
+    def _ping_interval(self):
+        interval = self._options['ping_interval']
+        if self._options['keepalive']:
+            interval = min(interval or self._options['keepalive'], self._options['keepalive'])
+        return interval
+
+    async def _ping_loop(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            self._pingresp_future = loop.create_future()
+            try:
+                self._send_packet(PingreqPacket())
+                await asyncio.wait_for(self._pingresp_future, self._options['ping_timeout'])
+            except asyncio.TimeoutError:
+                logging.warning("no PINGRESP in %s seconds, the connection is dead", self._options['ping_timeout'])
+                # the read loop sees the connection closed and fails the pending requests
+                self._writer.close()
+                return
+            except ConnectionError:
+                return
+
+    def _cancel_ping(self):
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+
+    async def _handle_packet(self, packet_type, packet_bytes):
+        if packet_type not in _receive_packet_types:
+            logging.warning("unknown packet type: %s", packet_type)
+            return
+        packet = _receive_packet_types[packet_type].from_bytes(packet_bytes)
+        logging.debug('receive a packet: %s', packet)
+
+        # CONNACK Packet
+        if isinstance(packet, ConnackPacket):
+            if self._connack_future and not self._connack_future.done():
+                self._connack_future.set_result(packet)
+        # PINGRESP Packet
+        elif isinstance(packet, PingrespPacket):
+            if self._pingresp_future and not self._pingresp_future.done():
+                self._pingresp_future.set_result(packet)
+        # Publish Packet
+        elif isinstance(packet, PublishPacket):
+            if packet.qos == 1:
+                self._send_packet(PubackPacket(packet.packet_id))
+            elif packet.qos == 2 and packet.packet_id in self._unack_package_ids:
+                # received before, only the PUBREC was lost: acknowledge it again without another delivery
+                self._send_packet(PubrecPacket(packet.packet_id))
+                return
+            elif packet.qos == 2:
+                self._unack_package_ids.add(packet.packet_id)
+                self._send_packet(PubrecPacket(packet.packet_id))
+            await self._messages.put(packet)
+        # PUBACK Packet
+        elif isinstance(packet, PubackPacket):
+            self._resolve(self._publish_futures, packet.packet_id, packet)
+        # PUBREC Packet
+        elif isinstance(packet, PubrecPacket) and packet.packet_id in self._publish_futures:
+            self._send_packet(PubrelPacket(packet.packet_id))
+        # PUBCOMP Packet
+        elif isinstance(packet, PubcompPacket):
+            self._resolve(self._publish_futures, packet.packet_id, packet)
+        # PUBREL Packet
+        elif isinstance(packet, PubrelPacket) and packet.packet_id in self._unack_package_ids:
+            self._unack_package_ids.remove(packet.packet_id)
+            self._send_packet(PubcompPacket(packet.packet_id))
+        # SUBACK Packet
+        elif isinstance(packet, SubackPacket):
+            self._resolve(self._subscribe_futures, packet.packet_id, packet)
+
+    def _connection_lost(self, exc):
+        self._cancel_ping()
+        futures = list(self._publish_futures.values()) + list(self._subscribe_futures.values())
+        if self._connack_future:
+            futures.append(self._connack_future)
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+        self._publish_futures.clear()
+        self._subscribe_futures.clear()
+        self._packet_ids.clear()
+        # wake up messages() consumers
+        try:
+            self._messages.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    def _resolve(self, futures, packet_id, packet):
+        future = futures.pop(packet_id, None)
+        if future is None:
+            # a stray or repeated ack, the id may be in use by another request
+            return
+        self._packet_ids.release(packet_id)
+        if not future.done():
+            future.set_result(packet)
+
+    def _send_packet(self, packet):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError('connection is closed')
+        logging.debug('send a packet: %s', packet)
+        self._writer.write(packet.to_bytes())
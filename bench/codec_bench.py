@@ -0,0 +1,191 @@
+"""Codec microbenchmarks
+
+Measures ops/sec and peak bytes allocated per operation of the packet encoders/decoders, the remaining length
+codec and Scanner, offline and without a broker. Run from the repository root::
+
+    python -m bench.codec_bench                          # print results
+    python -m bench.codec_bench --save baseline.json     # save a baseline
+    python -m bench.codec_bench --compare baseline.json  # exit with 1 on regressions above --threshold
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from packet.connack_packet import ConnackPacket
+from packet.connect_packet import ConnectPacket
+from packet.puback_packet import PubackPacket
+from packet.pubcomp_packet import PubcompPacket
+from packet.publish_packet import PublishPacket, PublishTemplate
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from packet.suback_packet import SubackPacket
+from packet.subscribe_packet import SubscribePacket
+from util.decode import decode_remaining_length
+from util.encode import encode_remaining_length
+from util.frame_decoder import FrameDecoder
+from util.scanner import Scanner
+
+PAYLOAD_SIZES = (0, 16, 256, 4096, 65536, 1 << 20)
+TOPIC_LENGTHS = (1, 16, 128)
+REMAINING_LENGTHS = (0, 127, 16383, 2097151, 268435455)
+
+
+def _topic(length):
+    return ('sensor/' * (length // 7 + 1))[:length]
+
+
+def _cases():
+    """yield ``(name, func)`` for every benchmark"""
+    for size in PAYLOAD_SIZES:
+        for topic_length in TOPIC_LENGTHS:
+            topic = _topic(topic_length)
+            payload = b'x' * size
+            for qos in (0, 1):
+                suffix = 'topic={} payload={} qos={}'.format(topic_length, size, qos)
+                packet = PublishPacket(False, qos, False, topic, 1 if qos else None, payload)
+                packet_bytes = packet.to_bytes()
+                template = PublishTemplate(topic, qos)
+                yield 'PublishPacket.to_bytes ' + suffix, packet.to_bytes
+                yield 'PublishTemplate.to_bytes ' + suffix, lambda t=template, p=payload: t.to_bytes(1, p)
+                yield 'PublishPacket.from_bytes ' + suffix, lambda b=packet_bytes: PublishPacket.from_bytes(b)
+                yield 'PublishPacket.from_bytes+topic+payload ' + suffix, \
+                    lambda b=packet_bytes: _read_publish(PublishPacket.from_bytes(b))
+
+    for size in PAYLOAD_SIZES:
+        frame = PublishPacket(False, 0, False, 'sensor/1', None, b'x' * size).to_bytes()
+        frames = frame * max(1, 65536 // len(frame))
+        yield 'FrameDecoder.feed payload={}'.format(size), lambda d=FrameDecoder(), f=frames: d.feed(f)
+
+    for topic_length in TOPIC_LENGTHS:
+        topic = _topic(topic_length)
+        packet = SubscribePacket(1, topic, 1, topic + '/a', 2)
+        yield 'SubscribePacket.to_bytes topic={}'.format(topic_length), packet.to_bytes
+    connect = ConnectPacket('client-1', 'user', 'password', 60, 'will/topic', 'bye', False, 1)
+    yield 'ConnectPacket.to_bytes', connect.to_bytes
+
+    for packet_class in (PubackPacket, PubrecPacket, PubrelPacket, PubcompPacket):
+        packet = packet_class(0x1234)
+        packet_bytes = packet.to_bytes()
+        yield '{}.to_bytes'.format(packet_class.__name__), packet.to_bytes
+        yield '{}.from_bytes'.format(packet_class.__name__), lambda c=packet_class, b=packet_bytes: c.from_bytes(b)
+    yield 'ConnackPacket.from_bytes', lambda: ConnackPacket.from_bytes(b'\x20\x02\x01\x00')
+    for count in (1, 16):
+        suback = bytes((0x90, 2 + count, 0x12, 0x34)) + b'\x01' * count
+        yield 'SubackPacket.from_bytes codes={}'.format(count), lambda b=suback: SubackPacket.from_bytes(b)
+
+    for remaining_length in REMAINING_LENGTHS:
+        encoded = encode_remaining_length(remaining_length) or b'\x00'
+        yield 'encode_remaining_length {}'.format(remaining_length), \
+            lambda n=remaining_length: encode_remaining_length(n)
+        yield 'decode_remaining_length {}'.format(remaining_length), \
+            lambda b=encoded: decode_remaining_length(Scanner(b))
+
+    data = bytes(range(256)) * 4
+    yield 'Scanner.next_bytes(1) x64', lambda: _scan_bytes(Scanner(data), 1)
+    yield 'Scanner.next_bytes(2) x64', lambda: _scan_bytes(Scanner(data), 2)
+    yield 'Scanner.next_bits x64', lambda: _scan_bits(Scanner(data))
+    yield 'Scanner.remains_bytes', lambda: Scanner(data).skip_bytes(4).remains_bytes()
+
+
+def _read_publish(packet):
+    return packet.topic, packet.payload
+
+
+def _scan_bytes(scanner, n):
+    for _ in range(64):
+        scanner.next_bytes(n)
+
+
+def _scan_bits(scanner):
+    for _ in range(16):
+        scanner.next_bits(1)
+        scanner.next_bits(2)
+        scanner.next_bits(1)
+        scanner.next_bits(4)
+
+
+def measure(func, min_time=0.2):
+    """return ``(ops_per_sec, peak_bytes)`` of ``func``"""
+    # calibrate the number of calls per round
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 5:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / 5 / elapsed))
+    # best of 5 rounds
+    best = elapsed
+    for _ in range(4):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    # bytes allocated at the peak of one call
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return number / best, peak
+
+
+def run(name_filter=None, min_time=0.2, out=sys.stdout):
+    results = {}
+    for name, func in _cases():
+        if name_filter and name_filter not in name:
+            continue
+        ops, peak = measure(func, min_time)
+        results[name] = {'ops_per_sec': ops, 'peak_bytes': peak}
+        print('{:<70} {:>14,.0f} ops/s {:>12,} B'.format(name, ops, peak), file=out)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """return the list of regressions of ``results`` against ``baseline``"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append('{}: {:,.0f} -> {:,.0f} ops/s'.format(name, base['ops_per_sec'],
+                                                                     result['ops_per_sec']))
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + threshold) + 64:
+            regressions.append('{}: {:,} -> {:,} peak bytes'.format(name, base['peak_bytes'], result['peak_bytes']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='codec microbenchmarks')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent on each benchmark')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative regression, default 0.1')
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.min_time)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+        print('no regression above {:.0%}'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,39 @@
+import errno
 import logging
+import os
+import queue
+import random
+import select
 import socket
-import sys
+import threading
+import time
 import traceback
+from concurrent.futures import Future
 
 from packet.connack_packet import ConnackPacket
 from packet.connect_packet import ConnectPacket
+from packet.disconnect_packet import DisconnectPacket
+from packet.pingreq_packet import PingreqPacket
+from packet.pingresp_packet import PingrespPacket
 from packet.puback_packet import PubackPacket
 from packet.pubcomp_packet import PubcompPacket
-from packet.publish_packet import PublishPacket
+from packet.publish_packet import PublishPacket, PublishTemplate, encode_header
 from packet.pubrec_packet import PubrecPacket
 from packet.pubrel_packet import PubrelPacket
 from packet.suback_packet import SubackPacket
 from packet.subscribe_packet import SubscribePacket
+from util.batch import MAGIC, BatchPublisher, unpack_envelope
+from util.columnar import MessageBatch, schema_router
+from util.capture import CaptureWriter
 from util.common import random_str, merge_dict
-
-logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', stream=sys.stdout, level=logging.DEBUG)
+from util.dispatcher import OrderedDispatcher
+from util.frame_decoder import FrameDecoder, PUBLISH_CHUNK, PUBLISH_HEAD
+from util.metrics import Metrics
+from util.packet_id import PacketIdAllocator
+from util.stream import StreamPayload
+from util.timer_wheel import TimerWheel
+from util.topic_router import TopicRouter
+from util.write_queue import WriteQueue
 
 _default_options = {
     "keepalive": 60,
@@ -23,9 +42,68 @@ _default_options = {
     "will_retain": None,
     "will_qos": None,
     "clean_session": True,
+    # seconds between PINGREQs, never longer than keepalive
     "ping_interval": 300,
+    # seconds to wait for PINGRESP before the connection is considered dead
+    "ping_timeout": 10,
+    # seconds before an unacknowledged QoS 1/2 message is sent again with DUP set, 0 only resends on reconnect
+    "retry_interval": 0,
+    # resolution in seconds of the timers driving pings and retransmission
+    "timer_tick": 0.1,
+    "recv_buffer_size": 65536,
+    # outbound packets are coalesced until this many bytes are pending, 0 for no size limit
+    "write_buffer_size": 0,
+    # max seconds a packet may wait in the write queue, 0 for no time limit; with both at 0 every packet is written
+    # at once. The limits are checked when a packet is queued: loop_forever also writes after every read, without a
+    # running loop call flush()
+    "write_flush_interval": 0,
+    "tcp_nodelay": False,
+    # max number of unacknowledged packets, 0 means the whole packet id space
+    "max_inflight_messages": 0,
+    # seconds publish() waits for room in the in-flight window before raising queue.Full, None waits forever
+    "inflight_timeout": None,
+    # number of topics whose matching message callbacks are cached
+    "topic_match_cache_size": 4096,
+    # a concurrent.futures executor running message callbacks, None runs them on the network thread
+    "callback_executor": None,
+    # max number of messages waiting for or running on callback_executor
+    "callback_queue_size": 1000,
+    # function(packet) returning the key whose messages are handled in order, default is the topic
+    "dispatch_key": None,
+    # when QoS 1/2 messages are acked with callback_executor: "after_handler" or "before_dispatch"
+    "ack_policy": "after_handler",
+    # True or a util.metrics.Metrics instance to collect metrics, see Client.metrics
+    "metrics": False,
+    # a util.session_store.SessionStore keeping QoS 1/2 in-flight state, e.g. FileSessionStore, replayed on
+    # connect when clean_session is False
+    "session_store": None,
+    # reconnect in loop_forever when the connection is lost
+    "auto_reconnect": False,
+    # bounds in seconds of the jittered exponential backoff between reconnect attempts
+    "reconnect_delay_min": 1,
+    "reconnect_delay_max": 120,
+    # a util.compression.Compression compressing published payloads per topic filter and decompressing received ones
+    "compression": None,
+    # PUBLISH packets of at least this many bytes are passed to on_message_stream in chunks, when it is set
+    "stream_threshold": 1 << 20,
+    # unpack the envelopes of Client.batch_publisher into one message each
+    "batch_envelopes": True,
+    # a util.offline_queue.OfflineQueue keeping the messages of publish() while disconnected, sent once connected
+    "offline_queue": None,
+    # a util.rate_limit.RateLimiter throttling publish(), publish_future(), publish_many() and prepared publishes per
+    # topic filter
+    "publish_rate_limit": None,
+    # a util.rate_limit.RateLimiter throttling the dispatch of received messages per topic filter
+    "message_rate_limit": None,
+    # a util.capture.CaptureWriter or the path of a log recording every packet sent and read, see replay.py
+    "capture": None,
 }
 
+# max remaining length of one SUBSCRIBE packet sent when resubscribing
+_max_resubscribe_length = 65536
+
+_ack_policies = ('after_handler', 'before_dispatch')
+
 _receive_packet_types = {
     2: ConnackPacket,
     3: PublishPacket,
@@ -34,9 +112,21 @@ _receive_packet_types = {
     6: PubrelPacket,
     7: PubcompPacket,
     9: SubackPacket,
+    13: PingrespPacket,
 }
 
 
+def _call_callbacks(callbacks, packet):
+    for callback in callbacks:
+        callback(packet)
+
+
+def _call_callbacks_each(callbacks, packets):
+    for packet in packets:
+        for callback in callbacks:
+            callback(packet)
+
+
 class Client:
 
     def __init__(self, host, port=1883, client_id=random_str(6), username=None, password=None, **options):
@@ -49,10 +139,83 @@ class Client:
         # No default callbacks
         self._on_connect = None
         self._on_message = None
+        self._on_message_stream = None
+        self._on_envelope = None
+        self._on_message_batch = None
+        self._batch_max_items = 1000
+        self._batch_max_delay = 0.05
+        # topic filter -> PayloadSchema of on_message_batch
+        self._payload_schemas = None
+        # the MessageBatch being filled
+        self._message_batch = None
+        # header and sink of the PUBLISH being received in chunks
+        self._stream_packet = None
+        self._stream_sink = None
+        # topic filter -> message callback, see message_callback_add
+        self._message_callbacks = TopicRouter(self._options['topic_match_cache_size'])
+        if self._options['ack_policy'] not in _ack_policies:
+            raise ValueError('ack_policy must be one of {}'.format(_ack_policies))
+        self._dispatcher = None
+        if self._options['callback_executor'] is not None:
+            self._dispatcher = OrderedDispatcher(self._options['callback_executor'],
+                                                 self._options['callback_queue_size'])
         self._socket = None
-        self._packet_id = 0
+        self._decoder = None
+        self._write_queue = None
+        self._packet_ids = PacketIdAllocator()
+        self._max_inflight = min(self._options['max_inflight_messages'] or 0xFFFF, 0xFFFF)
+        # notified whenever a packet id is released
+        self._inflight_cond = threading.Condition()
+        self._loop_thread = None
+        # packet ids of received QoS 2 messages waiting for PUBREL
         self._unack_package_ids = set()
+        # sent QoS 1/2 messages waiting for PUBACK/PUBREC
         self._unack_packet = {}
+        # packet ids of sent QoS 2 messages waiting for PUBCOMP
+        self._unack_pubrel_ids = set()
+        # packet id -> Future of a QoS 1/2 message sent by publish_future
+        self._publish_futures = {}
+        self._metrics = None
+        if self._options['metrics']:
+            self._metrics = self._options['metrics'] if isinstance(self._options['metrics'], Metrics) else Metrics()
+            self._register_gauges()
+        # packet id -> time the QoS 1/2 message was published, only when metrics are enabled
+        self._publish_times = {}
+        self._session_store = self._options['session_store']
+        self._compression = self._options['compression']
+        self._offline_queue = self._options['offline_queue']
+        self._publish_limiter = self._options['publish_rate_limit']
+        self._message_limiter = self._options['message_rate_limit']
+        self._capture = self._options['capture']
+        # the writer was opened by the client, which closes it
+        self._owns_capture = isinstance(self._capture, str)
+        if self._owns_capture:
+            self._capture = CaptureWriter(self._capture)
+        self._session_restored = False
+        # topic -> qos of every subscribe() call, renewed on reconnect
+        self._subscriptions = {}
+        # packet ids of SUBSCRIBE packets waiting for SUBACK
+        self._unack_subscribe_ids = set()
+        self._closing = False
+        # time the connection was lost, cleared once delivery is restored
+        self._disconnected_at = None
+        # packet ids of the SUBSCRIBE packets sent by the reconnect
+        self._resubscribe_ids = set()
+        self._timers = TimerWheel(self._options['timer_tick'])
+        self._ping_timer = None
+        # deadline of the PINGRESP of the last PINGREQ
+        self._pingresp_timer = None
+        # packet id -> retransmission Timer of a QoS 1/2 message
+        self._retry_timers = {}
+        # the Multiplexer running this client, see Multiplexer.add
+        self._multiplexer = None
+        # wakes up the select of loop_forever when another thread queued packets
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._wakeup_sent = False
+        self._loop_stopping = False
+        # the thread started by loop_start
+        self._background_thread = None
 
     @classmethod
     def define_packet_type(cls, packet_type):
@@ -66,85 +229,298 @@ class Client:
     def connect(self):
         """connect MQTT broker
         """
+        self._closing = False
+        multiplexer = self._multiplexer
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.setblocking(True)
-        self._socket.connect((self._host, self._port))
+        self._socket.setblocking(multiplexer is None)
+        if self._options['tcp_nodelay']:
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if multiplexer is None:
+            self._socket.connect((self._host, self._port))
+            self._decoder = FrameDecoder(self._options['recv_buffer_size'])
+            self._write_queue = WriteQueue(self._socket, self._options['write_buffer_size'],
+                                           self._options['write_flush_interval'])
+        else:
+            # the packets below stay queued until the connection is established
+            err = self._socket.connect_ex((self._host, self._port))
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                self._socket.close()
+                raise OSError(err, os.strerror(err))
+            self._decoder = FrameDecoder(buffer=multiplexer.recv_buffer)
+            self._write_queue = WriteQueue(self._socket, self._options['write_buffer_size'],
+                                           self._options['write_flush_interval'], False,
+                                           lambda _: multiplexer._write_pending(self))
+            multiplexer._register(self)
+        if self._on_message_stream is not None:
+            self._decoder.stream_threshold = self._options['stream_threshold']
+        self._decoder.capture = self._capture
+        self._stream_packet = self._stream_sink = None
         # Send connect packet
         packet = ConnectPacket(self._client_id, self._username, self._password, self._options['keepalive'],
                                self._options['will_topic'], self._options['will_message'], self._options['will_retain'],
                                self._options['will_qos'], self._options['clean_session'])
         self._send_packet(packet)
+        if self._session_store is not None:
+            if self._options['clean_session']:
+                self._session_store.clear()
+            elif not self._session_restored:
+                self._restore_session()
+            self._session_restored = True
+        self._schedule_ping()
 
     def reconnect(self):
-        """reconnect MQTT broker"""
-        pass
+        """reconnect MQTT broker
+
+        The in-flight QoS 1/2 messages are sent again with DUP set and the subscriptions are renewed with as few
+        SUBSCRIBE packets as possible.
+        """
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        self._close_socket()
+        self.connect()
+        self._resend_inflight()
+        self._resubscribe()
+        self.flush()
+        if self._metrics is not None:
+            self._metrics.inc('reconnects')
 
     def close(self):
         """close connection and clear the resource
         """
-        pass
+        self._closing = True
+        if self._socket is not None:
+            try:
+                self._send_packet(DisconnectPacket())
+                self.flush()
+            except OSError:
+                pass
+        self._close_socket()
+        if self._session_store is not None:
+            self._session_store.close()
+        if self._offline_queue is not None:
+            self._offline_queue.close()
+        if self._capture is not None:
+            if self._owns_capture:
+                self._capture.close()
+            else:
+                self._capture.flush()
+        futures, self._publish_futures = self._publish_futures, {}
+        for future in futures.values():
+            future.set_exception(ConnectionError('client is closed'))
+        if self._background_thread is not None and self._background_thread is not threading.current_thread():
+            self._background_thread.join()
+            self._background_thread = None
+        for sock in (self._wakeup_r, self._wakeup_w):
+            if sock is not None:
+                sock.close()
+        self._wakeup_r = self._wakeup_w = None
+
+    def loop_start(self):
+        """Run loop_forever on a background thread
+
+        Any thread may publish meanwhile: packets are handed to the network thread without waiting for the socket
+        and written in batches.
+        """
+        if self._background_thread is not None:
+            raise RuntimeError('loop is already running')
+        self._background_thread = threading.Thread(target=self.loop_forever, name='mqtt-loop', daemon=True)
+        self._background_thread.start()
+        return self._background_thread
+
+    def loop_stop(self):
+        """Stop the thread started by loop_start, the connection stays open"""
+        if self._background_thread is None:
+            return
+        self._loop_stopping = True
+        self._wake_loop()
+        self._background_thread.join()
+        self._background_thread = None
+        # cleared here and not when the loop starts, so a stop right after loop_start is not lost
+        self._loop_stopping = False
 
     def loop_forever(self):
         """Receive data from broker in an loop"""
-        while True:
-            try:
-                packet_type, flags, packet_bytes, remaining_length = self._recv_packet()
-                if packet_type not in _receive_packet_types:
-                    logging.warning("unknown packet type: %s", packet_type)
-                    continue
-                packet = _receive_packet_types[packet_type].from_bytes(packet_bytes)
-                logging.debug('receive a packet: %s', packet)
-
-                # CONNACK Packet
-                if isinstance(packet, ConnackPacket) and self._on_connect:
-                    self._on_connect(packet)
-                # Publish Packet
-                elif isinstance(packet, PublishPacket):
-                    if packet.qos == 0:
-                        # callback on_message
-                        self._on_message(packet)
-                    elif packet.qos == 1:
-                        # callback on_message
-                        self._on_message(packet)
-                        # publish ack for publish packet(qos = 1)
-                        self._send_packet(PubackPacket(packet.packet_id))
-                    elif packet.qos == 2:
-                        # Store packet id
-                        self._unack_package_ids.add(packet.packet_id)
-                        # callback on_message
-                        self._on_message(packet)
-                        # send PUBREC packet
-                        self._send_packet(PubrecPacket(packet.packet_id))
-                # PUBACK Packet
-                elif isinstance(packet, PubackPacket) and packet.packet_id in self._unack_packet:
-                    self._unack_packet.pop(packet.packet_id)
-                # PUBREC Packet
-                elif isinstance(packet, PubrecPacket) and packet.packet_id in self._unack_packet:
-                    # discard message
-                    self._unack_packet.pop(packet.packet_id)
-                    # store packet id
-                    self._unack_package_ids.add(packet.packet_id)
-                    # send PUBREL message
-                    self._send_packet(PubrelPacket(packet.packet_id))
-                # PUBCOMP Packet
-                elif isinstance(packet, PubcompPacket) and packet.packet_id in self._unack_package_ids:
-                    self._unack_package_ids.remove(packet.packet_id)
-                # PUBREL Packet
-                elif isinstance(packet, PubrelPacket) and packet.packet_id in self._unack_package_ids:
-                    # discard packet id
-                    self._unack_package_ids.remove(packet.packet_id)
-                    # send PUBCOMP packet
-                    self._send_packet(PubcompPacket(packet.packet_id))
+        if self._wakeup_r is None:
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
+        self._loop_thread = threading.current_thread()
+        try:
+            self._loop()
+        finally:
+            if self._message_batch is not None:
+                try:
+                    self._flush_message_batch(self._message_batch)
+                except Exception as e:
+                    logging.error("message callback occur error: %s", e)
+            self._loop_thread = None
+            # packets posted while the loop was stopping
+            if not self._closing:
+                try:
+                    self.flush()
+                except OSError:
+                    pass
 
+    def _loop(self):
+        while not self._closing and not self._loop_stopping:
+            try:
+                frames = self._recv_packets()
             except KeyboardInterrupt:
                 self.close()
-            except ConnectionError as e:
+                return
+            except (OSError, ValueError) as e:
+                if self._closing:
+                    return
                 logging.warning("%s", e)
+                if isinstance(e, ValueError):
+                    # a malformed frame, the stream is out of sync and only a new connection gets out of it
+                    self._close_socket()
+                if self._reconnect_with_backoff():
+                    continue
                 return
+            self._handle_frames(frames)
+            # pings and retransmissions that are due
+            self._timers.advance()
+            # acks of this batch and anything else pending go out together
+            try:
+                self.flush()
+            except OSError as e:
+                if self._closing:
+                    return
+                logging.warning("%s", e)
+                if not self._reconnect_with_backoff():
+                    return
+
+    def _handle_frames(self, frames):
+        """handle every packet of one read before going back to the socket"""
+        for packet_type, flags, packet_bytes in frames:
+            if self._metrics is not None and packet_type <= PUBLISH_HEAD:
+                # flags of a PUBLISH_HEAD is the length of the payload to come
+                self._metrics.count_packet('in', 3 if packet_type == PUBLISH_HEAD else packet_type,
+                                           len(packet_bytes) + (flags if packet_type == PUBLISH_HEAD else 0))
+            try:
+                if packet_type >= PUBLISH_HEAD:
+                    self._handle_stream(packet_type, flags, packet_bytes)
+                else:
+                    self._handle_packet(packet_type, packet_bytes)
+            except ConnectionError as e:
+                logging.warning("%s", e)
+                break
             except Exception as e:
                 logging.error("mqtt client occur error: %s", e)
                 traceback.print_exc()
-                continue
+        if self._offline_queue is not None and len(self._offline_queue):
+            # connected again, acks made room in the in-flight window or messages were held while draining
+            try:
+                self._drain_offline()
+            except OSError as e:
+                logging.warning("%s", e)
+
+    def _handle_packet(self, packet_type, packet_bytes):
+        if packet_type not in _receive_packet_types:
+            logging.warning("unknown packet type: %s", packet_type)
+            return
+        packet = _receive_packet_types[packet_type].from_bytes(packet_bytes)
+        logging.debug('receive a packet: %s', packet)
+
+        # CONNACK Packet
+        if isinstance(packet, ConnackPacket):
+            if not self._resubscribe_ids:
+                self._delivery_restored()
+            if self._on_connect:
+                self._on_connect(packet)
+        # PINGRESP Packet
+        elif isinstance(packet, PingrespPacket):
+            if self._pingresp_timer is not None:
+                self._pingresp_timer.cancel()
+                self._pingresp_timer = None
+        # Publish Packet
+        elif isinstance(packet, PublishPacket):
+            if packet.qos == 0:
+                # callback on_message
+                self._dispatch_message(packet)
+            elif packet.qos == 1:
+                # callback on_message, publish ack for publish packet(qos = 1)
+                self._dispatch_message(packet, PubackPacket(packet.packet_id))
+            elif packet.qos == 2 and packet.packet_id in self._unack_package_ids:
+                # received before, only the PUBREC was lost: acknowledge it again without another dispatch
+                self._send_packet(PubrecPacket(packet.packet_id))
+            elif packet.qos == 2:
+                # Store packet id
+                self._unack_package_ids.add(packet.packet_id)
+                if self._session_store is not None:
+                    self._session_store.add_inbound(packet.packet_id)
+                # callback on_message, send PUBREC packet
+                self._dispatch_message(packet, PubrecPacket(packet.packet_id))
+        # PUBACK Packet
+        elif isinstance(packet, PubackPacket) and packet.packet_id in self._unack_packet:
+            self._unack_packet.pop(packet.packet_id)
+            self._publish_done(packet.packet_id)
+        # PUBREC Packet
+        elif isinstance(packet, PubrecPacket) and packet.packet_id in self._unack_packet:
+            # discard message
+            self._unack_packet.pop(packet.packet_id)
+            # store packet id
+            self._unack_pubrel_ids.add(packet.packet_id)
+            if self._session_store is not None:
+                self._session_store.add_pubrel(packet.packet_id)
+            # send PUBREL message
+            self._send_packet(PubrelPacket(packet.packet_id))
+            self._schedule_retry(packet.packet_id)
+        # PUBCOMP Packet
+        elif isinstance(packet, PubcompPacket) and packet.packet_id in self._unack_pubrel_ids:
+            self._unack_pubrel_ids.remove(packet.packet_id)
+            self._publish_done(packet.packet_id)
+        # PUBREL Packet
+        elif isinstance(packet, PubrelPacket) and packet.packet_id in self._unack_package_ids:
+            # discard packet id
+            self._unack_package_ids.remove(packet.packet_id)
+            if self._session_store is not None:
+                self._session_store.remove_inbound(packet.packet_id)
+            # send PUBCOMP packet
+            self._send_packet(PubcompPacket(packet.packet_id))
+        # SUBACK Packet
+        elif isinstance(packet, SubackPacket):
+            self._unack_subscribe_ids.discard(packet.packet_id)
+            self._release_packet_id(packet.packet_id)
+            if packet.packet_id in self._resubscribe_ids:
+                self._resubscribe_ids.remove(packet.packet_id)
+                if not self._resubscribe_ids:
+                    self._delivery_restored()
+
+    def _handle_stream(self, event, length, data):
+        if event == PUBLISH_HEAD:
+            packet = self._stream_packet = PublishPacket.from_bytes(data)
+            if packet.qos == 2 and packet.packet_id in self._unack_package_ids:
+                # received before, the payload is dropped and the PUBREC sent again
+                self._stream_sink = None
+            else:
+                self._stream_sink = self._on_message_stream(packet, length)
+        elif event == PUBLISH_CHUNK:
+            if self._stream_sink is not None:
+                self._stream_sink.write(data)
+        else:
+            packet, sink = self._stream_packet, self._stream_sink
+            self._stream_packet = self._stream_sink = None
+            if sink is not None:
+                sink.close()
+            # acknowledged once the whole payload is handled
+            if packet.qos == 1:
+                self._send_packet(PubackPacket(packet.packet_id))
+            elif packet.qos == 2:
+                if packet.packet_id not in self._unack_package_ids:
+                    self._unack_package_ids.add(packet.packet_id)
+                    if self._session_store is not None:
+                        self._session_store.add_inbound(packet.packet_id)
+                self._send_packet(PubrecPacket(packet.packet_id))
+
+    @property
+    def metrics(self):
+        """the Metrics of this client, None unless the metrics option is set
+
+        ``client.metrics.snapshot()`` returns the current counters, gauges and histograms.
+        """
+        return self._metrics
 
     def on_connect(self, func):
         """
@@ -158,75 +534,801 @@ class Client:
         self._on_message = func
         return func
 
+    def on_message_stream(self, func):
+        """Receive PUBLISH packets of at least ``stream_threshold`` bytes in chunks as they arrive
+
+        ``func(packet, length)`` gets the topic and flags first (the payload of ``packet`` is empty) and the payload
+        length, and returns a sink: ``sink.write(chunk)`` is called for every chunk and ``sink.close()`` at the end,
+        then the message is acknowledged. Returning None drops the payload. The sink runs on the network thread and
+        the payload is not decompressed.
+        """
+        self._on_message_stream = func
+        if self._decoder is not None:
+            self._decoder.stream_threshold = self._options['stream_threshold']
+        return func
+
+    def on_envelope(self, func):
+        """Receive the messages of a batch envelope together
+
+        ``func(packets)`` gets the list of PublishPackets of one envelope instead of on_message and the message
+        callbacks getting them one by one. The envelope is acknowledged once, after it returns.
+        """
+        self._on_envelope = func
+        return func
+
+    def on_message_batch(self, func, max_items=1000, max_delay=0.05, schemas=None):
+        """Receive messages a batch at a time instead of one by one with on_message
+
+        ``func(batch)`` gets a util.columnar.MessageBatch, a list of PublishPackets with their receive times, once
+        it holds ``max_items`` messages or its first one is ``max_delay`` seconds old. ``schemas`` maps topic
+        filters to a util.columnar.PayloadSchema or a struct format, ``batch.columns()`` then decodes the payloads
+        into one column per field::
+
+            def store(batch):
+                for topic_filter, columns in batch.columns(numpy=True).items():
+                    write(columns['timestamp'], columns['value'])
+
+            client.on_message_batch(store, 5000, 0.1, {'sensor/+/temperature': '<f'})
+
+        The callbacks of message_callback_add still get their messages one by one. QoS 1/2 messages are
+        acknowledged after ``func`` returns.
+        """
+        self._on_message_batch = func
+        self._batch_max_items = max_items
+        self._batch_max_delay = max_delay
+        self._payload_schemas = schema_router(schemas, self._options['topic_match_cache_size']) if schemas else None
+        return func
+
+    def message_callback_add(self, topic_filter: str, func):
+        """Call ``func`` for messages whose topic matches ``topic_filter`` instead of on_message
+
+        ``topic_filter`` may contain ``+`` and ``#`` wildcards. Messages matching several filters are passed to every
+        matching callback, messages matching none go to on_message.
+        """
+        self._message_callbacks.add(topic_filter, func)
+        return func
+
+    def message_callback_remove(self, topic_filter: str):
+        self._message_callbacks.remove(topic_filter)
+
     def subscribe(self, topic: str, qos=0, *others_topic_qos):
         """订阅消息
         """
-        packet = SubscribePacket(self._next_packet_id(), topic, qos, *others_topic_qos)
+        packet = SubscribePacket(self._acquire_packet_id(), topic, qos, *others_topic_qos)
+        self._subscriptions[topic] = qos
+        for i in range(0, len(others_topic_qos) - 1, 2):
+            self._subscriptions[others_topic_qos[i]] = others_topic_qos[i + 1]
+        self._unack_subscribe_ids.add(packet.packet_id)
         self._send_packet(packet)
+        return packet.packet_id
 
     def unsubscribe(self, topics):
         """取消订阅
         """
         pass
 
-    def publish(self, topic: str, message: bytes, qos: int = 0, retain: bool = False, dup: bool = False):
+    def publish(self, topic: str, message: bytes, qos: int = 0, retain: bool = False, dup: bool = False,
+                length=None):
         """发布消息
+
+        ``message`` may also be a file-like object or an iterable of bytes of ``length`` bytes, see publish_stream.
+        With the offline_queue option, messages published while disconnected are queued and sent after reconnecting
+        (streams are not, see publish_stream).
+        With publish_rate_limit, raise queue.Full when the limit rejects the message.
+        """
+        if message is not None and not isinstance(message, (bytes, bytearray, memoryview)):
+            return self.publish_stream(topic, message, length, qos, retain)
+        limiter = self._publish_limiter
+        if limiter is not None and self._limit_publish(limiter, topic, self._publish_now,
+                                                       (topic, message, qos, retain, dup)):
+            return
+        self._publish_now(topic, message, qos, retain, dup)
+
+    def publish_stream(self, topic: str, source, length=None, qos: int = 0, retain: bool = False,
+                       chunk_size=65536):
+        """Publish ``length`` bytes read in chunks from a file-like object or an iterable of bytes
+
+        The payload is never held in memory as a whole: the chunks go straight to the socket, blocking until the last
+        one is written. ``length`` may be left out for a seekable file. QoS 1/2 need a seekable file, which is read
+        again for a retransmission; such messages are not kept in the session store. With offline_queue, raise
+        ConnectionError where publish() would hold the message, a stream is read only once.
+        """
+        payload = StreamPayload(source, length, chunk_size)
+        if qos and not payload.seekable:
+            raise ValueError('QoS 1/2 streams must be seekable files')
+        if self._must_hold():
+            raise ConnectionError('not connected, streams are not held in the offline queue')
+        publish_packet = self._build_publish_packet(topic, payload, qos, retain)
+        self._send_publish(publish_packet)
+        return publish_packet.packet_id
+
+    def publish_future(self, topic: str, message: bytes, qos: int = 0, retain: bool = False):
+        """Publish and return a concurrent.futures.Future resolved with the packet id once it is acknowledged
+
+        QoS 0 messages resolve as soon as they are queued, with None. Futures still pending when the client is
+        closed fail with ConnectionError. With offline_queue, raise ConnectionError where publish() would hold the
+        message, the future could not follow it into the queue (the future fails instead when the rate limit delayed
+        the message).
+        """
+        future = Future()
+        limiter = self._publish_limiter
+        if limiter is not None and self._limit_publish(limiter, topic, self._publish_future_later,
+                                                       (topic, message, qos, retain, future)):
+            return future
+        self._publish_future_now(topic, message, qos, retain, future)
+        return future
+
+    def publish_many(self, messages):
+        """Publish a batch of messages with as few writes as possible
+
+        :param messages: iterable of ``(topic, message)``, ``(topic, message, qos)`` or ``(topic, message, qos, retain)``
+
+        publish_rate_limit applies to every message as in publish(), the messages before a rejected one are sent.
+        With offline_queue, messages are held while disconnected as in publish().
+        """
+        limiter = self._publish_limiter
+        offline = self._offline_queue
+        packets_bytes = []
+        # the messages of packets_bytes, with offline_queue
+        unsent = []
+
+        def write(flush):
+            self._write_many(packets_bytes)
+            if flush:
+                self.flush()
+
+        def write_pending(flush=True):
+            # the acks that make room or the time waited for tokens can only count for packets that were sent
+            if not packets_bytes:
+                return
+            try:
+                self._write_or_hold(unsent, write, flush)
+            finally:
+                packets_bytes.clear()
+                unsent.clear()
+
+        try:
+            for item in messages:
+                if limiter is not None or offline is not None:
+                    topic, message, qos, retain = (tuple(item) + (0, False))[:4]
+                    if limiter is not None and self._limit_publish(limiter, topic, self._publish_now,
+                                                                   (topic, message, qos, retain, False),
+                                                                   write_pending):
+                        continue
+                    if self._must_hold():
+                        write_pending()
+                        self._hold(topic, message, qos, retain)
+                        continue
+                    if offline is not None:
+                        unsent.append((topic, message, qos, retain))
+                if packets_bytes and not self._has_inflight_room():
+                    write_pending()
+                publish_packet = self._build_publish_packet(*item)
+                logging.debug('send a packet: %s', publish_packet)
+                packets_bytes.append(publish_packet.to_bytes())
+        finally:
+            write_pending(False)
+
+    def batch_publisher(self, qos: int = 0, retain: bool = False, max_items=100, max_delay=0.05, max_bytes=65536):
+        """Return a BatchPublisher packing many small messages of one topic into one PUBLISH
+
+        Messages are collected per topic until ``max_items`` messages, ``max_bytes`` bytes or ``max_delay`` seconds
+        and sent as one envelope, which receiving Clients unpack into one message each (see on_envelope)::
+
+            batch = client.batch_publisher(qos=1, max_items=50, max_delay=0.1)
+            batch.publish('sensor/1', b'21.5')
         """
+        return BatchPublisher(lambda topic, payload: self.publish(topic, payload, qos, retain),
+                              lambda delay, callback, *args: self._timers.schedule(delay, callback, *args),
+                              max_items, max_delay, max_bytes)
+
+    def prepare_publish(self, topic: str, qos: int = 0, retain: bool = False):
+        """Return a PreparedPublish for publishing to ``topic`` repeatedly
+
+        The fixed header flags and the encoded topic are computed once::
+
+            temperature = client.prepare_publish('sensor/temperature', 1)
+            temperature.publish(b'21.5')
+        """
+        return PreparedPublish(self, PublishTemplate(topic, qos, retain))
+
+    def flush(self):
+        """write all queued packets to the socket"""
+        if self._write_queue is not None:
+            self._write_queue.flush()
+
+    def _build_publish_packet(self, topic, message, qos=0, retain=False, dup=False, future=None):
         if qos != 2:
             dup = False
-        publish_packet = PublishPacket(dup, qos, retain, topic, self._next_packet_id(), message)
-        self._send_packet(publish_packet)
-
+        streaming = isinstance(message, StreamPayload)
+        if self._compression is not None and not streaming:
+            message = self._compression.compress(topic, message)
+        packet_id = self._acquire_packet_id() if qos else None
+        publish_packet = PublishPacket(dup, qos, retain, topic, packet_id, message)
         if qos != 0:
+            # registered before the packet is sent, the ack may come back at once
+            if future is not None:
+                self._publish_futures[packet_id] = future
             # Store message
             self._unack_packet[publish_packet.packet_id] = publish_packet
+            if self._session_store is not None and not streaming:
+                self._session_store.add_publish(packet_id, publish_packet.to_bytes())
+            if self._metrics is not None:
+                self._publish_times[packet_id] = time.monotonic()
+            self._schedule_retry(packet_id)
+        return publish_packet
+
+    def _publish_template(self, template, message):
+        limiter = self._publish_limiter
+        if limiter is not None and self._limit_publish(limiter, template.topic, self._publish_template_now,
+                                                       (template, message)):
+            return
+        self._publish_template_now(template, message)
+
+    def _publish_template_now(self, template, message):
+        held = ((template.topic, message, template.qos, template.retain),)
+        if self._must_hold():
+            self._hold(*held[0])
+            return
+        publish_packet = self._build_publish_packet(template.topic, message, template.qos, template.retain)
+        logging.debug('send a packet: %s', publish_packet)
+        self._write_or_hold(held, self._write, template.to_bytes(publish_packet.packet_id, publish_packet.payload))
+
+    def _dispatch_message(self, packet, ack=None, limit=True):
+        """run the message callbacks of ``packet`` and send ``ack`` according to ack_policy"""
+        if limit and self._message_limiter is not None and self._limit_message(self._message_limiter, packet, ack):
+            return
+        if self._compression is not None:
+            payload = self._compression.decompress(packet.payload)
+            if payload is not packet.payload:
+                packet = PublishPacket(packet.dup, packet.qos, packet.retain, packet.topic, packet.packet_id, payload)
+        payloads = None
+        if self._options['batch_envelopes'] and packet.payload is not None and packet.payload[:2] == MAGIC:
+            payloads = unpack_envelope(packet.payload)
+        if payloads is not None and self._on_envelope is not None:
+            callbacks = (self._on_envelope,)
+        else:
+            callbacks = self._message_callbacks.match(packet.topic) if self._message_callbacks else ()
+            if not callbacks and self._on_message_batch is not None:
+                if payloads is None:
+                    self._collect_message((packet,), ack)
+                else:
+                    self._collect_message([PublishPacket(packet.dup, packet.qos, packet.retain, packet.topic,
+                                                         packet.packet_id, payload) for payload in payloads], ack)
+                return
+            if not callbacks and self._on_message:
+                callbacks = (self._on_message,)
+        call = _call_callbacks
+        arg = packet
+        if payloads is not None:
+            # one packet per message of the envelope, acknowledged together
+            arg = [PublishPacket(packet.dup, packet.qos, packet.retain, packet.topic, packet.packet_id, payload)
+                   for payload in payloads]
+            if self._on_envelope is None:
+                call = _call_callbacks_each
+        key_func = self._options['dispatch_key']
+        self._run_callbacks(call, callbacks, arg, (ack,) if ack else (), key_func(packet) if key_func else packet.topic)
+
+    def _run_callbacks(self, call, callbacks, arg, acks, key):
+        """``call(callbacks, arg)`` on the network thread or callback_executor, send ``acks`` according to
+        ack_policy"""
+        if self._dispatcher is None or not callbacks:
+            if self._metrics is not None and callbacks:
+                start = time.monotonic()
+                call(callbacks, arg)
+                self._metrics.observe('callback_duration', time.monotonic() - start)
+            else:
+                call(callbacks, arg)
+            if acks:
+                self._send_acks(acks)
+            return
+        if acks and self._options['ack_policy'] == 'before_dispatch':
+            self._send_acks(acks)
+            acks = ()
+        submitted = time.monotonic()
+
+        def on_done(future):
+            if self._metrics is not None:
+                # includes the time spent waiting for the executor
+                self._metrics.observe('callback_latency', time.monotonic() - submitted)
+            if acks and future.exception() is None:
+                self._send_acks(acks)
+
+        self._dispatcher.submit(key, call, (callbacks, arg), on_done)
+
+    def _send_acks(self, acks):
+        if len(acks) == 1:
+            self._send_packet(acks[0])
+        else:
+            self._write_many([ack.to_bytes() for ack in acks])
+
+    def _collect_message(self, packets, ack):
+        """add received messages to the batch of on_message_batch"""
+        batch = self._message_batch
+        if batch is None:
+            batch = self._message_batch = MessageBatch(self._payload_schemas)
+            batch.timer = self._timers.schedule(self._batch_max_delay, self._flush_message_batch, batch)
+        received = time.time()
+        if len(packets) == 1:
+            batch.append(packets[0])
+            batch.timestamps.append(received)
+        else:
+            batch.extend(packets)
+            batch.timestamps.extend([received] * len(packets))
+        if ack:
+            batch.acks.append(ack)
+        if len(batch) >= self._batch_max_items:
+            self._flush_message_batch(batch)
+
+    def _flush_message_batch(self, batch):
+        if batch is not self._message_batch:
+            return
+        self._message_batch = None
+        batch.timer.cancel()
+        # the timer holds a lock, the batch must pickle for a process pool callback_executor
+        acks, batch.acks, batch.timer = batch.acks, [], None
+        # batches have no topic, one key keeps them in order on callback_executor
+        self._run_callbacks(_call_callbacks, (self._on_message_batch,), batch, acks, None)
+
+    def _publish_now(self, topic, message, qos, retain, dup):
+        if self._must_hold():
+            self._hold(topic, message, qos, retain)
+            return
+        publish_packet = self._build_publish_packet(topic, message, qos, retain, dup)
+        self._write_or_hold(((topic, message, qos, retain),), self._send_publish, publish_packet)
+
+    def _publish_future_now(self, topic, message, qos, retain, future):
+        if self._must_hold():
+            raise ConnectionError('not connected, publish_future does not use the offline queue')
+        publish_packet = self._build_publish_packet(topic, message, qos, retain, future=future)
+        self._send_publish(publish_packet)
+        if not qos:
+            future.set_result(None)
+
+    def _publish_future_later(self, topic, message, qos, retain, future):
+        # queued by the rate limit, nobody else sees the error
+        try:
+            self._publish_future_now(topic, message, qos, retain, future)
+        except queue.Full:
+            raise
+        except Exception as e:
+            # a registered QoS 1/2 message is sent again after reconnecting
+            if not any(f is future for f in self._publish_futures.values()):
+                future.set_exception(e)
+
+    def _limit_publish(self, limiter, topic, func, args, before_wait=None):
+        """apply publish_rate_limit, return True if ``func(*args)`` was queued to run later
+
+        ``before_wait()`` is called before blocking for tokens.
+        """
+        if limiter.policy == 'reject':
+            if not limiter.try_acquire(topic):
+                raise queue.Full('rate limit of {} exceeded'.format(topic))
+            return False
+        bucket, delay = limiter.reserve(topic)
+        if bucket is None or delay <= 0 and not bucket.queued:
+            return False
+        if limiter.policy == 'block' and not bucket.queued and threading.current_thread() is not self._loop_thread:
+            if before_wait is not None:
+                before_wait()
+            time.sleep(delay)
+            return False
+        # the network thread never waits for tokens, and queued messages keep their order
+        self._defer(limiter, bucket, delay, func, args)
+        return True
+
+    def _limit_message(self, limiter, packet, ack):
+        """apply message_rate_limit, return True if the message was dropped or queued"""
+        if limiter.policy == 'reject':
+            if limiter.try_acquire(packet.topic):
+                return False
+            # dropped, the broker must not send it again
+            if ack:
+                self._send_packet(ack)
+            return True
+        bucket, delay = limiter.reserve(packet.topic)
+        if bucket is None or delay <= 0 and not bucket.queued:
+            return False
+        if limiter.policy == 'block' or len(bucket.queued) >= limiter.max_queued:
+            # the network thread stops reading meanwhile, so TCP pushes back on the broker
+            time.sleep(max(delay, 0))
+            self._release_limited(limiter, bucket)
+            return False
+        self._defer(limiter, bucket, delay, self._dispatch_message, (packet, ack, False))
+        return True
+
+    def _defer(self, limiter, bucket, delay, func, args):
+        if limiter.defer(bucket, delay, func, args):
+            self._timers.schedule(delay, self._release_limited, limiter, bucket)
+
+    def _release_limited(self, limiter, bucket):
+        """run the calls of ``bucket`` queued by a rate limit that are due"""
+        due, delay = limiter.pop_due(bucket)
+        for i, (func, args) in enumerate(due):
+            try:
+                func(*args)
+            except queue.Full:
+                # the in-flight window is full, try again on the next tick
+                limiter.push_back(bucket, due[i:])
+                delay = 0
+                break
+            except Exception as e:
+                logging.error("rate limited call occur error: %s", e)
+        if delay is not None:
+            self._timers.schedule(delay, self._release_limited, limiter, bucket)
+
+    def _connected(self):
+        """whether the connection is up as far as the network thread knows, a reconnect is up once delivery is
+        restored"""
+        return (not self._closing and self._disconnected_at is None and self._socket is not None
+                and self._socket.fileno() != -1)
+
+    def _must_hold(self):
+        """with offline_queue, whether a new message must wait in it: while disconnected, and behind the messages
+        already held"""
+        offline = self._offline_queue
+        return offline is not None and (len(offline) or not self._connected())
+
+    def _write_or_hold(self, messages, write, *args):
+        """``write(*args)``, with offline_queue the QoS 0 ones of ``messages`` are held if the write fails
+
+        QoS 1/2 messages are in flight before they are written and are sent again with the others after reconnecting.
+        """
+        try:
+            write(*args)
+        except OSError:
+            if self._offline_queue is None:
+                raise
+            for topic, message, qos, retain in messages:
+                if not qos:
+                    self._hold(topic, message, qos, retain)
+
+    def _hold(self, topic, message, qos, retain):
+        # the network thread must not wait for room it makes itself
+        self._offline_queue.put(topic, message or b'', qos, retain, threading.current_thread() is not self._loop_thread)
+        if self._connected():
+            self._wake_loop()
+
+    def _drain_offline(self):
+        """publish the messages held while disconnected, as many as the in-flight window has room for"""
+        offline = self._offline_queue
+        while len(offline) and self._connected():
+            room = self._max_inflight - len(self._packet_ids)
+            if room <= 0 or not offline.drain(self._publish_held, room):
+                return
+
+    def _publish_held(self, messages):
+        packets_bytes = []
+        for topic, message, qos, retain in messages:
+            publish_packet = self._build_publish_packet(topic, message, qos, retain)
+            logging.debug('send a packet: %s', publish_packet)
+            packets_bytes.append(publish_packet.to_bytes())
+        self._write_many(packets_bytes)
+
+    def _send_publish(self, packet):
+        if isinstance(packet.payload, StreamPayload):
+            self._write_stream(packet)
+        else:
+            self._send_packet(packet)
+
+    def _write_stream(self, packet):
+        logging.debug('send a packet: %s', packet)
+        payload = packet.payload
+        header = encode_header(packet.dup, packet.qos, packet.retain, packet.topic, packet.packet_id, len(payload))
+        if self._session_store is not None:
+            self._session_store.flush()
+        if self._metrics is not None:
+            self._metrics.count_packet('out', 3, len(header) + len(payload))
+        chunks = payload.chunks()
+        if self._capture is not None:
+            self._capture.sent(header)
+            chunks = self._captured_chunks(chunks)
+        try:
+            self._write_queue.write_stream(header, chunks)
+        except ValueError:
+            # the packet on the wire is incomplete, only a new connection gets out of it
+            if self._socket is not None:
+                try:
+                    self._socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            raise
+
+    def _captured_chunks(self, chunks):
+        for chunk in chunks:
+            self._capture.sent(chunk)
+            yield chunk
 
     def _send_packet(self, packet):
         """发送数据包"""
-        logging.debug('send a packet: {}'.format(packet))
-        packet_bytes = packet.to_bytes()
-        self._socket.sendall(packet_bytes)
-
-    def _recv_packet(self):
-        packet_bytes = bytearray()
-        # Read first byte
-        read_bytes = self._socket.recv(1)
-        self._check_recv_data(read_bytes)
-        first_byte = read_bytes[0]
-        packet_bytes.append(first_byte)
-        packet_type = first_byte >> 4
-        flags = first_byte & 0x0F
-
-        # Read second byte
-        read_bytes = self._socket.recv(1)
-        self._check_recv_data(read_bytes)
-        second_byte = read_bytes[0]
-        packet_bytes.append(second_byte)
-
-        remaining_length = second_byte & 0x7F
-        flag_bit = second_byte & 0x80
-        multiplier = 1
-        while True:
-            if flag_bit == 0:
-                break
-            read_bytes = self._socket.recv(1)
-            self._check_recv_data(read_bytes)
-            next_byte = read_bytes[0]
-            flag_bit = next_byte & 0x80
-            remaining_length += (next_byte & 0x7F) * multiplier
-
-        # Read remaining bytes
-        while remaining_length > 0:
-            read_bytes = self._socket.recv(min(4096, remaining_length))
-            remaining_length -= len(read_bytes)
-            packet_bytes.extend(read_bytes)
-        return packet_type, flags, packet_bytes, remaining_length
-
-    @staticmethod
-    def _check_recv_data(data):
-        if not data:
-            raise ConnectionError('connection is closed')
-
-    def _next_packet_id(self):
-        self._packet_id += 1
-        return self._packet_id
+        logging.debug('send a packet: %s', packet)
+        self._write(packet.to_bytes())
+
+    def _write(self, data):
+        if self._session_store is not None:
+            # the session state must reach the disk before the packets reach the broker
+            self._session_store.flush()
+        if self._metrics is not None:
+            self._metrics.count_packet('out', data[0] >> 4, len(data))
+        if self._capture is not None:
+            self._capture.sent(data)
+        if self._posting():
+            # the network thread writes it with the rest of its batch
+            self._write_queue.post(data)
+            self._wake_loop()
+        else:
+            self._write_queue.append(data)
+
+    def _write_many(self, datas):
+        if self._session_store is not None:
+            self._session_store.flush()
+        if self._metrics is not None:
+            for data in datas:
+                self._metrics.count_packet('out', data[0] >> 4, len(data))
+        if self._capture is not None:
+            for data in datas:
+                self._capture.sent(data)
+        if self._posting():
+            self._write_queue.post_many(datas)
+            self._wake_loop()
+        else:
+            self._write_queue.extend(datas)
+
+    def _posting(self):
+        """whether packets are handed to a running loop_forever on another thread"""
+        return (self._wakeup_w is not None and self._loop_thread is not None
+                and threading.current_thread() is not self._loop_thread)
+
+    def _wake_loop(self):
+        # one wakeup per batch: the loop clears the flag after draining the socketpair and before it takes the
+        # posted packets
+        if self._wakeup_sent or self._wakeup_w is None:
+            return
+        self._wakeup_sent = True
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _recv_packets(self):
+        """Wait for the socket until the next timer tick, read once and return all complete packets as
+        ``(packet_type, flags, packet_bytes)``
+        """
+        readable, _, _ = select.select([self._socket, self._wakeup_r], [], [], self._timers.next_timeout())
+        if self._wakeup_r in readable:
+            try:
+                while self._wakeup_r.recv(4096):
+                    pass
+            except OSError:
+                pass
+            # not before the drain: the byte of a packet posted in between would be drained with the flag still set,
+            # and no later post would wake the loop again
+            self._wakeup_sent = False
+        if self._socket not in readable:
+            return []
+        return self._decoder.recv_from(self._socket)
+
+    def _acquire_packet_id(self):
+        """allocate a packet id, waiting for room in the in-flight window"""
+        timeout = self._options['inflight_timeout']
+        if threading.current_thread() is self._loop_thread:
+            # acks are read by this thread, so waiting here would never end
+            timeout = 0
+        with self._inflight_cond:
+            if not self._inflight_cond.wait_for(self._has_inflight_room, timeout):
+                raise queue.Full('in-flight window is full')
+            return self._packet_ids.allocate()
+
+    def _release_packet_id(self, packet_id):
+        with self._inflight_cond:
+            self._packet_ids.release(packet_id)
+            self._inflight_cond.notify()
+
+    def _has_inflight_room(self):
+        return len(self._packet_ids) < self._max_inflight
+
+    def _publish_done(self, packet_id):
+        """a sent QoS 1/2 message is acknowledged"""
+        self._cancel_retry(packet_id)
+        if self._session_store is not None:
+            self._session_store.remove(packet_id)
+        if self._metrics is not None:
+            published = self._publish_times.pop(packet_id, None)
+            if published is not None:
+                self._metrics.observe('publish_ack_latency', time.monotonic() - published)
+        self._release_packet_id(packet_id)
+        future = self._publish_futures.pop(packet_id, None)
+        if future is not None:
+            future.set_result(packet_id)
+
+    def _reconnect_with_backoff(self):
+        """reconnect until it succeeds, return False if auto_reconnect is off or the client is closed"""
+        if self._disconnected_at is None and not self._closing:
+            self._disconnected_at = time.monotonic()
+        if not self._options['auto_reconnect'] or self._closing:
+            return False
+        attempt = 0
+        while not self._closing:
+            time.sleep(self._reconnect_delay(attempt))
+            try:
+                self.reconnect()
+                return True
+            except OSError as e:
+                logging.warning("reconnect failed: %s", e)
+                attempt += 1
+        return False
+
+    def _reconnect_delay(self, attempt):
+        delay = min(self._options['reconnect_delay_max'], self._options['reconnect_delay_min'] * 2 ** attempt)
+        # full jitter, so clients that lost the same broker do not come back in lockstep
+        return random.uniform(0, delay)
+
+    def _close_socket(self):
+        if self._socket is not None:
+            if self._multiplexer is not None:
+                self._multiplexer._unregister(self)
+            try:
+                # wakes up a recv blocked in another thread
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+    def _resend_inflight(self):
+        packets_bytes = []
+        streams = []
+        for packet_id in list(self._unack_packet):
+            packet = self._dup_publish(packet_id)
+            if isinstance(packet.payload, StreamPayload):
+                streams.append(packet)
+            else:
+                packets_bytes.append(packet.to_bytes())
+        for packet_id in list(self._unack_pubrel_ids):
+            packets_bytes.append(PubrelPacket(packet_id).to_bytes())
+        self._write_many(packets_bytes)
+        for packet in streams:
+            self._write_stream(packet)
+
+    def _dup_publish(self, packet_id):
+        """the unacknowledged PUBLISH of ``packet_id`` with DUP set"""
+        packet = self._unack_packet[packet_id]
+        if not packet.dup:
+            packet = PublishPacket(True, packet.qos, packet.retain, packet.topic, packet_id, packet.payload)
+            self._unack_packet[packet_id] = packet
+        return packet
+
+    def _schedule_ping(self):
+        for timer in (self._ping_timer, self._pingresp_timer):
+            if timer is not None:
+                timer.cancel()
+        self._pingresp_timer = None
+        interval = self._ping_interval()
+        self._ping_timer = self._timers.schedule(interval, self._ping) if interval else None
+
+    def _ping_interval(self):
+        interval = self._options['ping_interval']
+        if self._options['keepalive']:
+            interval = min(interval or self._options['keepalive'], self._options['keepalive'])
+        return interval
+
+    def _ping(self):
+        self._ping_timer = self._timers.schedule(self._ping_interval(), self._ping)
+        if self._pingresp_timer is None:
+            self._pingresp_timer = self._timers.schedule(self._options['ping_timeout'], self._ping_timed_out)
+        self._send_packet(PingreqPacket())
+
+    def _ping_timed_out(self):
+        self._pingresp_timer = None
+        logging.warning("no PINGRESP in %s seconds, the connection is dead", self._options['ping_timeout'])
+        if self._socket is not None:
+            # the read side sees the connection closed and reconnects
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _schedule_retry(self, packet_id):
+        if self._options['retry_interval']:
+            self._cancel_retry(packet_id)
+            self._retry_timers[packet_id] = self._timers.schedule(self._options['retry_interval'], self._retry,
+                                                                  packet_id)
+
+    def _cancel_retry(self, packet_id):
+        timer = self._retry_timers.pop(packet_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _retry(self, packet_id):
+        """resend a QoS 1/2 message that was not acknowledged in time"""
+        self._retry_timers.pop(packet_id, None)
+        if packet_id in self._unack_packet:
+            self._send_publish(self._dup_publish(packet_id))
+        elif packet_id in self._unack_pubrel_ids:
+            self._write(PubrelPacket(packet_id).to_bytes())
+        else:
+            return
+        self._schedule_retry(packet_id)
+
+    def _resubscribe(self):
+        # SUBACKs of the old connection will never come
+        for packet_id in self._unack_subscribe_ids:
+            self._release_packet_id(packet_id)
+        self._unack_subscribe_ids.clear()
+        self._resubscribe_ids.clear()
+        batch = []
+        length = 2
+        for topic, qos in list(self._subscriptions.items()):
+            item_length = 3 + len(topic.encode('utf-8'))
+            if batch and length + item_length > _max_resubscribe_length:
+                self._send_resubscribe(batch)
+                batch = []
+                length = 2
+            batch.extend((topic, qos))
+            length += item_length
+        if batch:
+            self._send_resubscribe(batch)
+
+    def _send_resubscribe(self, batch):
+        packet = SubscribePacket(self._acquire_packet_id(), *batch)
+        self._unack_subscribe_ids.add(packet.packet_id)
+        self._resubscribe_ids.add(packet.packet_id)
+        self._send_packet(packet)
+
+    def _delivery_restored(self):
+        if self._disconnected_at is None:
+            return
+        recovery_time = time.monotonic() - self._disconnected_at
+        self._disconnected_at = None
+        logging.info('delivery restored %.3fs after the connection was lost', recovery_time)
+        if self._metrics is not None:
+            self._metrics.observe('reconnect_recovery', recovery_time)
+
+    def _restore_session(self):
+        """resend the in-flight messages of the persistent session before any new traffic"""
+        state = self._session_store.load()
+        packets_bytes = []
+        for packet_id, packet_bytes in state.publishes.items():
+            # set DUP on the stored packet instead of encoding it again
+            packet_bytes = bytes((packet_bytes[0] | 0b00001000,)) + packet_bytes[1:]
+            self._packet_ids.reserve(packet_id)
+            self._unack_packet[packet_id] = PublishPacket.from_bytes(packet_bytes)
+            self._schedule_retry(packet_id)
+            packets_bytes.append(packet_bytes)
+        for packet_id in state.pubrels:
+            self._packet_ids.reserve(packet_id)
+            self._unack_pubrel_ids.add(packet_id)
+            self._schedule_retry(packet_id)
+            packets_bytes.append(PubrelPacket(packet_id).to_bytes())
+        self._unack_package_ids.update(state.inbound)
+        logging.info('restore session: %s publish, %s pubrel, %s inbound', len(state.publishes), len(state.pubrels),
+                     len(state.inbound))
+        self._write_many(packets_bytes)
+        self.flush()
+
+    def _register_gauges(self):
+        metrics = self._metrics
+        metrics.gauge('inflight', lambda: len(self._packet_ids))
+        metrics.gauge('packet_id_usage', lambda: len(self._packet_ids) / 0xFFFF)
+        metrics.gauge('unack_publish', lambda: len(self._unack_packet))
+        metrics.gauge('unack_pubrel', lambda: len(self._unack_pubrel_ids))
+        metrics.gauge('write_queue_buffers', lambda: len(self._write_queue) if self._write_queue else 0)
+        metrics.gauge('write_queue_bytes', lambda: self._write_queue.pending_bytes if self._write_queue else 0)
+        metrics.gauge('dispatch_pending', lambda: self._dispatcher.pending if self._dispatcher else 0)
+        metrics.gauge('offline_queue', lambda: len(self._offline_queue) if self._offline_queue is not None else 0)
+        metrics.gauge('publish_rate_queued', lambda: self._publish_limiter.queued if self._publish_limiter else 0)
+        metrics.gauge('message_rate_queued', lambda: self._message_limiter.queued if self._message_limiter else 0)
+
+
+class PreparedPublish:
+    """A publisher bound to one topic, see Client.prepare_publish"""
+
+    def __init__(self, client, template):
+        self._client = client
+        self._template = template
+
+    @property
+    def topic(self):
+        return self._template.topic
+
+    def publish(self, message: bytes):
+        self._client._publish_template(self._template, message)
@@ -0,0 +1,236 @@
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import wait
+
+from client import Client
+from util.common import random_str
+from util.hash_ring import HashRing
+from util.metrics import merge_snapshots
+
+
+def _worker_main(worker_id, client_args, options, subscriptions, handler, conn, metrics_interval):
+    """body of a worker process: one connection consuming its share of the topic filters"""
+    client = Client(*client_args, **dict(options, metrics=True))
+    client.on_message(handler)
+    client.connect()
+    if subscriptions:
+        _subscribe(client, subscriptions)
+    thread = threading.Thread(target=client.loop_forever, name='mqtt-worker-{}'.format(worker_id), daemon=True)
+    thread.start()
+    # whether the loop ended before the parent asked to stop
+    lost = False
+    try:
+        while True:
+            if not thread.is_alive():
+                lost = True
+                break
+            if conn.poll(metrics_interval):
+                command, arg = conn.recv()
+                if command == 'subscribe':
+                    _subscribe(client, arg)
+                elif command == 'stop':
+                    break
+            conn.send(('metrics', client.metrics.snapshot(buckets=True)))
+    except (EOFError, OSError):
+        # the parent is gone
+        pass
+    finally:
+        client.close()
+    thread.join(1)
+    if lost:
+        # the connection was lost for good, the parent moves the filters to the other workers
+        os._exit(1)
+
+
+def _subscribe(client, subscriptions):
+    items = []
+    for topic_filter, qos in subscriptions:
+        items.extend((topic_filter, qos))
+    client.subscribe(*items)
+
+
+class ConsumerPool:
+    """Consumes messages with ``workers`` processes, each with its own connection
+
+    The topic filters are split across the workers by consistent hashing. With ``share_group`` every worker
+    subscribes to every filter as ``$share/<share_group>/<filter>`` and the broker spreads the messages instead.
+    When a worker dies its filters move to the remaining workers, the other filters stay where they are::
+
+        pool = ConsumerPool('127.0.0.1', handler=handle, workers=8)
+        pool.subscribe('sensor/+/temperature', 1)
+        pool.subscribe('sensor/+/humidity', 1)
+        pool.start()
+        ...
+        print(pool.metrics())
+        pool.stop()
+
+    ``handler(packet)`` runs in the worker processes, it must be picklable unless the fork start method is used.
+    ``options`` are passed to every worker Client, whose metrics are combined by ``metrics()``.
+    """
+
+    def __init__(self, host, port=1883, handler=None, workers=None, share_group=None, client_id=None,
+                 username=None, password=None, metrics_interval=1, **options):
+        if handler is None:
+            raise ValueError('handler is required')
+        self._host = host
+        self._port = port
+        self._handler = handler
+        self._workers = workers or os.cpu_count() or 1
+        self._share_group = share_group
+        self._client_id = client_id or random_str(6)
+        self._username = username
+        self._password = password
+        self._metrics_interval = metrics_interval
+        self._options = options
+        # topic filter -> qos
+        self._subscriptions = {}
+        self._ring = HashRing()
+        # worker id -> (Process, Connection)
+        self._processes = {}
+        # worker id -> latest metrics snapshot
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._stopping = False
+
+    def subscribe(self, topic_filter: str, qos=0):
+        """add a topic filter, may be called before or after start()"""
+        with self._lock:
+            self._subscriptions[topic_filter] = qos
+            if not self._processes:
+                return
+            if self._share_group is None:
+                self._send(self._ring.get(topic_filter), 'subscribe', [(topic_filter, qos)])
+            else:
+                for worker_id in self._processes:
+                    self._send(worker_id, 'subscribe', [(self._shared(topic_filter), qos)])
+
+    def assignment(self):
+        """worker id -> list of the topic filters it consumes"""
+        with self._lock:
+            assignment = {worker_id: [] for worker_id in self._processes}
+            for topic_filter in self._subscriptions:
+                if self._share_group is None:
+                    worker_id = self._ring.get(topic_filter)
+                    if worker_id is not None:
+                        assignment[worker_id].append(topic_filter)
+                else:
+                    for topic_filters in assignment.values():
+                        topic_filters.append(topic_filter)
+            return assignment
+
+    def start(self):
+        self._stopping = False
+        with self._lock:
+            for worker_id in range(self._workers):
+                self._ring.add(worker_id)
+            for worker_id in range(self._workers):
+                self._spawn(worker_id)
+        self._monitor = threading.Thread(target=self._monitor_loop, name='mqtt-consumer-pool', daemon=True)
+        self._monitor.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        with self._lock:
+            processes = list(self._processes.values())
+            for worker_id in self._processes:
+                self._send(worker_id, 'stop', None)
+        for process, _ in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        with self._lock:
+            self._processes.clear()
+            self._ring = HashRing()
+
+    def metrics(self):
+        """the metrics of every worker combined, see util.metrics.merge_snapshots"""
+        with self._lock:
+            return merge_snapshots(list(self._snapshots.values()))
+
+    def __len__(self):
+        """number of live workers"""
+        return len(self._processes)
+
+    def _spawn(self, worker_id):
+        if self._share_group is None:
+            subscriptions = [(topic_filter, qos) for topic_filter, qos in self._subscriptions.items()
+                             if self._ring.get(topic_filter) == worker_id]
+        else:
+            subscriptions = [(self._shared(topic_filter), qos) for topic_filter, qos in self._subscriptions.items()]
+        client_args = (self._host, self._port, '{}-{}'.format(self._client_id, worker_id), self._username,
+                       self._password)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_worker_main, name='mqtt-consumer-{}'.format(worker_id),
+                                          args=(worker_id, client_args, self._options, subscriptions, self._handler,
+                                                child_conn, self._metrics_interval),
+                                          daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[worker_id] = (process, parent_conn)
+
+    def _shared(self, topic_filter):
+        return '$share/{}/{}'.format(self._share_group, topic_filter)
+
+    def _send(self, worker_id, command, arg):
+        try:
+            self._processes[worker_id][1].send((command, arg))
+        except (KeyError, OSError):
+            pass
+
+    def _monitor_loop(self):
+        while True:
+            with self._lock:
+                workers = {}
+                for worker_id, (process, conn) in self._processes.items():
+                    workers[process.sentinel] = worker_id
+                    workers[conn] = worker_id
+            if not workers:
+                return
+            for ready in wait(list(workers), self._metrics_interval):
+                worker_id = workers[ready]
+                if ready is self._processes.get(worker_id, (None, None))[1]:
+                    try:
+                        command, snapshot = ready.recv()
+                    except (EOFError, OSError):
+                        self._worker_died(worker_id)
+                        continue
+                    if command == 'metrics':
+                        with self._lock:
+                            self._snapshots[worker_id] = snapshot
+                else:
+                    self._worker_died(worker_id)
+
+    def _worker_died(self, worker_id):
+        with self._lock:
+            if worker_id not in self._processes:
+                return
+            process, conn = self._processes.pop(worker_id)
+            conn.close()
+            if worker_id in self._snapshots:
+                # keep its counters, its gauges are gone with it
+                self._snapshots[worker_id] = dict(self._snapshots[worker_id], gauges={})
+            if self._stopping:
+                return
+            logging.warning('consumer worker %s died with exit code %s', worker_id, process.exitcode)
+            if self._share_group is not None:
+                # the broker sends the messages to the workers left in the group
+                return
+            orphans = [topic_filter for topic_filter in self._subscriptions
+                       if self._ring.get(topic_filter) == worker_id]
+            self._ring.remove(worker_id)
+            if not self._processes:
+                logging.error('no consumer worker left for %s topic filters', len(orphans))
+                return
+            moved = {}
+            for topic_filter in orphans:
+                moved.setdefault(self._ring.get(topic_filter), []).append((topic_filter,
+                                                                           self._subscriptions[topic_filter]))
+            for new_worker_id, subscriptions in moved.items():
+                self._send(new_worker_id, 'subscribe', subscriptions)
@@ -0,0 +1,227 @@
+import logging
+import selectors
+import socket
+import threading
+import time
+
+from util.timer_wheel import TimerWheel
+
+
+class Multiplexer:
+    """Runs many Clients on one thread
+
+    Every added client connects with a non-blocking socket registered in one selector (epoll on Linux). Readable
+    sockets are read into one shared buffer and fed to the client's own frame decoder, writable sockets flush the
+    client's write queue, and the pings and retransmissions of all clients run on one timer wheel::
+
+        multiplexer = Multiplexer()
+        for client_id in client_ids:
+            client = Client('127.0.0.1', client_id=client_id, auto_reconnect=True)
+            multiplexer.add(client)
+            client.connect()
+        multiplexer.run_forever()
+
+    Clients keep the blocking API for publishing from other threads, their writes never block and whatever the
+    socket does not accept is written by the loop.
+    """
+
+    def __init__(self, timer_tick=0.1, recv_buffer_size=65536):
+        self._selector = selectors.DefaultSelector()
+        self._timers = TimerWheel(timer_tick)
+        self.recv_buffer = bytearray(recv_buffer_size)
+        self._clients = set()
+        # clients with queued bytes, flushed by the loop
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # reconnect attempts of clients whose connection was lost
+        self._attempts = {}
+        self._thread = None
+        self._running = False
+        # wakes up select when another thread queued bytes
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+    def __len__(self):
+        return len(self._clients)
+
+    @property
+    def timers(self):
+        """the TimerWheel shared by every client"""
+        return self._timers
+
+    def add(self, client):
+        """run ``client`` on this loop, call before ``client.connect()``"""
+        if client._socket is not None:
+            raise ValueError('client is already connected')
+        client._multiplexer = self
+        client._timers = self._timers
+        client._loop_thread = self._thread
+        self._clients.add(client)
+        return client
+
+    def remove(self, client):
+        """stop running ``client`` on this loop, the client keeps its connection state"""
+        self._unregister(client)
+        self._clients.discard(client)
+        self._attempts.pop(client, None)
+        with self._pending_lock:
+            self._pending.discard(client)
+        client._multiplexer = None
+        client._timers = TimerWheel(client._options['timer_tick'])
+        client._loop_thread = None
+
+    def run_forever(self):
+        """Run the loop until stop() is called"""
+        self._thread = threading.current_thread()
+        for client in self._clients:
+            client._loop_thread = self._thread
+        self._running = True
+        try:
+            while self._running:
+                self._run_once()
+        finally:
+            self._thread = None
+            for client in self._clients:
+                client._loop_thread = None
+
+    def stop(self):
+        """make run_forever return, may be called from any thread"""
+        self._running = False
+        self._wakeup()
+
+    def close(self):
+        """close every client and release the selector"""
+        self.stop()
+        for client in list(self._clients):
+            client.close()
+        self._clients.clear()
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def _run_once(self):
+        for key, events in self._selector.select(self._timers.next_timeout()):
+            client = key.data
+            if client is None:
+                self._drain_wakeup()
+                continue
+            if events & selectors.EVENT_READ and client._socket is key.fileobj:
+                self._on_readable(client)
+            # the read may have lost the connection
+            if events & selectors.EVENT_WRITE and client._socket is key.fileobj:
+                self._on_writable(client)
+        # pings and retransmissions that are due
+        self._timers.advance()
+        self._flush_pending()
+
+    def _on_readable(self, client):
+        try:
+            frames = client._decoder.recv_from(client._socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, ValueError) as e:
+            self._connection_lost(client, e)
+            return
+        # the connection is established once the broker talks
+        self._attempts.pop(client, None)
+        client._handle_frames(frames)
+
+    def _on_writable(self, client):
+        try:
+            done = client._write_queue.flush_nowait()
+        except OSError as e:
+            self._connection_lost(client, e)
+            return
+        if done:
+            self._modify(client, selectors.EVENT_READ)
+
+    def _flush_pending(self):
+        """write the bytes clients queued since the last round"""
+        with self._pending_lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = set()
+        for client in pending:
+            write_queue = client._write_queue
+            if client._socket is None or write_queue is None:
+                continue
+            if not write_queue.due():
+                # waiting for write_buffer_size or write_flush_interval
+                if len(write_queue):
+                    self._write_pending(client)
+                continue
+            try:
+                done = write_queue.flush_nowait()
+            except OSError as e:
+                self._connection_lost(client, e)
+                continue
+            if not done:
+                # the socket buffer is full, continue once it is writable
+                self._modify(client, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _write_pending(self, client):
+        """called by the write queue of ``client`` when bytes are left queued"""
+        with self._pending_lock:
+            if client in self._pending:
+                return
+            self._pending.add(client)
+        if threading.current_thread() is not self._thread:
+            self._wakeup()
+
+    def _register(self, client):
+        self._clients.add(client)
+        self._selector.register(client._socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+    def _unregister(self, client):
+        if client._socket is None:
+            return
+        try:
+            self._selector.unregister(client._socket)
+        except (KeyError, ValueError):
+            pass
+
+    def _modify(self, client, events):
+        try:
+            self._selector.modify(client._socket, events, client)
+        except (KeyError, ValueError):
+            pass
+
+    def _connection_lost(self, client, e):
+        self._unregister(client)
+        if client._closing:
+            return
+        logging.warning("%s", e)
+        client._close_socket()
+        client._socket = None
+        if not client._options['auto_reconnect']:
+            return
+        if client._disconnected_at is None:
+            client._disconnected_at = time.monotonic()
+        attempt = self._attempts.get(client, 0)
+        self._attempts[client] = attempt + 1
+        self._timers.schedule(client._reconnect_delay(attempt), self._reconnect, client)
+
+    def _reconnect(self, client):
+        if client._closing or client._multiplexer is not self:
+            return
+        try:
+            client.reconnect()
+        except OSError as e:
+            self._connection_lost(client, e)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            # the socket buffer is full, the loop is going to wake up anyway
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except OSError:
+            pass
@@ -0,0 +1,48 @@
+import struct
+
+# fixed header and packet id of PUBACK, PUBREC, PUBREL and PUBCOMP
+ack_struct = struct.Struct('>BBH')
+# packet ids and string lengths
+int16_struct = struct.Struct('>H')
+
+_pack_ack = ack_struct.pack
+_unpack_int16 = int16_struct.unpack_from
+
+
+def decode_packet_id(packet_bytes, offset=2):
+    return _unpack_int16(packet_bytes, offset)[0]
+
+
+def skip_remaining_length(packet_bytes):
+    """offset of the variable header"""
+    offset = 2
+    while packet_bytes[offset - 1] & 0x80:
+        offset += 1
+    return offset
+
+
+class AckPacket:
+    """Packet made of a fixed header and a packet id: PUBACK, PUBREC, PUBREL and PUBCOMP
+
+    Subclasses only set ``first_byte``.
+    """
+    __slots__ = ('_packet_id',)
+
+    first_byte = None
+
+    def __init__(self, packet_id: int):
+        self._packet_id = packet_id
+
+    @property
+    def packet_id(self):
+        return self._packet_id
+
+    def to_bytes(self):
+        return _pack_ack(self.first_byte, 2, self._packet_id)
+
+    @classmethod
+    def from_bytes(cls, packet_bytes):
+        return cls(_unpack_int16(packet_bytes, 2)[0])
+
+    def __str__(self):
+        return '{}(packet_id = {})'.format(type(self).__name__, self._packet_id)
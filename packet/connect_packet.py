@@ -3,6 +3,8 @@ from util.encode import encode_remaining_length, encode_string
 
 class ConnectPacket:
     """A connect packet"""
+    __slots__ = ('_client_id', '_username', '_password', '_keep_alive', '_will_topic', '_will_message',
+                 '_will_retain', '_will_qos', '_clean_session_flag')
 
     def __init__(self, client_id, username=None, password=None, keep_alive=300,
                  will_topic=None, will_message=None, will_retain=False, will_qos=0, clean_session_flag=True):
@@ -0,0 +1,12 @@
+_disconnect_bytes = bytes((0b11100000, 0))
+
+
+class DisconnectPacket:
+    __slots__ = ()
+
+    def to_bytes(self):
+        # fixed header only
+        return _disconnect_bytes
+
+    def __str__(self):
+        return 'DisconnectPacket()'
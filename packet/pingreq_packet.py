@@ -0,0 +1,12 @@
+_pingreq_bytes = bytes((0b11000000, 0))
+
+
+class PingreqPacket:
+    __slots__ = ()
+
+    def to_bytes(self):
+        # fixed header only
+        return _pingreq_bytes
+
+    def __str__(self):
+        return 'PingreqPacket()'
@@ -0,0 +1,9 @@
+class PingrespPacket:
+    __slots__ = ()
+
+    @staticmethod
+    def from_bytes(packet_bytes):
+        return PingrespPacket()
+
+    def __str__(self):
+        return 'PingrespPacket()'
@@ -1,15 +1,63 @@
-from util.decode import skip_remaining_length_byte
-from util.encode import encode_remaining_length, encode_string, encode_int16
-from util.scanner import Scanner
+from util.encode import encode_remaining_length
+from util.lru import LRUCache
+
+# encoded topics shared by PublishPacket.to_bytes and PublishTemplate
+_topic_cache = LRUCache(1024)
+
+
+def encode_topic(topic: str):
+    """utf-8 encoded topic with its 2 bytes length prefix, cached"""
+    encoded = _topic_cache.get(topic)
+    if encoded is None:
+        topic_bytes = topic.encode('utf-8')
+        encoded = len(topic_bytes).to_bytes(2, 'big') + topic_bytes
+        _topic_cache.put(topic, encoded)
+    return encoded
+
+
+def _first_byte(dup, qos, retain):
+    # packet type
+    first_byte = 0b00110000
+    # dup
+    if dup:
+        first_byte = first_byte | 0b00001000
+    # qos
+    first_byte = first_byte | (qos << 1)
+    # retain
+    if retain:
+        first_byte = first_byte | 1
+    return first_byte
+
+
+def _encode(first_byte, topic_bytes, qos, packet_id, payload):
+    length = len(topic_bytes) + len(payload)
+    if qos:
+        length += 2
+        return b''.join((first_byte, encode_remaining_length(length), topic_bytes, packet_id.to_bytes(2, 'big'),
+                         payload))
+    return b''.join((first_byte, encode_remaining_length(length), topic_bytes, payload))
+
+
+def encode_header(dup, qos, retain, topic, packet_id, payload_length):
+    """fixed and variable header of a PUBLISH whose payload is written separately"""
+    topic_bytes = encode_topic(topic)
+    length = len(topic_bytes) + payload_length
+    first_byte = bytes((_first_byte(dup, qos, retain),))
+    if qos:
+        return b''.join((first_byte, encode_remaining_length(length + 2), topic_bytes, packet_id.to_bytes(2, 'big')))
+    return b''.join((first_byte, encode_remaining_length(length), topic_bytes))
 
 
 class PublishPacket:
+    __slots__ = ('_dup', '_qos', '_retain', '_topic', '_topic_bytes', '_packet_id', '_payload')
 
     def __init__(self, dup: bool, qos: int, retain: bool, topic: str, packet_id: int, payload: bytes):
         self._dup = dup
         self._qos = qos
         self._retain = retain
         self._topic = topic
+        # utf-8 topic of a decoded packet, turned into str on first access of topic
+        self._topic_bytes = None
         self._packet_id = packet_id
         self._payload = payload
 
@@ -27,6 +75,8 @@ class PublishPacket:
 
     @property
     def topic(self):
+        if self._topic is None and self._topic_bytes is not None:
+            self._topic = str(self._topic_bytes, 'utf-8')
         return self._topic
 
     @property
@@ -38,74 +88,81 @@ class PublishPacket:
         return self._payload
 
     def to_bytes(self):
-        byte_array = bytearray()
-        # packet type
-        first_byte = 0b00110000
-        # dup
-        if self._dup:
-            first_byte = first_byte | 0b00111000
-        # qos
-        first_byte = first_byte | (self._qos << 1)
-        # retain
-        if self._retain:
-            first_byte = first_byte | 1
-        byte_array.append(first_byte)
-        # remaining length
-        remaining_length_bytes = self._cal_remaining_length_bytes()
-        byte_array.extend(remaining_length_bytes)
-        # topic
-        topic_bytes = encode_string(self._topic)
-        byte_array.extend(topic_bytes)
-        # packet id (when QoS = 1 or 2)
-        if not self._qos == 0:
-            packet_id_bytes = encode_int16(self._packet_id)
-            byte_array.extend(packet_id_bytes)
-        # payload
-        if self._payload:
-            byte_array.extend(self._payload)
-
-        return bytes(byte_array)
+        first_byte = bytes((_first_byte(self._dup, self._qos, self._retain),))
+        return _encode(first_byte, encode_topic(self.topic), self._qos, self._packet_id, self._payload or b'')
 
     @staticmethod
     def from_bytes(packet_bytes):
-        scanner = Scanner(packet_bytes)
-        # skip packet type
-        scanner.skip_bits(4)
-        # dup
-        dup = scanner.next_bits()
-        # qos
-        qos = scanner.next_bits(2)
-        # retain
-        retain = bool(scanner.next_bits())
+        """Decode a PUBLISH packet without copying
+
+        The topic is decoded lazily and the payload is a memoryview over ``packet_bytes``.
+        """
+        view = memoryview(packet_bytes)
+        first_byte = view[0]
+        dup = bool(first_byte & 0b00001000)
+        qos = (first_byte >> 1) & 0b11
+        retain = bool(first_byte & 1)
         # skip Remaining Length
-        skip_remaining_length_byte(scanner)
-        # topic name length
-        topic_length = scanner.next_bytes(2)
+        offset = 2
+        while view[offset - 1] & 0x80:
+            offset += 1
         # topic name
-        topic_bytes = bytearray()
-        for i in range(topic_length):
-            topic_bytes.append(scanner.next_bytes())
-        topic = bytes(topic_bytes).decode('utf-8')
-        # packet id
+        topic_length = (view[offset] << 8) | view[offset + 1]
+        offset += 2
+        topic_bytes = view[offset:offset + topic_length]
+        offset += topic_length
+        # packet id (when QoS = 1 or 2)
         packet_id = None
         if not qos == 0:
-            packet_id = scanner.next_bytes(2)
-        payload = scanner.remains_bytes()
-        return PublishPacket(dup, qos, retain, topic, packet_id, payload)
+            packet_id = (view[offset] << 8) | view[offset + 1]
+            offset += 2
+        packet = PublishPacket(dup, qos, retain, None, packet_id, view[offset:])
+        packet._topic_bytes = topic_bytes
+        return packet
+
+    def __reduce__(self):
+        # a decoded payload is a memoryview, pickle a copy of it (e.g. for a process pool)
+        return PublishPacket, (self._dup, self._qos, self._retain, self.topic, self._packet_id,
+                               None if self._payload is None else bytes(self._payload))
 
     def __str__(self):
+        payload = self._payload
+        if payload is None or isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = bytes(payload or b'')
         return 'PublishPacket(dup = {}, qos = {}, retain = {}, topic= {}, packet_id = {}, payload = {})' \
-            .format(self._dup, self._qos, self._retain, self._topic, self._packet_id, self._payload)
+            .format(self._dup, self._qos, self._retain, self.topic, self._packet_id, payload)
 
-    def _cal_remaining_length_bytes(self):
-        # topic length
-        length = 2
-        # topic
-        length += len(bytes(self._topic, 'utf8'))
-        # packet id (when QoS = 1 or 2)
-        if not self._qos == 0:
-            length = length + 2
-        # payload
-        if self._payload:
-            length = length + len(self._payload)
-        return encode_remaining_length(length)
+
+class PublishTemplate:
+    """PUBLISH header for one topic, qos and retain, encoded once
+
+    Only remaining length, packet id and payload are filled in by ``to_bytes``.
+    """
+    __slots__ = ('_topic', '_qos', '_retain', '_first_byte', '_dup_first_byte', '_topic_bytes')
+
+    def __init__(self, topic: str, qos: int = 0, retain: bool = False):
+        self._topic = topic
+        self._qos = qos
+        self._retain = retain
+        self._first_byte = bytes((_first_byte(False, qos, retain),))
+        self._dup_first_byte = bytes((_first_byte(True, qos, retain),))
+        self._topic_bytes = encode_topic(topic)
+
+    @property
+    def topic(self):
+        return self._topic
+
+    @property
+    def qos(self):
+        return self._qos
+
+    @property
+    def retain(self):
+        return self._retain
+
+    def to_bytes(self, packet_id, payload, dup=False):
+        first_byte = self._dup_first_byte if dup else self._first_byte
+        return _encode(first_byte, self._topic_bytes, self._qos, packet_id, payload or b'')
+
+    def __str__(self):
+        return 'PublishTemplate(topic = {}, qos = {}, retain = {})'.format(self._topic, self._qos, self._retain)
@@ -1,7 +1,8 @@
-from util.scanner import Scanner
+from packet.codec import decode_packet_id, skip_remaining_length
 
 
 class SubackPacket:
+    __slots__ = ('_packet_id', '_return_codes')
 
     def __init__(self, packet_id, return_codes):
         self._packet_id = packet_id
@@ -17,18 +18,9 @@ class SubackPacket:
 
     @staticmethod
     def from_bytes(packet_bytes):
-        scanner = Scanner(packet_bytes)
-        # 跳过固定头部第1个字节
-        scanner.skip_bytes(1)
-        # Remaining Length
-        remaining_length = scanner.next_bytes()
-        # packet_id
-        packet_id = scanner.next_bytes(2)
-        # return code array
-        return_codes = []
-        for _ in range(remaining_length - 2):
-            return_codes.append(scanner.next_bytes())
-        return SubackPacket(packet_id, return_codes)
+        offset = skip_remaining_length(packet_bytes)
+        # packet_id, then one return code per topic
+        return SubackPacket(decode_packet_id(packet_bytes, offset), list(packet_bytes[offset + 2:]))
 
     def __str__(self):
         return 'SubackPacket(packet_id = {}, return_codes = {})'.format(self._packet_id, self._return_codes)
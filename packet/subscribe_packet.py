@@ -1,11 +1,11 @@
-from util.encode import encode_remaining_length, encode_int16
+from packet.codec import int16_struct
+from util.encode import encode_remaining_length
 
 
 class SubscribePacket:
+    __slots__ = ('_packet_id', '_items')
 
     def __init__(self, packet_id: int, topic: str, qos: int, *others_topic_qos):
-        if packet_id > 0xFFFF:
-            packet_id = packet_id % 0xFFFF
         self._packet_id = packet_id
         self._items = [(topic, qos)]
         if len(others_topic_qos) % 2 != 0:
@@ -13,6 +13,14 @@ class SubscribePacket:
         for i in range(0, len(others_topic_qos) // 2):
             self._items.append((others_topic_qos[i * 2], others_topic_qos[i * 2 + 1]))
 
+    @property
+    def packet_id(self):
+        return self._packet_id
+
+    @property
+    def items(self):
+        return list(self._items)
+
     def to_bytes(self):
         byte_array = bytearray()
         # Packet type and Reserved
@@ -20,7 +28,7 @@ class SubscribePacket:
         # Remaining Length
         byte_array.extend(self._cal_remaining_length_bytes())
         # Packet Identifier MSB, LSB
-        byte_array.extend(encode_int16(self._packet_id))
+        byte_array.extend(int16_struct.pack(self._packet_id))
         # payload
         byte_array.extend(self._cal_payload_bytes())
         return bytes(byte_array)
@@ -37,12 +45,14 @@ class SubscribePacket:
     def _cal_payload_bytes(self):
         byte_array = bytearray()
         for topic_qos in self._items:
-            topic_length = len(bytes(topic_qos[0], 'utf-8'))
-            topic_length_bytes = encode_int16(topic_length)
+            topic_bytes = bytes(topic_qos[0], 'utf-8')
             # Length MSB, LSB
-            byte_array.extend(topic_length_bytes)
+            byte_array.extend(int16_struct.pack(len(topic_bytes)))
             # Topic
-            byte_array.extend(bytes(topic_qos[0], 'utf-8'))
+            byte_array.extend(topic_bytes)
             # QoS
             byte_array.append(topic_qos[1])
         return bytes(byte_array)
+
+    def __str__(self):
+        return 'SubscribePacket(packet_id = {}, items = {})'.format(self._packet_id, self._items)
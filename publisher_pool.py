@@ -0,0 +1,151 @@
+import itertools
+import logging
+import threading
+import zlib
+
+from client import Client
+from util.common import random_str
+
+_strategies = ('round_robin', 'least_inflight', 'topic_hash')
+
+
+class PublisherPool:
+    """Publishes through ``size`` Client connections
+
+    ``strategy`` picks the connection of each message:
+
+    * ``round_robin``: one after the other
+    * ``least_inflight``: the one with the fewest unacknowledged messages
+    * ``topic_hash``: by topic, so the messages of one topic keep their order
+
+    ``publish`` returns a concurrent.futures.Future for every message, whatever connection carries it::
+
+        pool = PublisherPool('127.0.0.1', size=4, strategy='topic_hash', keepalive=30)
+        pool.start()
+        futures = [pool.publish('sensor/{}'.format(i % 10), b'1', 1) for i in range(1000)]
+        concurrent.futures.wait(futures)
+        pool.close()
+
+    ``options`` are passed to every Client. A member whose network loop has ended is replaced by a new connection
+    before its next message, and its unacknowledged messages are published again on the new one. Messages the
+    broker has already received (PUBREC) count as delivered.
+    """
+
+    def __init__(self, host, port=1883, size=4, strategy='round_robin', client_id=None, username=None,
+                 password=None, **options):
+        if strategy not in _strategies:
+            raise ValueError('strategy must be one of {}'.format(_strategies))
+        self._host = host
+        self._port = port
+        self._size = size
+        self._strategy = strategy
+        self._client_id = client_id or random_str(6)
+        self._username = username
+        self._password = password
+        self._options = options
+        self._clients = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._clients)
+
+    @property
+    def clients(self):
+        return list(self._clients)
+
+    def start(self):
+        """connect every member"""
+        self._closed = False
+        self._clients = [self._connect(index) for index in range(self._size)]
+        return self
+
+    def publish(self, topic: str, message: bytes, qos: int = 0, retain: bool = False):
+        """publish through one member, return a Future resolved once the message is acknowledged"""
+        index = self._pick(topic)
+        for _ in range(self._size):
+            client = self._member(index)
+            if client is not None:
+                try:
+                    return client.publish_future(topic, message, qos, retain)
+                except OSError as e:
+                    logging.warning('publisher %s failed: %s', index, e)
+            if self._strategy == 'topic_hash':
+                # another member would break the order of the topic
+                break
+            index = (index + 1) % self._size
+        raise ConnectionError('no publisher connection available')
+
+    def flush(self):
+        for client in self._clients:
+            client.flush()
+
+    def close(self):
+        self._closed = True
+        for client in self._clients:
+            client.close()
+
+    def _pick(self, topic):
+        if self._strategy == 'round_robin':
+            return next(self._counter) % self._size
+        if self._strategy == 'least_inflight':
+            clients = self._clients
+            return min(range(len(clients)), key=lambda i: len(clients[i]._packet_ids))
+        return zlib.crc32(topic.encode('utf-8')) % self._size
+
+    def _member(self, index):
+        """the client at ``index``, replaced first if its network loop has ended"""
+        client = self._clients[index]
+        if self._alive(client) or self._closed:
+            return client
+        with self._lock:
+            client = self._clients[index]
+            if self._alive(client):
+                return client
+            logging.warning('publisher %s is down, replacing it', index)
+            try:
+                new_client = self._connect(index)
+            except OSError as e:
+                logging.warning('publisher %s reconnect failed: %s', index, e)
+                return None
+            self._migrate(client, new_client)
+            self._clients[index] = new_client
+            return new_client
+
+    def _connect(self, index):
+        client = Client(self._host, self._port, '{}-{}'.format(self._client_id, index), self._username,
+                        self._password, **self._options)
+        client.connect()
+        client.loop_start()
+        return client
+
+    @staticmethod
+    def _alive(client):
+        thread = client._background_thread
+        return thread is not None and thread.is_alive()
+
+    @staticmethod
+    def _migrate(old, new):
+        """publish the unacknowledged messages of ``old`` on ``new``, chaining their futures"""
+        futures, old._publish_futures = old._publish_futures, {}
+        for packet_id in list(old._unack_packet):
+            packet = old._unack_packet.pop(packet_id)
+            future = futures.pop(packet_id, None)
+            new_future = new.publish_future(packet.topic, bytes(packet.payload), packet.qos, packet.retain)
+            if future is not None:
+                new_future.add_done_callback(lambda f, future=future: _copy_result(f, future))
+        # the broker already has them
+        for packet_id in old._unack_pubrel_ids:
+            future = futures.pop(packet_id, None)
+            if future is not None:
+                future.set_result(packet_id)
+        old._unack_pubrel_ids.clear()
+        old.close()
+
+
+def _copy_result(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,161 @@
+"""Replay of capture logs
+
+Feeds the packets read by a Client, recorded with its ``capture`` option, through the frame decoder, the packet
+decoders and the callbacks of a Client again, without a socket: as fast as possible to measure the receive path, or
+at the original timing (``--speed 1``, ``--speed 10`` for ten times faster). Run from the repository root::
+
+    python -m replay capture.log                            # replay at full speed, print the throughput
+    python -m replay capture.log --speed 1 --setup app:setup  # app.setup(client) registers the callbacks first
+    python -m replay capture.log --summary                  # count the packets of each type and direction
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+
+from client import Client
+from util.capture import CaptureReader, RECEIVED, SENT
+from util.frame_decoder import FrameDecoder, PUBLISH_HEAD
+from util.write_queue import WriteQueue
+
+_packet_names = {
+    1: 'CONNECT', 2: 'CONNACK', 3: 'PUBLISH', 4: 'PUBACK', 5: 'PUBREC', 6: 'PUBREL', 7: 'PUBCOMP',
+    8: 'SUBSCRIBE', 9: 'SUBACK', 10: 'UNSUBSCRIBE', 11: 'UNSUBACK', 12: 'PINGREQ', 13: 'PINGRESP',
+    14: 'DISCONNECT',
+}
+
+
+class _NullSocket:
+    """accepts every write, the packets the client sends back while replaying are only counted"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def send(self, data):
+        self.bytes += len(data)
+        return len(data)
+
+    def sendmsg(self, buffers):
+        n = sum(len(buffer) for buffer in buffers)
+        self.bytes += n
+        return n
+
+
+class Replayer:
+    """Feeds the RECEIVED records of a capture log to ``client`` as if they were read from its socket
+
+    The client is not connected: its callbacks run as in loop_forever, one read at a time followed by its timers,
+    and what it sends back (acks, publishes of the callbacks) is discarded::
+
+        client = Client('127.0.0.1')
+        client.on_message(handle)
+        stats = Replayer('capture.log', client).run()
+    """
+
+    def __init__(self, path, client=None):
+        self._reader = CaptureReader(path)
+        self.client = client if client is not None else Client('replay')
+
+    def run(self, speed=None):
+        """replay the log once, ``speed`` times the original pace or as fast as possible if None, return stats"""
+        client = self.client
+        # QoS 2 ids of the previous run would make its messages duplicates
+        client._unack_package_ids.clear()
+        client._decoder = FrameDecoder(client._options['recv_buffer_size'])
+        if client._on_message_stream is not None:
+            client._decoder.stream_threshold = client._options['stream_threshold']
+        sink = _NullSocket()
+        client._write_queue = WriteQueue(sink)
+        feed = client._decoder.feed
+        records = received = frames = publishes = 0
+        start = time.monotonic()
+        for direction, timestamp, data in self._reader:
+            if direction != RECEIVED:
+                continue
+            if speed:
+                delay = start + timestamp / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            records += 1
+            received += len(data)
+            batch = feed(data)
+            frames += len(batch)
+            publishes += sum(1 for packet_type, _, _ in batch if packet_type == 3 or packet_type == PUBLISH_HEAD)
+            client._handle_frames(batch)
+            client._timers.advance()
+            client.flush()
+        if client._message_batch is not None:
+            client._flush_message_batch(client._message_batch)
+        if client._dispatcher is not None:
+            # callbacks still running on the callback_executor
+            while client._dispatcher.pending:
+                time.sleep(0.001)
+        client.flush()
+        seconds = time.monotonic() - start
+        return {
+            'records': records,
+            'bytes': received,
+            'frames': frames,
+            'publishes': publishes,
+            'sent_bytes': sink.bytes,
+            'seconds': seconds,
+            'frames_per_second': frames / seconds if seconds else 0.0,
+            'publishes_per_second': publishes / seconds if seconds else 0.0,
+            'mb_per_second': received / seconds / (1 << 20) if seconds else 0.0,
+        }
+
+
+def summarize(path):
+    """the number of packets of each type read and sent in a capture log and its duration"""
+    reader = CaptureReader(path)
+    decoders = {RECEIVED: FrameDecoder(), SENT: FrameDecoder()}
+    counts = {RECEIVED: {}, SENT: {}}
+    duration = 0.0
+    for direction, timestamp, data in reader:
+        duration = timestamp
+        for packet_type, _, _ in decoders[direction].feed(data):
+            name = _packet_names.get(packet_type, str(packet_type))
+            counts[direction][name] = counts[direction].get(name, 0) + 1
+    return {
+        'start_time': reader.start_time,
+        'duration': duration,
+        'received': counts[RECEIVED],
+        'sent': counts[SENT],
+    }
+
+
+def _load(spec):
+    """the function named by ``module:function``"""
+    module_name, _, func_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='capture log written by the capture option of Client')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='times the original pace, 0 replays as fast as possible (default)')
+    parser.add_argument('--setup', metavar='MODULE:FUNCTION',
+                        help='called with the Client before replaying, to register its callbacks')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the log this many times')
+    parser.add_argument('--summary', action='store_true', help='only count the packets of the log')
+    args = parser.parse_args(argv)
+
+    if args.summary:
+        json.dump(summarize(args.path), sys.stdout, indent=2)
+        print()
+        return 0
+    replayer = Replayer(args.path)
+    if args.setup:
+        _load(args.setup)(replayer.client)
+    for _ in range(args.repeat):
+        stats = replayer.run(args.speed or None)
+        print('{records} reads, {frames} frames, {publishes} publishes in {seconds:.3f}s: '
+              '{frames_per_second:,.0f} frames/s, {publishes_per_second:,.0f} publishes/s, '
+              '{mb_per_second:.1f} MB/s'.format(**stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+
+from async_client import AsyncClient
+from packet.pingreq_packet import PingreqPacket
+from packet.puback_packet import PubackPacket
+from packet.pubcomp_packet import PubcompPacket
+from packet.publish_packet import PublishPacket
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from util.frame_decoder import FrameDecoder
+
+
+class _Writer:
+    """collects what the client writes like an asyncio.StreamWriter"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    def packets(self):
+        packets = [packet_bytes for _, _, packet_bytes in FrameDecoder().feed(bytes(self.data))]
+        self.data.clear()
+        return packets
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+    """the client is fed packets without a connection"""
+
+    def setUp(self):
+        self.client = AsyncClient('127.0.0.1')
+        self.writer = self.client._writer = _Writer()
+
+    async def _feed(self, packet):
+        data = packet if isinstance(packet, bytes) else packet.to_bytes()
+        await self.client._handle_packet(data[0] >> 4, data)
+
+    async def test_publish_futures(self):
+        qos0 = self.client.publish('t', b'0')
+        qos1 = self.client.publish('t', b'1', 1)
+        qos2 = self.client.publish('t', b'2', 2)
+        self.assertIsNone(await qos0)
+        sent = [PublishPacket.from_bytes(data) for data in self.writer.packets()]
+        self.assertEqual([(p.qos, p.payload) for p in sent], [(0, b'0'), (1, b'1'), (2, b'2')])
+        await self._feed(PubackPacket(sent[1].packet_id))
+        self.assertIsInstance(await qos1, PubackPacket)
+        await self._feed(PubrecPacket(sent[2].packet_id))
+        self.assertEqual(self.writer.packets(), [PubrelPacket(sent[2].packet_id).to_bytes()])
+        self.assertFalse(qos2.done())
+        await self._feed(PubcompPacket(sent[2].packet_id))
+        self.assertIsInstance(await qos2, PubcompPacket)
+
+    async def test_stray_ack_keeps_the_packet_id(self):
+        subscribe = self.client.subscribe('a')
+        packet_id = int.from_bytes(self.writer.packets()[0][2:4], 'big')
+        # an ack of the wrong kind, or one repeated by the broker
+        await self._feed(PubackPacket(packet_id))
+        await self._feed(PubcompPacket(packet_id))
+        self.assertFalse(subscribe.done())
+        publish = self.client.publish('t', b'1', 1)
+        self.assertNotEqual(PublishPacket.from_bytes(self.writer.packets()[0]).packet_id, packet_id)
+        self.assertFalse(publish.done())
+
+    async def test_subscribe_future(self):
+        future = self.client.subscribe('a/#', 1, 'b', 2)
+        packet_id = int.from_bytes(self.writer.packets()[0][2:4], 'big')
+        await self._feed(b'\x90\x04' + packet_id.to_bytes(2, 'big') + b'\x01\x02')
+        suback = await future
+        self.assertEqual((suback.packet_id, suback.return_codes), (packet_id, [1, 2]))
+
+    async def test_received_messages(self):
+        await self._feed(PublishPacket(False, 1, False, 'a', 3, b'x'))
+        await self._feed(PublishPacket(False, 2, False, 'b', 4, b'y'))
+        self.assertEqual(self.writer.packets(), [PubackPacket(3).to_bytes(), PubrecPacket(4).to_bytes()])
+        await self._feed(PubrelPacket(4))
+        self.assertEqual(self.writer.packets(), [PubcompPacket(4).to_bytes()])
+        self.client._connection_lost(ConnectionError('connection is closed'))
+        self.assertEqual([(m.topic, m.payload) async for m in self.client.messages()], [('a', b'x'), ('b', b'y')])
+
+    async def test_duplicate_qos2_message(self):
+        await self._feed(PublishPacket(False, 2, False, 'a', 5, b'x'))
+        await self._feed(PublishPacket(True, 2, False, 'a', 5, b'x'))
+        self.assertEqual(self.writer.packets(), [PubrecPacket(5).to_bytes(), PubrecPacket(5).to_bytes()])
+        # the id is free again once PUBREL arrived
+        await self._feed(PubrelPacket(5))
+        await self._feed(PublishPacket(False, 2, False, 'a', 5, b'y'))
+        self.client._connection_lost(ConnectionError('connection is closed'))
+        self.assertEqual([bytes(m.payload) async for m in self.client.messages()], [b'x', b'y'])
+
+    async def test_connection_lost_fails_pending_requests(self):
+        publish = self.client.publish('t', b'1', 1)
+        subscribe = self.client.subscribe('t')
+        self.client._connection_lost(ConnectionError('connection is closed'))
+        for future in (publish, subscribe):
+            with self.assertRaises(ConnectionError):
+                await future
+
+
+    async def test_pings(self):
+        self.client = AsyncClient('127.0.0.1', ping_interval=0.01, ping_timeout=0.05)
+        self.writer = self.client._writer = _Writer()
+        ping = asyncio.ensure_future(self.client._ping_loop(self.client._ping_interval()))
+        for _ in range(2):
+            while not self.writer.data:
+                await asyncio.sleep(0.005)
+            self.assertEqual(self.writer.packets(), [PingreqPacket().to_bytes()])
+            await self._feed(b'\xd0\x00')
+        # no PINGRESP, the connection is closed
+        await asyncio.wait_for(ping, 1)
+        self.assertEqual(self.writer.packets(), [PingreqPacket().to_bytes()])
+        self.assertTrue(self.writer.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
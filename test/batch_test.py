@@ -0,0 +1,69 @@
+import unittest
+
+from util.batch import BatchPublisher, pack_envelope, unpack_envelope
+
+
+class _Timer:
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EnvelopeTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        messages = [b'', b'a', b'x' * 200, b'y' * 70000]
+        self.assertEqual([bytes(m) for m in unpack_envelope(pack_envelope(messages))], messages)
+
+    def test_not_an_envelope(self):
+        for payload in (b'', b'plain', b'\xfe', b'\xfe\xba', b'\xfe\xba\x05ab', b'\xfe\xba\xff\xff\xff\xff\x01'):
+            self.assertIsNone(unpack_envelope(payload))
+
+
+class BatchPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.published = []
+        self.timers = []
+        self.batch = BatchPublisher(lambda topic, payload: self.published.append((topic, payload)), self._schedule,
+                                    max_items=3, max_delay=0.05, max_bytes=100)
+
+    def _schedule(self, delay, callback, *args):
+        timer = _Timer(callback, args)
+        self.timers.append(timer)
+        return timer
+
+    def _messages(self, index):
+        topic, payload = self.published[index]
+        return topic, [bytes(m) for m in unpack_envelope(payload)]
+
+    def test_max_items(self):
+        for i in range(4):
+            self.batch.publish('t', b'%d' % i)
+        self.assertEqual(self._messages(0), ('t', [b'0', b'1', b'2']))
+        self.assertTrue(self.timers[0].cancelled)
+        self.assertEqual(len(self.batch), 1)
+
+    def test_max_bytes(self):
+        self.batch.publish('t', b'a' * 60)
+        self.batch.publish('t', b'b' * 60)
+        self.assertEqual(self._messages(0), ('t', [b'a' * 60]))
+
+    def test_max_delay(self):
+        self.batch.publish('t', b'1')
+        self.batch.publish('u', b'2')
+        timer = self.timers[0]
+        timer.callback(*timer.args)
+        self.assertEqual(self._messages(0), ('t', [b'1']))
+        self.batch.flush()
+        self.assertEqual(self._messages(1), ('u', [b'2']))
+        self.assertEqual((self.batch.batches, self.batch.messages), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
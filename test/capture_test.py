@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from util.capture import CaptureReader, CaptureWriter, RECEIVED, SENT
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'capture.log')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self):
+        writer = CaptureWriter(self.path)
+        writer.sent(b'\x10\x00')
+        writer.received(memoryview(b'\x20\x02\x00\x00'))
+        writer.received(b'')
+        writer.close()
+        # records after close are ignored
+        writer.sent(b'late')
+        return writer
+
+    def test_round_trip(self):
+        writer = self._write()
+        self.assertEqual((writer.records, writer.bytes), (3, 6))
+        reader = CaptureReader(self.path)
+        records = [(direction, bytes(data)) for direction, _, data in reader]
+        self.assertEqual(records, [(SENT, b'\x10\x00'), (RECEIVED, b'\x20\x02\x00\x00'), (RECEIVED, b'')])
+        timestamps = [timestamp for _, timestamp, _ in reader]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertGreater(reader.start_time, 0)
+        self.assertEqual(reader.duration(), timestamps[-1])
+
+    def test_torn_record_ends_the_log(self):
+        self._write()
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        self.assertEqual(len(list(CaptureReader(self.path))), 2)
+
+    def test_not_a_capture_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 32)
+        with self.assertRaises(ValueError):
+            CaptureReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
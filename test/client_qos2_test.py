@@ -0,0 +1,76 @@
+import unittest
+
+from client import Client
+from packet.publish_packet import PublishPacket
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from util.frame_decoder import FrameDecoder
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(self.send(buffer) for buffer in buffers)
+
+
+class _Sink:
+
+    def __init__(self, received):
+        self._received = received
+        self._data = b''
+
+    def write(self, chunk):
+        self._data += chunk
+
+    def close(self):
+        self._received.append(self._data)
+
+
+class InboundQos2Test(unittest.TestCase):
+    """the client is fed frames without a socket, as by replay.py"""
+
+    def _client(self, stream):
+        client = Client('127.0.0.1', stream_threshold=50)
+        self.received = []
+        client.on_message(lambda packet: self.received.append(packet.payload))
+        if stream:
+            client.on_message_stream(lambda packet, length: _Sink(self.received))
+        self.sock = _Socket()
+        client._write_queue = WriteQueue(self.sock)
+        client._decoder = FrameDecoder(stream_threshold=50 if stream else None)
+        return client
+
+    def _feed(self, client, data):
+        client._handle_frames(client._decoder.feed(data))
+        client.flush()
+
+    def _check_duplicate_is_acknowledged_once_dispatched(self, stream):
+        client = self._client(stream)
+        payload = b'x' * 100
+        self._feed(client, PublishPacket(False, 2, False, 't', 7, payload).to_bytes())
+        self._feed(client, PublishPacket(True, 2, False, 't', 7, payload).to_bytes())
+        self.assertEqual(self.received, [payload])
+        pubrec = PubrecPacket(7).to_bytes()
+        self.assertEqual(bytes(self.sock.data), pubrec + pubrec)
+        # the id is free again once PUBREL arrived
+        self._feed(client, PubrelPacket(7).to_bytes())
+        self._feed(client, PublishPacket(False, 2, False, 't', 7, payload).to_bytes())
+        self.assertEqual(self.received, [payload, payload])
+
+    def test_duplicate_publish(self):
+        self._check_duplicate_is_acknowledged_once_dispatched(False)
+
+    def test_duplicate_streamed_publish(self):
+        self._check_duplicate_is_acknowledged_once_dispatched(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
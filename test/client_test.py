@@ -1,7 +1,10 @@
 import logging
+import sys
 
 from client import Client
 
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', stream=sys.stdout, level=logging.DEBUG)
+
 mqtt_client = Client('127.0.0.1', username='derker', password='123456')
 
 
@@ -0,0 +1,80 @@
+import pickle
+import struct
+import unittest
+
+from packet.publish_packet import PublishPacket
+from util.columnar import MessageBatch, PayloadSchema, schema_router
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PayloadSchemaTest(unittest.TestCase):
+
+    def _check(self, fmt, fields, rows):
+        schema = PayloadSchema(fmt, fields)
+        columns = schema.decode([struct.pack(fmt, *row) for row in rows])
+        self.assertEqual({field: list(column) for field, column in columns.items()},
+                         {field: [row[i] for row in rows] for i, field in enumerate(schema.fields)})
+        if numpy is not None:
+            columns = schema.decode([struct.pack(fmt, *row) for row in rows], numpy=True)
+            self.assertEqual({field: column.tolist() for field, column in columns.items()},
+                             {field: [row[i] for row in rows] for i, field in enumerate(schema.fields)})
+
+    def test_formats(self):
+        self._check('<f', None, [(1.5,), (2.5,)])
+        self._check('>d', ('v',), [(1.25,), (-3.0,)])
+        self._check('<dI', ('value', 'seq'), [(21.5, 1), (21.7, 2)])
+        self._check('@bxq', ('a', 'b'), [(1, 2 ** 40), (-1, 5)])
+        self._check('!hH', ('s', 'u'), [(-2, 65535), (7, 0)])
+
+    def test_empty(self):
+        self.assertEqual({k: list(v) for k, v in PayloadSchema('<dI').decode([]).items()}, {'f0': [], 'f1': []})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            PayloadSchema('<4s')
+        with self.assertRaises(ValueError):
+            PayloadSchema('<dI', ('only_one',))
+
+    def test_pickle(self):
+        schema = pickle.loads(pickle.dumps(PayloadSchema('<fI', ('value', 'seq'))))
+        self.assertEqual((schema.format, schema.fields, schema.size), ('<fI', ('value', 'seq'), 8))
+
+
+class MessageBatchTest(unittest.TestCase):
+
+    def _batch(self):
+        batch = MessageBatch(schema_router({'sensor/+/temp': PayloadSchema('<fI', ('value', 'seq')),
+                                            'sensor/+/hum': '<H'}))
+        messages = [('sensor/1/temp', struct.pack('<fI', 1.5, 1)), ('sensor/1/hum', struct.pack('<H', 40)),
+                    ('sensor/2/temp', struct.pack('<fI', 2.5, 2)), ('other', b'plain'),
+                    ('sensor/3/temp', b'short')]
+        for i, (topic, payload) in enumerate(messages):
+            batch.append(PublishPacket(False, 0, False, topic, None, payload))
+            batch.timestamps.append(float(i))
+        return batch
+
+    def test_columns(self):
+        columns = self._batch().columns()
+        self.assertEqual(sorted(columns), ['sensor/+/hum', 'sensor/+/temp'])
+        temp = columns['sensor/+/temp']
+        self.assertEqual(list(temp['value']), [1.5, 2.5])
+        self.assertEqual(list(temp['seq']), [1, 2])
+        self.assertEqual(temp['topic'], ['sensor/1/temp', 'sensor/2/temp'])
+        self.assertEqual(list(temp['timestamp']), [0.0, 2.0])
+        self.assertEqual(list(columns['sensor/+/hum']['f0']), [40])
+
+    def test_without_schemas(self):
+        self.assertEqual(MessageBatch().columns(), {})
+
+    def test_pickle(self):
+        batch = pickle.loads(pickle.dumps(self._batch()))
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(list(batch.columns()['sensor/+/temp']['seq']), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import random
+import unittest
+
+from util.compression import Compression, train_dictionary
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = b'{"sensor": "temperature", "value": 21.5, "unit": "celsius"}' * 20
+
+    def test_zlib_and_lzma_round_trip(self):
+        compression = Compression()
+        compression.add_rule('z/#', 'zlib', threshold=16)
+        compression.add_rule('l/#', 'lzma', threshold=16)
+        for topic in ('z/a', 'l/a'):
+            compressed = compression.compress(topic, self.payload)
+            self.assertLess(len(compressed), len(self.payload))
+            self.assertEqual(compression.decompress(compressed), self.payload)
+
+    def test_dictionary(self):
+        samples = [b'{"sensor": "s%d", "value": %d}' % (i, i) for i in range(200)]
+        compression = Compression()
+        compression.add_dictionary(1, train_dictionary(samples))
+        compression.add_rule('d/#', threshold=8, dictionary_id=1)
+        payload = b'{"sensor": "s7", "value": 7, "value": 7}'
+        compressed = compression.compress('d/x', payload)
+        self.assertEqual(compression.decompress(compressed), payload)
+        with self.assertRaises(ValueError):
+            compression.add_rule('e/#', dictionary_id=2)
+
+    def test_payloads_left_alone(self):
+        compression = Compression()
+        compression.add_rule('a/#', threshold=100)
+        self.assertIs(compression.compress('a/b', b'short'), b'short')
+        self.assertIs(compression.compress('other', self.payload), self.payload)
+        # a plain payload starting with the marker
+        self.assertEqual(compression.decompress(b'\xff\x10garbage'), b'\xff\x10garbage')
+        self.assertEqual(compression.stats()['inbound']['errors'], 1)
+
+    def test_random_payloads_with_the_marker(self):
+        compression = Compression()
+        rng = random.Random(1)
+        for n in range(2000):
+            for header in (b'\xff\x10', b'\xff\x20'):
+                payload = header + bytes(rng.getrandbits(8) for _ in range(n % 64))
+                self.assertIs(compression.decompress(payload), payload)
+        self.assertEqual(compression.stats()['inbound']['decompressed'], 0)
+
+    def test_truncated_and_padded_streams(self):
+        compression = Compression()
+        compression.add_rule('#', threshold=16)
+        compressed = compression.compress('t', self.payload)
+        for payload in (compressed[:-1], compressed + b'\x00'):
+            self.assertIs(compression.decompress(payload), payload)
+
+    def test_most_specific_rule_wins(self):
+        compression = Compression()
+        compression.add_rule('a/#', 'zlib', threshold=16)
+        compression.add_rule('a/+/raw', 'zlib', threshold=10000)
+        self.assertIs(compression.compress('a/1/raw', self.payload), self.payload)
+        self.assertNotEqual(compression.compress('a/1/cooked', self.payload), self.payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
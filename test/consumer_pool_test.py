@@ -0,0 +1,65 @@
+import multiprocessing
+import socket
+import unittest
+
+from consumer_pool import ConsumerPool, _worker_main
+from util.frame_decoder import FrameDecoder
+
+_CONNACK = b'\x20\x02\x00\x00'
+
+
+def _handle(packet):
+    pass
+
+
+class WorkerTest(unittest.TestCase):
+    """a worker process connected to a listening socket in place of a broker"""
+
+    def setUp(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(self.server.close)
+        self.server.settimeout(5)
+        port = self.server.getsockname()[1]
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.addCleanup(self.conn.close)
+        self.process = multiprocessing.Process(target=_worker_main, daemon=True, args=(
+            0, ('127.0.0.1', port, 'worker-0', None, None), {}, [], _handle, child_conn, 0.05))
+        self.process.start()
+        child_conn.close()
+        self.broker_conn = self.server.accept()[0]
+        self.addCleanup(self.broker_conn.close)
+        self.broker_conn.settimeout(5)
+        # CONNECT
+        decoder = FrameDecoder()
+        frames = []
+        while not frames:
+            frames = decoder.feed(self.broker_conn.recv(65536))
+        self.assertEqual(frames[0][0], 1)
+        self.broker_conn.sendall(_CONNACK)
+
+    def tearDown(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+    def test_stop_exits_cleanly(self):
+        self.assertEqual(self.conn.recv()[0], 'metrics')
+        self.conn.send(('stop', None))
+        self.process.join(5)
+        self.assertEqual(self.process.exitcode, 0)
+
+    def test_lost_connection_exits_with_an_error(self):
+        self.broker_conn.close()
+        self.process.join(5)
+        self.assertEqual(self.process.exitcode, 1)
+
+
+class ConsumerPoolTest(unittest.TestCase):
+
+    def test_handler_is_required(self):
+        with self.assertRaises(ValueError):
+            ConsumerPool('127.0.0.1')
+
+
+if __name__ == '__main__':
+    unittest.main()
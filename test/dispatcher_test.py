@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from util.dispatcher import OrderedDispatcher
+
+
+class OrderedDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def _wait(self, dispatcher):
+        deadline = time.monotonic() + 5
+        while dispatcher.pending and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(dispatcher.pending, 0)
+
+    def test_calls_of_one_key_stay_in_order(self):
+        dispatcher = OrderedDispatcher(self.executor)
+        results = {key: [] for key in 'abc'}
+
+        def handle(key, i):
+            # later calls of other keys overtake the slow ones
+            time.sleep(0.001 * (i % 3))
+            results[key].append(i)
+
+        for i in range(100):
+            for key in 'abc':
+                dispatcher.submit(key, handle, (key, i))
+        self._wait(dispatcher)
+        for key in 'abc':
+            self.assertEqual(results[key], list(range(100)))
+
+    def test_on_done_and_errors(self):
+        dispatcher = OrderedDispatcher(self.executor)
+        done = []
+        with self.assertLogs(level='ERROR'):
+            dispatcher.submit('k', lambda: 1 / 0, (), lambda future: done.append(future.exception() is not None))
+            dispatcher.submit('k', lambda: None, (), lambda future: done.append(future.exception() is not None))
+            self._wait(dispatcher)
+        self.assertEqual(done, [True, False])
+
+    def test_max_pending_blocks_the_caller(self):
+        dispatcher = OrderedDispatcher(self.executor, max_pending=2)
+        release = threading.Event()
+        dispatcher.submit('a', release.wait, ())
+        dispatcher.submit('b', release.wait, ())
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (dispatcher.submit('c', lambda: None, ()), submitted.set()))
+        thread.start()
+        self.assertFalse(submitted.wait(0.05))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        self._wait(dispatcher)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from packet.publish_packet import PublishPacket
+from packet.puback_packet import PubackPacket
+from util.frame_decoder import FrameDecoder, PUBLISH_CHUNK, PUBLISH_END, PUBLISH_HEAD
+
+
+class _Socket:
+    """returns the given reads from recv_into"""
+
+    def __init__(self, reads):
+        self._reads = list(reads)
+
+    def recv_into(self, buffer):
+        if not self._reads:
+            return 0
+        data = self._reads.pop(0)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _Capture:
+    """records the reads like util.capture.CaptureWriter"""
+
+    def __init__(self):
+        self.reads = []
+
+    def received(self, data):
+        self.reads.append(bytes(data))
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.publish = PublishPacket(False, 1, False, 'a/b', 7, b'x' * 300).to_bytes()
+        self.puback = PubackPacket(7).to_bytes()
+
+    def test_many_frames_in_one_read(self):
+        frames = FrameDecoder().feed(self.publish + self.puback + self.publish)
+        self.assertEqual([(t, f) for t, f, _ in frames], [(3, 2), (4, 0), (3, 2)])
+        self.assertEqual(frames[0][2], self.publish)
+        self.assertEqual(frames[1][2], self.puback)
+
+    def test_frames_split_at_every_byte(self):
+        decoder = FrameDecoder()
+        data = self.puback + self.publish + self.puback
+        frames = []
+        for i in range(len(data)):
+            frames.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual([packet_bytes for _, _, packet_bytes in frames], [self.puback, self.publish, self.puback])
+        self.assertEqual(decoder.pending_bytes(), 0)
+
+    def test_incomplete_frame_is_kept(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(self.publish[:100]), [])
+        self.assertEqual(decoder.pending_bytes(), 100)
+        frames = decoder.feed(self.publish[100:] + self.puback[:1])
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(decoder.feed(self.puback[1:])[0][2], self.puback)
+
+    def test_malformed_remaining_length(self):
+        with self.assertRaises(ValueError):
+            FrameDecoder().feed(b'\x30\xff\xff\xff\xff\x01')
+
+    def test_stream_threshold(self):
+        decoder = FrameDecoder(stream_threshold=100)
+        frames = decoder.feed(self.publish[:50]) + decoder.feed(self.publish[50:200]) + decoder.feed(
+            self.publish[200:] + self.puback)
+        self.assertEqual(frames[0][0], PUBLISH_HEAD)
+        header = frames[0][2]
+        self.assertEqual(frames[0][1], len(self.publish) - len(header))
+        chunks = b''.join(data for event, _, data in frames if event == PUBLISH_CHUNK)
+        self.assertEqual(header + chunks, self.publish)
+        self.assertEqual([event for event, _, _ in frames[-2:]], [PUBLISH_END, 4])
+
+    def test_recv_from(self):
+        decoder = FrameDecoder(buffer_size=64)
+        decoder.capture = _Capture()
+        sock = _Socket([self.puback + self.publish[:10], self.publish[10:60]])
+        self.assertEqual(len(decoder.recv_from(sock)), 1)
+        self.assertEqual(decoder.recv_from(sock), [])
+        self.assertEqual(decoder.capture.reads, [self.puback + self.publish[:10], self.publish[10:60]])
+        with self.assertRaises(ConnectionError):
+            decoder.recv_from(sock)
+
+
+if __name__ == '__main__':
+    unittest.main()
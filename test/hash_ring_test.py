@@ -0,0 +1,26 @@
+import unittest
+
+from util.hash_ring import HashRing
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+        keys = ['client-%d' % i for i in range(1000)]
+        before = {key: ring.get(key) for key in keys}
+        self.assertEqual(set(before.values()), {'a', 'b', 'c'})
+        ring.remove('b')
+        self.assertEqual(len(ring), 2)
+        for key in keys:
+            if before[key] != 'b':
+                self.assertEqual(ring.get(key), before[key])
+            else:
+                self.assertIn(ring.get(key), ('a', 'c'))
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing().get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import queue
+import select
+import socket
+import threading
+import unittest
+
+from client import Client
+from packet.publish_packet import PublishPacket
+from util.frame_decoder import FrameDecoder
+
+_CONNACK = b'\x20\x02\x00\x00'
+
+
+class _Peer:
+    """the broker side of one accepted connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._decoder = FrameDecoder()
+        self._frames = []
+
+    def read(self):
+        """the next (packet_type, packet_bytes) sent by the client"""
+        while not self._frames:
+            data = self.conn.recv(65536)
+            if not data:
+                raise ConnectionError('connection is closed')
+            self._frames.extend(self._decoder.feed(data))
+        packet_type, _, packet_bytes = self._frames.pop(0)
+        return packet_type, packet_bytes
+
+
+class _PostingSocket:
+    """the loop's end of the socketpair, a packet is posted while the loop drains it"""
+
+    def __init__(self, client):
+        self._client = client
+        self._sock = client._wakeup_r
+        self._posted = False
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, size):
+        if not self._posted:
+            self._posted = True
+            self._client._wake_loop()
+        return self._sock.recv(size)
+
+
+class LoopThreadTest(unittest.TestCase):
+    """loop_start against a listening socket in place of a broker"""
+
+    def setUp(self):
+        server = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(server.close)
+        server.settimeout(5)
+        self.client = Client('127.0.0.1', server.getsockname()[1])
+        self.client.connect()
+        conn = server.accept()[0]
+        conn.settimeout(5)
+        self.addCleanup(conn.close)
+        self.peer = _Peer(conn)
+        # CONNECT
+        self.assertEqual(self.peer.read()[0], 1)
+        conn.sendall(_CONNACK)
+
+    def tearDown(self):
+        self.client.close()
+
+    def _read_publishes(self, n):
+        payloads = []
+        for _ in range(n):
+            packet_type, packet_bytes = self.peer.read()
+            self.assertEqual(packet_type, 3)
+            payloads.append(bytes(PublishPacket.from_bytes(packet_bytes).payload))
+        return payloads
+
+    def _loop_start(self):
+        """start the loop and wait until it handles packets"""
+        received = queue.Queue()
+        self.client.on_message(lambda packet: received.put(threading.get_ident()))
+        thread = self.client.loop_start()
+        self.peer.conn.sendall(PublishPacket(False, 0, False, 't', None, b'').to_bytes())
+        self.assertEqual(received.get(timeout=5), thread.ident)
+
+    def test_publishes_of_many_threads_are_posted_to_the_loop(self):
+        self._loop_start()
+        with self.assertRaises(RuntimeError):
+            self.client.loop_start()
+
+        def publish(name):
+            for i in range(200):
+                self.client.publish('t', b'%s %d' % (name, i))
+
+        publishers = [threading.Thread(target=publish, args=(b'%d' % n,)) for n in range(4)]
+        for publisher in publishers:
+            publisher.start()
+        for publisher in publishers:
+            publisher.join()
+        payloads = self._read_publishes(800)
+        # every frame is whole and each thread's messages keep their order
+        for n in range(4):
+            self.assertEqual([p for p in payloads if p.startswith(b'%d ' % n)], [b'%d %d' % (n, i) for i in range(200)])
+
+    def test_loop_stop_keeps_the_connection(self):
+        self._loop_start()
+        self.client.loop_stop()
+        self.assertFalse(self.client._posting())
+        self.client.publish('t', b'direct')
+        self.assertEqual(self._read_publishes(1), [b'direct'])
+        # the loop can be started again
+        self._loop_start()
+        self.client.publish('t', b'posted')
+        self.assertEqual(self._read_publishes(1), [b'posted'])
+
+
+    def test_loop_stop_right_after_loop_start(self):
+        # closing wakes up a loop that missed the stop
+        watchdog = threading.Timer(5, self.client.close)
+        watchdog.start()
+        self.addCleanup(watchdog.cancel)
+        for _ in range(20):
+            self.client.loop_start()
+            self.client.loop_stop()
+        self.assertTrue(watchdog.is_alive())
+        self._loop_start()
+
+    def test_wakeup_posted_while_draining_is_kept(self):
+        self.client._wakeup_r, self.client._wakeup_w = socket.socketpair()
+        self.client._wakeup_r.setblocking(False)
+        wakeup_r = self.client._wakeup_r
+        self.client._wake_loop()
+        self.client._wakeup_r = _PostingSocket(self.client)
+        self.client._recv_packets()
+        self.client._wakeup_r = wakeup_r
+        # the next post wakes the loop up again
+        self.client._wake_loop()
+        self.assertEqual(select.select([wakeup_r], [], [], 0)[0], [wakeup_r])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from util.lru import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_dropped(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual((len(cache), cache.get('a'), cache.get('c')), (2, 1, 3))
+        self.assertIsNone(cache.get('b'))
+
+    def test_pop_and_clear(self):
+        cache = LRUCache()
+        cache.put('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', 0), 0)
+        cache.put('b', 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
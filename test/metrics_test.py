@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import unittest
+
+from client import Client
+from packet.puback_packet import PubackPacket
+from util.metrics import Histogram, Metrics, MetricsExporter, merge_snapshots
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+
+    def send(self, data):
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(len(buffer) for buffer in buffers)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        histogram = Histogram((1, 2, 4, 8))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1.5, 1.5, 3, 20):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual((snapshot['count'], snapshot['min'], snapshot['max'], snapshot['sum']), (5, 0.5, 20, 26.5))
+        self.assertEqual(snapshot['p50'], 2)
+        # above the last bucket, the max is the best bound
+        self.assertEqual(snapshot['p99'], 20)
+
+    def test_merge(self):
+        first, second = Histogram((1, 2, 4, 8)), Histogram((1, 2, 4, 8))
+        for value in (0.5, 3):
+            first.observe(value)
+        second.observe(20)
+        with self.assertRaises(ValueError):
+            first.merge(second.snapshot())
+        first.merge(second.snapshot(buckets=True))
+        snapshot = first.snapshot(buckets=True)
+        self.assertEqual((snapshot['count'], snapshot['min'], snapshot['max']), (3, 0.5, 20))
+        self.assertEqual(snapshot['buckets'], [1, 0, 1, 0, 1])
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counters_gauges_and_histograms(self):
+        metrics = Metrics()
+        depth = [3]
+        metrics.gauge('depth', lambda: depth[0])
+        metrics.count_packet('out', 3, 100)
+        metrics.count_packet('out', 3, 50)
+        metrics.count_packet('in', 99, 2)
+        metrics.inc('reconnects')
+        metrics.observe('latency', 0.001)
+        depth[0] = 4
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'packets_out.PUBLISH': 2, 'bytes_out.PUBLISH': 150,
+                                                'packets_in.99': 1, 'bytes_in.99': 2, 'reconnects': 1})
+        self.assertEqual(snapshot['gauges'], {'depth': 4})
+        self.assertEqual(snapshot['histograms']['latency']['count'], 1)
+        metrics.reset()
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['counters'], snapshot['histograms']), ({}, {}))
+        self.assertEqual(snapshot['gauges'], {'depth': 4})
+
+    def test_merge_snapshots(self):
+        snapshots = []
+        for i in (1, 2):
+            metrics = Metrics()
+            metrics.inc('messages', i)
+            metrics.gauge('depth', lambda: 10)
+            metrics.observe('latency', 0.001 * i)
+            snapshots.append(metrics.snapshot(buckets=True))
+        merged = merge_snapshots(snapshots)
+        self.assertEqual((merged['counters'], merged['gauges']), ({'messages': 3}, {'depth': 20}))
+        latency = merged['histograms']['latency']
+        self.assertEqual((latency['count'], latency['min'], latency['max']), (2, 0.001, 0.002))
+
+    def test_exporter(self):
+        metrics = Metrics()
+        metrics.inc('n')
+        with self.assertRaises(ValueError):
+            MetricsExporter(metrics)
+        exported = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.jsonl')
+            exporter = MetricsExporter(metrics, 60, path, exported.append).start()
+            exporter.stop()
+            with open(path) as f:
+                self.assertEqual([json.loads(line)['counters'] for line in f], [{'n': 1}])
+        self.assertEqual(exported[0]['counters'], {'n': 1})
+
+    def test_client_metrics(self):
+        self.assertIsNone(Client('127.0.0.1').metrics)
+        client = Client('127.0.0.1', metrics=True)
+        client._write_queue = WriteQueue(_Socket())
+        client.publish('t', b'x' * 10, 1)
+        client.publish('t', b'y')
+        client._handle_packet(4, PubackPacket(1).to_bytes())
+        snapshot = client.metrics.snapshot()
+        self.assertEqual(snapshot['counters']['packets_out.PUBLISH'], 2)
+        self.assertEqual(snapshot['histograms']['publish_ack_latency']['count'], 1)
+        self.assertEqual((snapshot['gauges']['inflight'], snapshot['gauges']['unack_publish']), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import queue
+import socket
+import threading
+import unittest
+
+from client import Client
+from multiplexer import Multiplexer
+from packet.publish_packet import PublishPacket
+from util.frame_decoder import FrameDecoder
+
+_CONNACK = b'\x20\x02\x00\x00'
+
+
+class _Peer:
+    """the broker side of one accepted connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._decoder = FrameDecoder()
+        self._frames = []
+
+    def read(self):
+        """the next (packet_type, packet_bytes) sent by the client"""
+        while not self._frames:
+            data = self.conn.recv(65536)
+            if not data:
+                raise ConnectionError('connection is closed')
+            self._frames.extend(self._decoder.feed(data))
+        packet_type, _, packet_bytes = self._frames.pop(0)
+        return packet_type, packet_bytes
+
+
+class MultiplexerTest(unittest.TestCase):
+    """clients on one Multiplexer talking to a listening socket in place of a broker"""
+
+    def setUp(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.port = self.server.getsockname()[1]
+        self.multiplexer = Multiplexer(timer_tick=0.01)
+        self.thread = None
+
+    def tearDown(self):
+        if self.thread is not None:
+            self.multiplexer.stop()
+            self.thread.join(5)
+        self.multiplexer.close()
+        self.server.close()
+
+    def _start(self):
+        self.thread = threading.Thread(target=self.multiplexer.run_forever)
+        self.thread.start()
+
+    def _accept(self):
+        conn = self.server.accept()[0]
+        conn.settimeout(5)
+        self.addCleanup(conn.close)
+        peer = _Peer(conn)
+        # CONNECT
+        self.assertEqual(peer.read()[0], 1)
+        conn.sendall(_CONNACK)
+        return peer
+
+    def test_clients_share_one_thread(self):
+        received = queue.Queue()
+        clients = []
+        for i in range(3):
+            client = Client('127.0.0.1', self.port, client_id='c%d' % i)
+            client.on_message(lambda packet, i=i: received.put((i, threading.get_ident(), bytes(packet.payload))))
+            self.multiplexer.add(client)
+            client.connect()
+            clients.append(client)
+        self.assertEqual(len(self.multiplexer), 3)
+        self._start()
+        peers = [self._accept() for _ in clients]
+        for peer in peers:
+            peer.conn.sendall(PublishPacket(False, 0, False, 't', None, b'hello').to_bytes())
+        messages = [received.get(timeout=5) for _ in clients]
+        self.assertEqual(sorted(i for i, _, _ in messages), [0, 1, 2])
+        self.assertEqual({ident for _, ident, _ in messages}, {self.thread.ident})
+        # publishes from another thread are written by the loop
+        for i, client in enumerate(clients):
+            client.publish('up', b'%d' % i)
+        payloads = set()
+        for peer in peers:
+            packet_type, packet_bytes = peer.read()
+            self.assertEqual(packet_type, 3)
+            payloads.add(bytes(PublishPacket.from_bytes(packet_bytes).payload))
+        self.assertEqual(payloads, {b'0', b'1', b'2'})
+
+    def test_lost_connection_is_reconnected(self):
+        client = Client('127.0.0.1', self.port, auto_reconnect=True, reconnect_delay_min=0.01,
+                        reconnect_delay_max=0.05)
+        self.multiplexer.add(client)
+        client.connect()
+        self._start()
+        self._accept().conn.close()
+        peer = self._accept()
+        client.publish('t', b'again')
+        packet_type, packet_bytes = peer.read()
+        self.assertEqual(bytes(PublishPacket.from_bytes(packet_bytes).payload), b'again')
+
+    def test_remove(self):
+        client = self.multiplexer.add(Client('127.0.0.1', self.port))
+        self.multiplexer.remove(client)
+        self.assertEqual(len(self.multiplexer), 0)
+        self.assertIsNone(client._multiplexer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import io
+import os
+import queue
+import tempfile
+import unittest
+
+from client import Client
+from util.offline_queue import OfflineQueue
+from util.write_queue import WriteQueue
+
+
+def _drain_all(offline):
+    sent = []
+    while offline.drain(sent.extend):
+        pass
+    return sent
+
+
+class OfflineQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.spill_dir = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_memory_only_drop_oldest(self):
+        offline = OfflineQueue(max_messages=3)
+        for i in range(5):
+            offline.put('t', b'%d' % i)
+        self.assertEqual([m[1] for m in _drain_all(offline)], [b'2', b'3', b'4'])
+        self.assertEqual(offline.dropped, 2)
+
+    def test_drop_newest(self):
+        offline = OfflineQueue(max_messages=2, policy='drop_newest')
+        self.assertTrue(offline.put('t', b'0'))
+        self.assertTrue(offline.put('t', b'1'))
+        self.assertFalse(offline.put('t', b'2'))
+        self.assertEqual([m[1] for m in _drain_all(offline)], [b'0', b'1'])
+
+    def test_block_raises_full(self):
+        offline = OfflineQueue(max_messages=1, policy='block', block_timeout=0.01)
+        offline.put('t', b'0')
+        with self.assertRaises(queue.Full):
+            offline.put('t', b'1')
+        with self.assertRaises(queue.Full):
+            offline.put('t', b'1', block=False)
+
+    def test_spill_and_drain_in_order(self):
+        offline = OfflineQueue(max_messages=10, spill_dir=self.spill_dir, segment_size=100, batch_size=7)
+        for i in range(95):
+            offline.put('a/b', b'%d' % i, i % 3, bool(i % 2))
+        self.assertGreater(offline.spilled, 0)
+        self.assertEqual(len(offline), 95)
+        sent = _drain_all(offline)
+        self.assertEqual(sent, [('a/b', b'%d' % i, i % 3, bool(i % 2)) for i in range(95)])
+        self.assertEqual(len(offline), 0)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_close_and_reopen_keeps_every_message(self):
+        offline = OfflineQueue(max_messages=2, spill_dir=self.spill_dir)
+        for i in range(10):
+            offline.put('t', b'%d' % i)
+        sent = []
+        offline.drain(sent.extend, 1)
+        offline.close()
+        reopened = OfflineQueue(max_messages=2, spill_dir=self.spill_dir)
+        self.assertEqual(len(reopened), 9)
+        self.assertEqual(sent + _drain_all(reopened), [('t', b'%d' % i, 0, False) for i in range(10)])
+
+    def test_close_and_reopen_twice(self):
+        offline = OfflineQueue(max_messages=3, spill_dir=self.spill_dir, segment_size=40)
+        for i in range(20):
+            offline.put('t', b'%d' % i)
+        sent = []
+        offline.drain(sent.extend, 4)
+        offline.close()
+        offline = OfflineQueue(max_messages=3, spill_dir=self.spill_dir, segment_size=40)
+        offline.drain(sent.extend, 2)
+        offline.put('t', b'20')
+        offline.close()
+        offline = OfflineQueue(max_messages=3, spill_dir=self.spill_dir, segment_size=40)
+        self.assertEqual([m[1] for m in sent + _drain_all(offline)], [b'%d' % i for i in range(21)])
+
+    def test_torn_segment_is_truncated(self):
+        offline = OfflineQueue(max_messages=2, spill_dir=self.spill_dir)
+        for i in range(5):
+            offline.put('t', b'%d' % i)
+        offline.close()
+        name = sorted(os.listdir(self.spill_dir))[-1]
+        with open(os.path.join(self.spill_dir, name), 'ab') as f:
+            f.write(b'\x00\x00')
+        reopened = OfflineQueue(max_messages=2, spill_dir=self.spill_dir)
+        self.assertEqual([m[1] for m in _drain_all(reopened)], [b'%d' % i for i in range(5)])
+
+    def test_max_disk_bytes_drops_oldest_segments(self):
+        offline = OfflineQueue(max_messages=5, spill_dir=self.spill_dir, segment_size=50, max_disk_bytes=100)
+        for i in range(100):
+            offline.put('t', b'%02d' % i)
+        sent = _drain_all(offline)
+        self.assertEqual(len(sent) + offline.dropped, 100)
+        self.assertEqual(sent[-1][1], b'99')
+        self.assertEqual([m[1] for m in sent], sorted(m[1] for m in sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class _FailingSocket:
+
+    def fileno(self):
+        return 3
+
+    def send(self, data):
+        raise ConnectionResetError()
+
+    def sendmsg(self, buffers):
+        raise ConnectionResetError()
+
+
+class ClientOfflineQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.offline = OfflineQueue()
+        # never connected
+        self.client = Client('127.0.0.1', offline_queue=self.offline)
+
+    def _fail_writes(self):
+        self.client._socket = _FailingSocket()
+        self.client._write_queue = WriteQueue(self.client._socket)
+
+    def test_publish_while_disconnected_is_held(self):
+        self.client.publish('a', b'0')
+        self.client.publish_many([('a', b'1'), ('a', b'2', 1)])
+        self.client.prepare_publish('b', 1).publish(b'3')
+        self.assertEqual(_drain_all(self.offline),
+                         [('a', b'0', 0, False), ('a', b'1', 0, False), ('a', b'2', 1, False), ('b', b'3', 1, False)])
+
+    def test_future_and_stream_are_not_held(self):
+        with self.assertRaises(ConnectionError):
+            self.client.publish_future('a', b'0', 1)
+        with self.assertRaises(ConnectionError):
+            self.client.publish_stream('a', io.BytesIO(b'0'))
+        self.assertEqual(len(self.offline), 0)
+        self.assertFalse(self.client._packet_ids)
+
+    def test_failed_write_holds_qos0_only(self):
+        self._fail_writes()
+        self.client.publish('a', b'0', 1)
+        self.client.publish('a', b'1')
+        self.assertEqual(_drain_all(self.offline), [('a', b'1', 0, False)])
+        self.client.publish_many([('b', b'2'), ('b', b'3', 1)])
+        self.assertEqual(_drain_all(self.offline), [('b', b'2', 0, False)])
+        self.client.prepare_publish('c').publish(b'4')
+        self.assertEqual(_drain_all(self.offline), [('c', b'4', 0, False)])
+        # sent again after reconnecting
+        self.assertEqual([packet.payload for packet in self.client._unack_packet.values()], [b'0', b'3'])
@@ -0,0 +1,57 @@
+import unittest
+
+from packet.connack_packet import ConnackPacket
+from packet.disconnect_packet import DisconnectPacket
+from packet.pingreq_packet import PingreqPacket
+from packet.puback_packet import PubackPacket
+from packet.pubcomp_packet import PubcompPacket
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from packet.suback_packet import SubackPacket
+from packet.subscribe_packet import SubscribePacket
+
+
+class AckPacketTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for cls, first_byte in ((PubackPacket, 0x40), (PubrecPacket, 0x50), (PubrelPacket, 0x62),
+                                (PubcompPacket, 0x70)):
+            for packet_id in (1, 0x1234, 0xFFFF):
+                data = cls(packet_id).to_bytes()
+                self.assertEqual(data, bytes((first_byte, 2)) + packet_id.to_bytes(2, 'big'))
+                for packet_bytes in (data, memoryview(data)):
+                    packet = cls.from_bytes(packet_bytes)
+                    self.assertIs(type(packet), cls)
+                    self.assertEqual(packet.packet_id, packet_id)
+
+    def test_str(self):
+        self.assertEqual(str(PubrelPacket(7)), 'PubrelPacket(packet_id = 7)')
+
+
+class ControlPacketTest(unittest.TestCase):
+
+    def test_connack(self):
+        packet = ConnackPacket.from_bytes(b'\x20\x02\x01\x05')
+        self.assertEqual((packet.sp, packet.return_code), (True, 5))
+
+    def test_suback(self):
+        packet = SubackPacket.from_bytes(b'\x90\x04\x00\x09\x01\x80')
+        self.assertEqual((packet.packet_id, packet.return_codes), (9, [1, 0x80]))
+
+    def test_suback_with_multi_byte_remaining_length(self):
+        return_codes = [i % 3 for i in range(200)]
+        # remaining length 202 takes 2 bytes
+        packet = SubackPacket.from_bytes(b'\x90\xca\x01\x01\x02' + bytes(return_codes))
+        self.assertEqual((packet.packet_id, packet.return_codes), (0x0102, return_codes))
+
+    def test_subscribe(self):
+        self.assertEqual(SubscribePacket(10, 'a/b', 1, '温', 2).to_bytes(),
+                         b'\x82\x0e\x00\x0a' + b'\x00\x03a/b\x01' + b'\x00\x03' + '温'.encode('utf-8') + b'\x02')
+
+    def test_fixed_header_only(self):
+        self.assertEqual(DisconnectPacket().to_bytes(), b'\xe0\x00')
+        self.assertEqual(PingreqPacket().to_bytes(), b'\xc0\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from util.packet_id import PacketIdAllocator
+
+
+class PacketIdAllocatorTest(unittest.TestCase):
+
+    def test_allocates_in_order(self):
+        ids = PacketIdAllocator()
+        self.assertEqual([ids.allocate() for _ in range(3)], [1, 2, 3])
+        self.assertEqual(len(ids), 3)
+        self.assertIn(2, ids)
+
+    def test_released_ids_are_recycled_first(self):
+        ids = PacketIdAllocator()
+        for _ in range(5):
+            ids.allocate()
+        ids.release(3)
+        ids.release(1)
+        self.assertEqual([ids.allocate(), ids.allocate(), ids.allocate()], [3, 1, 6])
+
+    def test_wraparound_and_exhaustion(self):
+        ids = PacketIdAllocator(max_id=0xFFFF)
+        for _ in range(0xFFFF):
+            ids.allocate()
+        self.assertEqual(ids.available, 0)
+        with self.assertRaises(RuntimeError):
+            ids.allocate()
+        ids.release(0xFFFF)
+        ids.release(10)
+        self.assertEqual(ids.allocate(), 0xFFFF)
+        self.assertEqual(ids.allocate(), 10)
+        with self.assertRaises(RuntimeError):
+            ids.allocate()
+
+    def test_reserved_ids_are_skipped(self):
+        ids = PacketIdAllocator(max_id=4)
+        ids.reserve(2)
+        self.assertEqual([ids.allocate(), ids.allocate(), ids.allocate()], [1, 3, 4])
+        ids.release(1)
+        ids.reserve(1)
+        with self.assertRaises(RuntimeError):
+            ids.allocate()
+
+    def test_release_of_unknown_id_is_ignored(self):
+        ids = PacketIdAllocator()
+        ids.release(42)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(ids.allocate(), 1)
+
+    def test_clear(self):
+        ids = PacketIdAllocator()
+        ids.allocate()
+        ids.allocate()
+        ids.clear()
+        self.assertEqual(ids.allocate(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from client import Client
+from packet.publish_packet import PublishPacket, PublishTemplate, encode_topic
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(self.send(buffer) for buffer in buffers)
+
+
+class PublishPacketTest(unittest.TestCase):
+
+    def _round_trip(self, packet):
+        decoded = PublishPacket.from_bytes(packet.to_bytes())
+        self.assertEqual((decoded.dup, decoded.qos, decoded.retain, decoded.topic, decoded.packet_id),
+                         (packet.dup, packet.qos, packet.retain, packet.topic, packet.packet_id))
+        self.assertEqual(bytes(decoded.payload), packet.payload)
+        return decoded
+
+    def test_round_trip(self):
+        self._round_trip(PublishPacket(False, 0, False, 'a/b', None, b'hello'))
+        self._round_trip(PublishPacket(False, 1, True, 'a/b', 1, b''))
+        self._round_trip(PublishPacket(False, 2, False, '传感器/温度', 65535, b'x' * 200))
+        self._round_trip(PublishPacket(False, 1, False, 't' * 300, 7, b'y' * 20000))
+
+    def test_payload_is_not_copied(self):
+        data = PublishPacket(False, 1, False, 'a/b', 9, b'payload').to_bytes()
+        packet = PublishPacket.from_bytes(data)
+        self.assertIsInstance(packet.payload, memoryview)
+        self.assertIs(packet.payload.obj, data)
+
+    def test_topic_is_decoded_on_first_access(self):
+        packet = PublishPacket.from_bytes(PublishPacket(False, 0, False, 'a/b', None, b'').to_bytes())
+        self.assertIsNone(packet._topic)
+        self.assertEqual(packet.topic, 'a/b')
+        self.assertIs(packet.topic, packet.topic)
+
+
+    def test_dup_flag(self):
+        self.assertEqual(PublishPacket(True, 1, False, 't', 1, b'').to_bytes()[0], 0b00111010)
+        self._round_trip(PublishPacket(True, 2, True, 't', 1, b'x'))
+
+
+class PublishTemplateTest(unittest.TestCase):
+
+    def test_same_bytes_as_publish_packet(self):
+        for qos in (0, 1, 2):
+            for retain in (False, True):
+                template = PublishTemplate('a/b', qos, retain)
+                for dup in (False, True):
+                    packet_id = 300 if qos else None
+                    for payload in (b'', b'x' * 200):
+                        self.assertEqual(template.to_bytes(packet_id, payload, dup),
+                                         PublishPacket(dup, qos, retain, 'a/b', packet_id, payload).to_bytes())
+
+    def test_encoded_topic_is_cached(self):
+        self.assertEqual(encode_topic('温度'), b'\x00\x06' + '温度'.encode('utf-8'))
+        self.assertIs(encode_topic('a/b/c'), encode_topic('a/b/c'))
+
+    def test_prepared_publish(self):
+        client = Client('127.0.0.1')
+        sock = _Socket()
+        client._write_queue = WriteQueue(sock)
+        temperature = client.prepare_publish('sensor/temperature', 1)
+        self.assertEqual(temperature.topic, 'sensor/temperature')
+        temperature.publish(b'21.5')
+        temperature.publish(b'21.7')
+        self.assertEqual(bytes(sock.data), PublishPacket(False, 1, False, 'sensor/temperature', 1, b'21.5').to_bytes()
+                         + PublishPacket(False, 1, False, 'sensor/temperature', 2, b'21.7').to_bytes())
+        self.assertEqual(sorted(client._unack_packet), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
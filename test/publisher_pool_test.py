@@ -0,0 +1,77 @@
+import unittest
+
+from client import Client
+from packet.puback_packet import PubackPacket
+from packet.publish_packet import PublishPacket
+from packet.pubrec_packet import PubrecPacket
+from publisher_pool import PublisherPool
+from util.frame_decoder import FrameDecoder
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(self.send(buffer) for buffer in buffers)
+
+
+def _client(sock=None):
+    """a client writing to a fake socket"""
+    client = Client('127.0.0.1')
+    client._write_queue = WriteQueue(sock or _Socket())
+    return client
+
+
+def _feed(client, packet):
+    data = packet.to_bytes()
+    client._handle_packet(data[0] >> 4, data)
+
+
+class PublisherPoolTest(unittest.TestCase):
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(ValueError):
+            PublisherPool('127.0.0.1', strategy='random')
+
+    def test_pick(self):
+        pool = PublisherPool('127.0.0.1', size=3)
+        self.assertEqual([pool._pick('t') for _ in range(4)], [0, 1, 2, 0])
+        pool = PublisherPool('127.0.0.1', size=3, strategy='topic_hash')
+        self.assertEqual({pool._pick('sensor/1') for _ in range(10)}, {pool._pick('sensor/1')})
+        pool = PublisherPool('127.0.0.1', size=3, strategy='least_inflight')
+        pool._clients = [_client() for _ in range(3)]
+        pool._clients[0].publish('t', b'', 1)
+        pool._clients[1].publish('t', b'', 1)
+        self.assertEqual(pool._pick('t'), 2)
+
+    def test_migrate(self):
+        sock = _Socket()
+        old, new = _client(), _client(sock)
+        acked = old.publish_future('a', b'1', 1)
+        received = old.publish_future('b', b'2', 2)
+        pending = old.publish_future('c', b'3', 1)
+        _feed(old, PubackPacket(1))
+        _feed(old, PubrecPacket(2))
+        self.assertEqual(acked.result(0), 1)
+        PublisherPool._migrate(old, new)
+        # the broker has the QoS 2 message already
+        self.assertEqual(received.result(0), 2)
+        frames = FrameDecoder().feed(bytes(sock.data))
+        self.assertEqual(len(frames), 1)
+        publish = PublishPacket.from_bytes(frames[0][2])
+        self.assertEqual((publish.topic, bytes(publish.payload), publish.qos), ('c', b'3', 1))
+        self.assertFalse(pending.done())
+        _feed(new, PubackPacket(publish.packet_id))
+        self.assertEqual(pending.result(0), publish.packet_id)
+        self.assertEqual((old._unack_packet, old._unack_pubrel_ids), ({}, set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import queue
+import unittest
+
+from util.rate_limit import RateLimiter, TokenBucket
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_then_reject(self):
+        limiter = RateLimiter(rate=1, burst=3, policy='reject')
+        self.assertEqual([limiter.try_acquire('a') for _ in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.stats()['global']['rejected'], 1)
+
+    def test_most_specific_filter_and_global(self):
+        limiter = RateLimiter(rate=1000, burst=1000)
+        limiter.add_limit('sensor/#', 1, burst=1)
+        limiter.add_limit('sensor/+/raw', 1, burst=2)
+        self.assertTrue(limiter.try_acquire('sensor/1/raw'))
+        self.assertTrue(limiter.try_acquire('sensor/1/raw'))
+        self.assertFalse(limiter.try_acquire('sensor/1/raw'))
+        # sensor/# has its own bucket
+        self.assertTrue(limiter.try_acquire('sensor/1/temp'))
+        self.assertFalse(limiter.try_acquire('sensor/1/temp'))
+        self.assertTrue(limiter.try_acquire('other'))
+        limiter.remove_limit('sensor/#')
+        self.assertTrue(limiter.try_acquire('sensor/1/temp'))
+
+    def test_reserve_returns_the_delay(self):
+        limiter = RateLimiter()
+        self.assertEqual(limiter.reserve('a'), (None, 0))
+        limiter.add_limit('a', 10, burst=1)
+        bucket, delay = limiter.reserve('a')
+        self.assertEqual(delay, 0)
+        bucket, delay = limiter.reserve('a')
+        self.assertAlmostEqual(delay, 0.1, delta=0.01)
+        bucket, delay = limiter.reserve('a')
+        self.assertAlmostEqual(delay, 0.2, delta=0.01)
+        self.assertEqual(bucket.delayed, 2)
+
+    def test_defer_and_pop_due_keep_the_order(self):
+        limiter = RateLimiter(policy='queue', max_queued=2)
+        limiter.add_limit('a', 10, burst=1)
+        bucket, _ = limiter.reserve('a')
+        self.assertTrue(limiter.defer(bucket, 0, print, (1,)))
+        self.assertFalse(limiter.defer(bucket, 0, print, (2,)))
+        with self.assertRaises(queue.Full):
+            limiter.defer(bucket, 0, print, (3,))
+        self.assertEqual(limiter.queued, 2)
+        due, delay = limiter.pop_due(bucket)
+        self.assertEqual(due, [(print, (1,)), (print, (2,))])
+        self.assertIsNone(delay)
+        limiter.push_back(bucket, due[1:])
+        self.assertEqual(limiter.pop_due(bucket)[0], [(print, (2,))])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(policy='drop')
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+from client import Client
+from packet.publish_packet import PublishPacket
+from packet.pubrec_packet import PubrecPacket
+from packet.pubrel_packet import PubrelPacket
+from util.frame_decoder import FrameDecoder
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def send(self, data):
+        self.data += data
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(self.send(buffer) for buffer in buffers)
+
+
+def _subscribe_items(packet_bytes):
+    """(topic, qos) items of an encoded SUBSCRIBE"""
+    offset = 2
+    while packet_bytes[offset - 1] & 0x80:
+        offset += 1
+    # packet id
+    offset += 2
+    items = []
+    while offset < len(packet_bytes):
+        length = int.from_bytes(packet_bytes[offset:offset + 2], 'big')
+        items.append((packet_bytes[offset + 2:offset + 2 + length].decode('utf-8'), packet_bytes[offset + 2 + length]))
+        offset += 3 + length
+    return items
+
+
+class ReconnectTest(unittest.TestCase):
+    """reconnect() over a fake connection"""
+
+    def setUp(self):
+        self.client = Client('127.0.0.1')
+        self.client.connect = self._connect
+        self._connect()
+
+    def _connect(self):
+        self.sock = _Socket()
+        self.client._write_queue = WriteQueue(self.sock)
+
+    def _feed(self, packet):
+        data = packet.to_bytes()
+        self.client._handle_packet(data[0] >> 4, data)
+
+    def _sent(self):
+        return FrameDecoder().feed(bytes(self.sock.data))
+
+    def test_inflight_messages_are_sent_again(self):
+        self.client.publish('a', b'1', 1)
+        self.client.publish('b', b'2', 2)
+        self._feed(PubrecPacket(2))
+        self.client.reconnect()
+        frames = self._sent()
+        publish = PublishPacket.from_bytes(frames[0][2])
+        self.assertEqual((publish.dup, publish.qos, publish.topic, publish.packet_id, bytes(publish.payload)),
+                         (True, 1, 'a', 1, b'1'))
+        self.assertEqual(frames[1][2], PubrelPacket(2).to_bytes())
+        self.assertEqual(len(frames), 2)
+
+    def test_subscriptions_are_renewed_in_few_packets(self):
+        topics = ['sensor/%04d/%s' % (i, 'x' * 100) for i in range(1000)]
+        others = []
+        for topic in topics[1:]:
+            others.extend((topic, 1))
+        self.client.subscribe(topics[0], 2, *others)
+        self.client.subscribe('alarm/#', 0)
+        self.client.reconnect()
+        frames = self._sent()
+        for packet_type, _, packet_bytes in frames:
+            self.assertEqual(packet_type, 8)
+            self.assertLessEqual(len(packet_bytes), 65536 + 5)
+        # about 113 KB of topic filters
+        self.assertEqual(len(frames), 2)
+        items = [item for _, _, packet_bytes in frames for item in _subscribe_items(packet_bytes)]
+        self.assertEqual(items, [(topics[0], 2)] + [(topic, 1) for topic in topics[1:]] + [('alarm/#', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from util.session_store import FileSessionStore
+
+
+class FileSessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'session.log')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _reopen(self, store, **options):
+        store.close()
+        return FileSessionStore(self.path, **options)
+
+    def test_replay_after_reopen(self):
+        store = FileSessionStore(self.path)
+        store.add_publish(1, b'publish-1')
+        store.add_publish(2, b'publish-2')
+        store.add_publish(3, b'publish-3')
+        store.remove(1)
+        store.add_pubrel(2)
+        store.add_inbound(9)
+        store.add_inbound(10)
+        store.remove_inbound(9)
+        state = self._reopen(store).load()
+        self.assertEqual(state.publishes, {3: b'publish-3'})
+        self.assertEqual(state.pubrels, {2})
+        self.assertEqual(state.inbound, {10})
+
+    def test_publish_order_is_kept(self):
+        store = FileSessionStore(self.path)
+        for packet_id in (5, 3, 9, 1):
+            store.add_publish(packet_id, b'%d' % packet_id)
+        # the same id used again goes to the end
+        store.remove(3)
+        store.add_publish(3, b'again')
+        state = self._reopen(store).load()
+        self.assertEqual(list(state.publishes.items()), [(5, b'5'), (9, b'9'), (1, b'1'), (3, b'again')])
+
+    def test_torn_record_is_dropped(self):
+        store = FileSessionStore(self.path)
+        store.add_publish(1, b'complete')
+        store.close()
+        with open(self.path, 'ab') as f:
+            f.write(b'\x01\x00\x02\x00\x00\x00\x10torn')
+        size = os.path.getsize(self.path)
+        store = FileSessionStore(self.path)
+        self.assertEqual(store.load().publishes, {1: b'complete'})
+        self.assertLess(os.path.getsize(self.path), size)
+        store.add_publish(2, b'next')
+        self.assertEqual(self._reopen(store).load().publishes, {1: b'complete', 2: b'next'})
+
+    def test_compaction_keeps_the_live_state(self):
+        store = FileSessionStore(self.path, compact_min=100, compact_ratio=4)
+        for packet_id in range(1, 1000):
+            store.add_publish(packet_id, b'x' * 20)
+            if packet_id % 10:
+                store.remove(packet_id)
+        store.add_pubrel(10)
+        store.add_inbound(7)
+        store.flush()
+        # 99 publishes, a pubrel and an inbound id are live, the log of 2000 records was compacted
+        self.assertLess(os.path.getsize(self.path), 2000 * 7)
+        state = self._reopen(store, compact_min=100).load()
+        self.assertEqual(sorted(state.publishes), list(range(20, 1000, 10)))
+        self.assertEqual(state.pubrels, {10})
+        self.assertEqual(state.inbound, {7})
+
+    def test_clear(self):
+        store = FileSessionStore(self.path)
+        store.add_publish(1, b'x')
+        store.add_inbound(2)
+        store.clear()
+        self.assertEqual(len(self._reopen(store).load()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
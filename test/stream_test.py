@@ -0,0 +1,35 @@
+import io
+import unittest
+
+from util.stream import StreamPayload
+
+
+class StreamPayloadTest(unittest.TestCase):
+
+    def test_seekable_file_is_read_again(self):
+        source = io.BytesIO(b'head' + b'x' * 100)
+        source.seek(4)
+        payload = StreamPayload(source, chunk_size=30)
+        self.assertTrue(payload.seekable)
+        self.assertEqual(len(payload), 100)
+        self.assertEqual([len(chunk) for chunk in payload.chunks()], [30, 30, 30, 10])
+        self.assertEqual(bytes(payload), b'x' * 100)
+
+    def test_iterable_is_read_once(self):
+        payload = StreamPayload(iter([b'ab', b'', b'cd']), 4)
+        self.assertFalse(payload.seekable)
+        self.assertEqual(bytes(payload), b'abcd')
+        with self.assertRaises(ValueError):
+            bytes(payload)
+
+    def test_declared_length_is_checked(self):
+        with self.assertRaises(ValueError):
+            StreamPayload(iter([b'ab']))
+        with self.assertRaises(ValueError):
+            bytes(StreamPayload(iter([b'ab']), 3))
+        with self.assertRaises(ValueError):
+            bytes(StreamPayload(iter([b'abcd']), 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
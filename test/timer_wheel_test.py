@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from util.timer_wheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=0.1, slots=8)
+        self.start = time.monotonic()
+        self.fired = []
+
+    def _at(self, seconds):
+        return self.wheel.advance(self.start + seconds)
+
+    def test_timers_fire_once_due(self):
+        self.wheel.schedule(0.25, self.fired.append, 'a')
+        self.wheel.schedule(0.05, self.fired.append, 'b')
+        self._at(0.15)
+        self.assertEqual(self.fired, ['b'])
+        self._at(0.45)
+        self.assertEqual(self.fired, ['b', 'a'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(0.1, self.fired.append, 'a')
+        self.assertTrue(timer.active)
+        timer.cancel()
+        self.assertFalse(timer.active)
+        self._at(1)
+        self.assertEqual(self.fired, [])
+
+    def test_deadlines_beyond_one_turn(self):
+        # 8 slots of 0.1s: 2.05s is more than two turns ahead
+        self.wheel.schedule(2.05, self.fired.append, 'late')
+        self._at(1.5)
+        self.assertEqual(self.fired, [])
+        self._at(2.5)
+        self.assertEqual(self.fired, ['late'])
+
+    def test_callback_errors_do_not_stop_the_others(self):
+        self.wheel.schedule(0, lambda: 1 / 0)
+        self.wheel.schedule(0, self.fired.append, 'ok')
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self._at(0.5), 2)
+        self.assertEqual(self.fired, ['ok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from util.topic_router import TopicRouter, validate_topic_filter
+
+
+class TopicRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = TopicRouter()
+        for topic_filter in ('sport/tennis/player1', 'sport/+/player1', 'sport/#', '+/+/+', '#', '+', '$SYS/#'):
+            self.router.add(topic_filter, topic_filter)
+
+    def _match(self, topic):
+        return sorted(self.router.match(topic))
+
+    def test_wildcards(self):
+        self.assertEqual(self._match('sport/tennis/player1'),
+                         ['#', '+/+/+', 'sport/#', 'sport/+/player1', 'sport/tennis/player1'])
+        self.assertEqual(self._match('sport/golf/player2'), ['#', '+/+/+', 'sport/#'])
+        self.assertEqual(self._match('news'), ['#', '+'])
+
+    def test_multi_level_wildcard_matches_the_parent(self):
+        self.assertEqual(self._match('sport'), ['#', '+', 'sport/#'])
+
+    def test_empty_levels(self):
+        self.assertEqual(self._match('/finance'), ['#'])
+        self.router.add('+/finance', 'x')
+        self.assertIn('x', self.router.match('/finance'))
+
+    def test_dollar_topics_need_an_explicit_first_level(self):
+        self.assertEqual(self._match('$SYS/broker/load'), ['$SYS/#'])
+
+    def test_remove_and_cache(self):
+        self.assertIn('sport/#', self.router.match('sport/golf'))
+        self.assertTrue(self.router.remove('sport/#'))
+        self.assertFalse(self.router.remove('sport/#'))
+        self.assertNotIn('sport/#', self.router.match('sport/golf'))
+        # the branch of sport/+/player1 is still there
+        self.assertIn('sport/+/player1', self.router.match('sport/golf/player1'))
+        self.assertEqual(len(self.router), 6)
+
+    def test_replace_value(self):
+        self.router.add('#', 'everything')
+        self.assertIn('everything', self.router.match('a/b'))
+        self.assertEqual(self.router.get('#'), 'everything')
+
+    def test_invalid_filters(self):
+        for topic_filter in ('', 'a/#/b', 'a/b#', 'a+/b'):
+            with self.assertRaises(ValueError):
+                validate_topic_filter(topic_filter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import time
+import unittest
+
+from util.write_queue import WriteQueue
+
+
+class _Socket:
+    """counts the writes, accepts at most ``limit`` bytes per write"""
+
+    def __init__(self, limit=None):
+        self.writes = 0
+        self.data = bytearray()
+        self.limit = limit
+
+    def send(self, data):
+        return self._take([data])
+
+    def sendmsg(self, buffers):
+        return self._take(buffers)
+
+    def _take(self, buffers):
+        self.writes += 1
+        data = b''.join(bytes(buffer) for buffer in buffers)[:self.limit]
+        self.data += data
+        return len(data)
+
+
+class WriteQueueTest(unittest.TestCase):
+
+    def test_defaults_write_every_packet(self):
+        sock = _Socket()
+        write_queue = WriteQueue(sock)
+        for i in range(10):
+            write_queue.append(b'%d' % i)
+        self.assertEqual(sock.writes, 10)
+        self.assertEqual(bytes(sock.data), b'0123456789')
+
+    def test_flush_size_without_interval_coalesces(self):
+        sock = _Socket()
+        write_queue = WriteQueue(sock, 65536, 0)
+        for _ in range(100):
+            write_queue.append(b'x' * 20)
+        self.assertEqual(sock.writes, 0)
+        self.assertFalse(write_queue.due())
+        write_queue.flush()
+        self.assertEqual(sock.writes, 1)
+        self.assertEqual(len(sock.data), 2000)
+
+    def test_flush_size_reached(self):
+        sock = _Socket()
+        write_queue = WriteQueue(sock, 100, 0)
+        for _ in range(10):
+            write_queue.append(b'x' * 20)
+        self.assertEqual(sock.writes, 2)
+        self.assertEqual(write_queue.pending_bytes, 0)
+
+    def test_flush_interval_without_size(self):
+        sock = _Socket()
+        write_queue = WriteQueue(sock, 0, 0.02)
+        write_queue.append(b'a')
+        write_queue.append(b'b')
+        self.assertEqual(sock.writes, 0)
+        time.sleep(0.03)
+        self.assertTrue(write_queue.due())
+        write_queue.append(b'c')
+        self.assertEqual(sock.writes, 1)
+        self.assertEqual(bytes(sock.data), b'abc')
+
+    def test_partial_writes_keep_order(self):
+        sock = _Socket(limit=3)
+        write_queue = WriteQueue(sock, 1 << 20, 0)
+        write_queue.extend([b'abcd', b'ef', b'ghijk'])
+        write_queue.post(b'lm')
+        write_queue.flush()
+        self.assertEqual(bytes(sock.data), b'abcdefghijklm')
+        self.assertEqual(len(write_queue), 0)
+
+    def test_write_stream(self):
+        sock = _Socket()
+        write_queue = WriteQueue(sock)
+        write_queue.write_stream(b'head', iter([b'1', b'2', b'3']))
+        write_queue.append(b'next')
+        self.assertEqual(bytes(sock.data), b'head123next')
+
+
+if __name__ == '__main__':
+    unittest.main()
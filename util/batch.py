@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+
+from util.encode import encode_remaining_length
+
+# first bytes of a batch envelope, 0xFE never starts utf-8 text
+MAGIC = b'\xfe\xba'
+
+
+def pack_envelope(messages):
+    """MAGIC followed by every message prefixed with its length, encoded like the MQTT remaining length"""
+    parts = [MAGIC]
+    for message in messages:
+        parts.append(encode_remaining_length(len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+
+def unpack_envelope(payload):
+    """the messages of an envelope as memoryviews, None if ``payload`` is not a well formed envelope"""
+    view = memoryview(payload)
+    end = len(view)
+    if end < 2 or view[0] != MAGIC[0] or view[1] != MAGIC[1]:
+        return None
+    messages = []
+    offset = 2
+    while offset < end:
+        length = 0
+        multiplier = 1
+        while True:
+            if offset >= end:
+                return None
+            byte = view[offset]
+            offset += 1
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+            if multiplier > 128 ** 3:
+                return None
+        if offset + length > end:
+            return None
+        messages.append(view[offset:offset + length])
+        offset += length
+    # pack_envelope is never given an empty batch
+    return messages or None
+
+
+class _Batch:
+    __slots__ = ('messages', 'size', 'timer')
+
+    def __init__(self):
+        self.messages = []
+        self.size = 2
+        self.timer = None
+
+
+class BatchPublisher:
+    """Packs the messages of one topic into a single PUBLISH, see Client.batch_publisher
+
+    A topic's batch is published once it holds ``max_items`` messages, would grow past ``max_bytes`` or is
+    ``max_delay`` seconds old. The delay is driven by the client's timers, so the client's network loop must run.
+    """
+
+    def __init__(self, publish, schedule, max_items=100, max_delay=0.05, max_bytes=65536):
+        self._publish = publish
+        self._schedule = schedule
+        self._max_items = max_items
+        self._max_delay = max_delay
+        self._max_bytes = max_bytes
+        # topic -> _Batch being filled
+        self._batches = {}
+        # held while a batch is published, keeps the batches of a topic in order
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.messages = 0
+
+    def __len__(self):
+        """number of messages waiting"""
+        return sum(len(batch.messages) for batch in list(self._batches.values()))
+
+    def publish(self, topic: str, message: bytes):
+        item_size = len(message) + len(encode_remaining_length(len(message)))
+        with self._lock:
+            batch = self._batches.get(topic)
+            if batch is not None and batch.size + item_size > self._max_bytes:
+                self._send(topic, self._batches.pop(topic))
+                batch = None
+            if batch is None:
+                batch = self._batches[topic] = _Batch()
+                batch.timer = self._schedule(self._max_delay, self._expire, topic, batch)
+            batch.messages.append(message)
+            batch.size += item_size
+            if len(batch.messages) >= self._max_items:
+                self._send(topic, self._batches.pop(topic))
+
+    def flush(self):
+        """publish every waiting batch now"""
+        with self._lock:
+            batches, self._batches = self._batches, {}
+            for topic, batch in batches.items():
+                self._send(topic, batch)
+
+    def _expire(self, topic, batch):
+        # runs on the network thread: never wait for a publisher that waits for acks
+        if not self._lock.acquire(blocking=False):
+            batch.timer = self._schedule(0, self._expire, topic, batch)
+            return
+        try:
+            if self._batches.get(topic) is not batch:
+                return
+            try:
+                self._publish(topic, pack_envelope(batch.messages))
+            except queue.Full:
+                # the in-flight window is full, try again on the next tick
+                batch.timer = self._schedule(0, self._expire, topic, batch)
+                return
+            del self._batches[topic]
+            self._count(batch)
+        except Exception as e:
+            logging.error("publish batch of %s occur error: %s", topic, e)
+        finally:
+            self._lock.release()
+
+    def _send(self, topic, batch):
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self._publish(topic, pack_envelope(batch.messages))
+        self._count(batch)
+
+    def _count(self, batch):
+        self.batches += 1
+        self.messages += len(batch.messages)
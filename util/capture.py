@@ -0,0 +1,94 @@
+import struct
+import threading
+import time
+
+MAGIC = b'MQTTCAP1'
+
+# magic, time.time() the capture started at
+_file_header = struct.Struct('>8sd')
+# direction, microseconds since the capture started, length of the data
+_record_header = struct.Struct('>BQI')
+
+RECEIVED = 0
+SENT = 1
+
+
+class CaptureWriter:
+    """Records the traffic of a Client in a compact binary log, see the capture option of Client
+
+    Every record is the bytes of one read from the socket (RECEIVED) or of one packet handed to the write queue
+    (SENT), with the time since the capture started. Each direction concatenated is the byte stream of the
+    connection, so a replay sees the same reads, split frames included, as the client did.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self._file = open(path, 'wb', buffering=buffer_size)
+        self._origin = time.monotonic()
+        self._file.write(_file_header.pack(MAGIC, time.time()))
+        self._lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+
+    def received(self, data):
+        self._record(RECEIVED, data)
+
+    def sent(self, data):
+        self._record(SENT, data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _record(self, direction, data):
+        micros = int((time.monotonic() - self._origin) * 1e6)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_record_header.pack(direction, micros, len(data)))
+            self._file.write(data)
+            self.records += 1
+            self.bytes += len(data)
+
+
+class CaptureReader:
+    """The records of a capture log as ``(direction, seconds since the start, data)``
+
+    The whole log is read into memory up front, so iterating does no I/O. A record torn by a crash ends the log.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._data = f.read()
+        if len(self._data) < _file_header.size:
+            raise ValueError('not a capture log: {}'.format(path))
+        magic, self.start_time = _file_header.unpack_from(self._data)
+        if magic != MAGIC:
+            raise ValueError('not a capture log: {}'.format(path))
+
+    def __iter__(self):
+        view = memoryview(self._data)
+        offset = _file_header.size
+        end = len(view)
+        unpack_from = _record_header.unpack_from
+        header_size = _record_header.size
+        while offset + header_size <= end:
+            direction, micros, length = unpack_from(view, offset)
+            offset += header_size
+            if offset + length > end:
+                return
+            yield direction, micros / 1e6, view[offset:offset + length]
+            offset += length
+
+    def duration(self):
+        """seconds between the start of the capture and its last record"""
+        last = 0.0
+        for _, timestamp, _ in self:
+            last = timestamp
+        return last
@@ -0,0 +1,176 @@
+import re
+import struct
+import sys
+from array import array
+
+from util.topic_router import TopicRouter
+
+_format_items = re.compile(r'\s*(\d*)([a-zA-Z?])')
+
+# struct format code -> (numpy kind, candidate array typecodes)
+_codes = {
+    'b': ('i', 'bhilq'), 'h': ('i', 'bhilq'), 'i': ('i', 'bhilq'), 'l': ('i', 'bhilq'), 'q': ('i', 'bhilq'),
+    'B': ('u', 'BHILQ'), 'H': ('u', 'BHILQ'), 'I': ('u', 'BHILQ'), 'L': ('u', 'BHILQ'), 'Q': ('u', 'BHILQ'),
+    'f': ('f', 'fd'), 'd': ('f', 'fd'),
+}
+
+
+def _typecode(code, size, native):
+    """the array typecode holding the struct ``code`` of ``size`` bytes"""
+    if native:
+        return code
+    kind, candidates = _codes[code]
+    for typecode in candidates:
+        if array(typecode).itemsize == size:
+            return typecode
+    raise ValueError('no array typecode for {}'.format(code))
+
+
+class PayloadSchema:
+    """Payloads packed with one struct format, decoded a batch at a time into one column per field
+
+    ``fields`` names the fields of ``fmt``, ``x`` pad bytes excepted; the default is f0, f1... Only integer and
+    float codes are supported::
+
+        schema = PayloadSchema('<dI', ('value', 'sequence'))
+        schema.decode([struct.pack('<dI', 21.5, 1), struct.pack('<dI', 21.7, 2)])
+        # {'value': array('d', [21.5, 21.7]), 'sequence': array('I', [1, 2])}
+    """
+
+    def __init__(self, fmt, fields=None):
+        self.format = fmt
+        self._struct = struct.Struct(fmt)
+        byte_order = fmt[0] if fmt[:1] in '@=<>!' else '@'
+        native = byte_order == '@'
+        self._swap = byte_order in '>!' and sys.byteorder == 'little' or byte_order == '<' and sys.byteorder == 'big'
+        body = fmt[1:] if fmt[:1] in '@=<>!' else fmt
+        codes = []
+        for count, code in _format_items.findall(body):
+            if code == 'x':
+                continue
+            if code not in _codes:
+                raise ValueError('unsupported format code: {}'.format(code))
+            codes.extend(code * int(count or 1))
+        if fields is None:
+            fields = tuple('f{}'.format(i) for i in range(len(codes)))
+        if len(fields) != len(codes):
+            raise ValueError('{} fields for {} values'.format(len(fields), len(codes)))
+        self.fields = tuple(fields)
+        self._typecodes = []
+        self._dtype_formats = []
+        self._offsets = []
+        endian = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}[byte_order]
+        prefix = byte_order
+        for code in codes:
+            size = struct.calcsize(byte_order + code)
+            # the offset of a field includes the alignment padding before it
+            prefix += code
+            self._offsets.append(struct.calcsize(prefix) - size)
+            self._typecodes.append(_typecode(code, size, native))
+            self._dtype_formats.append('{}{}{}'.format(endian, _codes[code][0], size))
+
+    def __reduce__(self):
+        # struct.Struct cannot be pickled, a process pool callback_executor gets the schema built again
+        return PayloadSchema, (self.format, self.fields)
+
+    @property
+    def size(self):
+        """the length of every payload"""
+        return self._struct.size
+
+    def decode(self, payloads, numpy=False):
+        """field -> column of the values in ``payloads``, array.array columns or NumPy arrays with ``numpy``
+
+        Every payload must be ``size`` bytes long.
+        """
+        data = b''.join(payloads)
+        if numpy:
+            import numpy as np
+            dtype = np.dtype({'names': self.fields, 'formats': self._dtype_formats, 'offsets': self._offsets,
+                              'itemsize': self.size})
+            records = np.frombuffer(data, dtype)
+            return {field: records[field] for field in self.fields}
+        if len(self.fields) == 1 and array(self._typecodes[0]).itemsize == self.size:
+            # the payloads are already one column
+            column = array(self._typecodes[0])
+            column.frombytes(data)
+            if self._swap:
+                column.byteswap()
+            return {self.fields[0]: column}
+        rows = self._struct.iter_unpack(data)
+        values = zip(*rows) if data else [()] * len(self.fields)
+        return {field: array(typecode, column) for field, typecode, column in zip(self.fields, self._typecodes, values)}
+
+
+class MessageBatch(list):
+    """The PublishPackets of one on_message_batch call, oldest first
+
+    ``timestamps`` holds the time.time() each message was received at. ``columns()`` decodes the payloads of the
+    topics with a schema in one step per schema.
+    """
+
+    def __init__(self, schemas=None):
+        super().__init__()
+        self.timestamps = array('d')
+        self._schemas = schemas
+        # acks sent once the batch is handled
+        self.acks = []
+        self.timer = None
+
+    def columns(self, numpy=False):
+        """topic filter -> columns of the messages matching its schema
+
+        The columns are the schema fields plus ``topic`` (a list) and ``timestamp``. Messages without a schema or
+        whose payload does not have the schema size are left out.
+        """
+        if not self._schemas:
+            return {}
+        # topic filter -> (payloads, topics, timestamps)
+        groups = {}
+        # topic -> (size, payloads, topics, timestamps) of its schema, None without schema, matched once per topic
+        topic_groups = {}
+        schemas = {}
+        for packet, timestamp in zip(self, self.timestamps):
+            topic = packet.topic
+            group = topic_groups.get(topic, False)
+            if group is False:
+                group = topic_groups[topic] = self._group(topic, groups, schemas)
+            if group is None:
+                continue
+            payload = packet.payload
+            if len(payload) == group[0]:
+                group[1](payload)
+                group[2](topic)
+                group[3](timestamp)
+        result = {}
+        for topic_filter, (payloads, topics, timestamps) in groups.items():
+            columns = schemas[topic_filter].decode(payloads, numpy)
+            columns['topic'] = topics
+            if numpy:
+                import numpy as np
+                timestamps = np.frombuffer(timestamps, np.float64)
+            columns['timestamp'] = timestamps
+            result[topic_filter] = columns
+        return result
+
+    def _group(self, topic, groups, schemas):
+        matches = self._schemas.match(topic)
+        if not matches:
+            return None
+        topic_filter, schema = matches[-1]
+        group = groups.get(topic_filter)
+        if group is None:
+            group = groups[topic_filter] = ([], [], array('d'))
+            schemas[topic_filter] = schema
+        # the bound appends of the group
+        return (schema.size,) + tuple(column.append for column in group)
+
+
+def schema_router(schemas, cache_size=4096):
+    """a TopicRouter of ``{topic filter: PayloadSchema or struct format}``"""
+    router = TopicRouter(cache_size)
+    for topic_filter, schema in schemas.items():
+        if not isinstance(schema, PayloadSchema):
+            schema = PayloadSchema(schema)
+        router.add(topic_filter, (topic_filter, schema))
+    return router
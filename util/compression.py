@@ -0,0 +1,203 @@
+import lzma
+import re
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from util.topic_router import TopicRouter
+
+# first byte of a compressed payload, never the first byte of utf-8 text
+MARKER = 0xFF
+
+_ZLIB = 1
+_LZMA = 2
+_algorithms = {'zlib': _ZLIB, 'lzma': _LZMA}
+
+# both sides must agree on the raw LZMA2 filter chain
+_lzma_dict_size = 1 << 20
+
+# JSON-ish separators the dictionary fragments are split at
+_fragment_separators = re.compile(rb'[,{}\[\]\s]+')
+
+
+def train_dictionary(samples, size=32768):
+    """Build a zlib preset dictionary from sample payloads
+
+    The fragments shared by many samples (keys, units, enum values...) are kept, the most valuable ones at the end
+    where zlib finds them with the shortest distances.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(fragment for fragment in _fragment_separators.split(sample) if len(fragment) > 2))
+    fragments = [fragment for fragment, count in counts.most_common() if count > 1]
+    fragments.sort(key=lambda fragment: counts[fragment] * len(fragment), reverse=True)
+    chosen = []
+    total = 0
+    for fragment in fragments:
+        if total + len(fragment) + 1 > size:
+            break
+        chosen.append(fragment)
+        total += len(fragment) + 1
+    return b','.join(reversed(chosen))
+
+
+class CompressionRule:
+    """How payloads of the matching topics are compressed"""
+    __slots__ = ('algorithm', 'level', 'threshold', 'dictionary_id')
+
+    def __init__(self, algorithm='zlib', level=6, threshold=256, dictionary_id=0):
+        if algorithm not in _algorithms:
+            raise ValueError('algorithm must be one of {}'.format(tuple(_algorithms)))
+        if dictionary_id and algorithm != 'zlib':
+            raise ValueError('only zlib supports preset dictionaries')
+        self.algorithm = algorithm
+        self.level = level
+        self.threshold = threshold
+        self.dictionary_id = dictionary_id
+
+
+class _Stats:
+    __slots__ = ('compressed', 'skipped', 'bytes_in', 'bytes_out', 'cpu_seconds', 'decompressed',
+                 'decompress_cpu_seconds', 'errors')
+
+    def __init__(self):
+        self.compressed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self.decompressed = 0
+        self.decompress_cpu_seconds = 0.0
+        self.errors = 0
+
+    def snapshot(self):
+        return {
+            'compressed': self.compressed,
+            'skipped': self.skipped,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in else None,
+            'cpu_seconds': self.cpu_seconds,
+            'cpu_us_per_kib': self.cpu_seconds * 1e6 / (self.bytes_in / 1024) if self.bytes_in else None,
+            'decompressed': self.decompressed,
+            'decompress_cpu_seconds': self.decompress_cpu_seconds,
+            'errors': self.errors,
+        }
+
+
+class Compression:
+    """Per topic filter payload compression
+
+    Payloads of at least ``threshold`` bytes published to a topic matching a rule are compressed and prefixed with a
+    2 bytes header: ``MARKER`` and a byte holding the algorithm (high nibble) and the dictionary id (low nibble).
+    Received payloads starting with the header are decompressed, anything else is passed through, so compressed and
+    plain publishers can share topics. When several filters match a topic, the most specific one wins::
+
+        compression = Compression()
+        compression.add_dictionary(1, train_dictionary(samples))
+        compression.add_rule('telemetry/#', 'zlib', level=6, threshold=128, dictionary_id=1)
+        client = Client('127.0.0.1', compression=compression)
+
+    ``stats()`` reports per filter the compression ratio and the CPU seconds spent, measured on the calling thread.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._rules = TopicRouter(cache_size)
+        # dictionary id (1-15) -> preset dictionary
+        self._dictionaries = {}
+        self._stats = defaultdict(_Stats)
+        # stats of received payloads, the publisher's rule is unknown
+        self._inbound = _Stats()
+
+    def add_dictionary(self, dictionary_id, dictionary: bytes):
+        if not 1 <= dictionary_id <= 15:
+            raise ValueError('dictionary_id must be in 1..15')
+        self._dictionaries[dictionary_id] = bytes(dictionary)
+
+    def add_rule(self, topic_filter, algorithm='zlib', level=6, threshold=256, dictionary_id=0):
+        if dictionary_id and dictionary_id not in self._dictionaries:
+            raise ValueError('unknown dictionary {}'.format(dictionary_id))
+        self._rules.add(topic_filter, (topic_filter, CompressionRule(algorithm, level, threshold, dictionary_id)))
+
+    def remove_rule(self, topic_filter):
+        self._rules.remove(topic_filter)
+
+    def compress(self, topic, payload):
+        """the payload to publish on ``topic``, compressed when a rule says so and it pays off"""
+        if not self._rules or not payload:
+            return payload
+        rules = self._rules.match(topic)
+        if not rules:
+            return payload
+        topic_filter, rule = rules[-1]
+        stats = self._stats[topic_filter]
+        if len(payload) < rule.threshold:
+            stats.skipped += 1
+            return payload
+        start = time.thread_time()
+        if rule.algorithm == 'zlib':
+            dictionary = self._dictionaries.get(rule.dictionary_id)
+            if dictionary is None:
+                compressor = zlib.compressobj(rule.level, zlib.DEFLATED, -15)
+            else:
+                compressor = zlib.compressobj(rule.level, zlib.DEFLATED, -15, zdict=dictionary)
+            body = compressor.compress(payload) + compressor.flush()
+            header = bytes((MARKER, _ZLIB << 4 | rule.dictionary_id))
+        else:
+            body = lzma.compress(payload, lzma.FORMAT_RAW, filters=(
+                {'id': lzma.FILTER_LZMA2, 'preset': rule.level, 'dict_size': _lzma_dict_size},))
+            header = bytes((MARKER, _LZMA << 4))
+        stats.cpu_seconds += time.thread_time() - start
+        if len(body) + 2 >= len(payload):
+            # not worth it, send it as it is
+            stats.skipped += 1
+            return payload
+        stats.compressed += 1
+        stats.bytes_in += len(payload)
+        stats.bytes_out += len(body) + 2
+        return header + body
+
+    def decompress(self, payload):
+        """the original payload of a received ``payload``"""
+        if len(payload) < 2 or payload[0] != MARKER:
+            return payload
+        algorithm = payload[1] >> 4
+        dictionary_id = payload[1] & 0x0F
+        stats = self._inbound
+        start = time.thread_time()
+        try:
+            if algorithm == _ZLIB:
+                dictionary = self._dictionaries.get(dictionary_id) if dictionary_id else None
+                if dictionary_id and dictionary is None:
+                    raise ValueError('unknown dictionary {}'.format(dictionary_id))
+                if dictionary is None:
+                    decompressor = zlib.decompressobj(-15)
+                else:
+                    decompressor = zlib.decompressobj(-15, zdict=dictionary)
+                result = decompressor.decompress(payload[2:]) + decompressor.flush()
+            elif algorithm == _LZMA:
+                decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=(
+                    {'id': lzma.FILTER_LZMA2, 'dict_size': _lzma_dict_size},))
+                result = decompressor.decompress(payload[2:])
+            else:
+                return payload
+            # raw streams have no checksum and random bytes often decode to something, so only a stream that ends
+            # exactly at the end of the payload and expands it, as compress() makes them, is accepted
+            if not decompressor.eof or decompressor.unused_data or len(result) <= len(payload):
+                raise ValueError('not a compressed payload')
+        except (zlib.error, lzma.LZMAError, ValueError):
+            # a plain binary payload that happens to start with the marker
+            stats.errors += 1
+            return payload
+        finally:
+            stats.decompress_cpu_seconds += time.thread_time() - start
+        stats.decompressed += 1
+        stats.bytes_in += len(result)
+        stats.bytes_out += len(payload)
+        return result
+
+    def stats(self):
+        """topic filter -> stats of the published payloads, 'inbound' for the received ones"""
+        result = {topic_filter: stats.snapshot() for topic_filter, stats in list(self._stats.items())}
+        result['inbound'] = self._inbound.snapshot()
+        return result
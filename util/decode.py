@@ -11,6 +11,7 @@ def decode_remaining_length(scanner: Scanner):
             return remaining_length
         next_byte = scanner.next_bytes()
         flag = next_byte & 0x80
+        multiplier *= 128
         remaining_length += (next_byte & 0x7F) * multiplier
 
 
@@ -0,0 +1,71 @@
+import logging
+import threading
+from collections import deque
+
+
+class OrderedDispatcher:
+    """Runs callbacks on an executor while calls with the same key stay in order
+
+    At most one call per key is submitted to the executor at a time, the others wait in a per-key queue. ``submit``
+    blocks once ``max_pending`` calls are waiting or running, so a slow executor slows the caller down instead of
+    growing without bound.
+    """
+
+    def __init__(self, executor, max_pending=1000):
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # key -> calls waiting behind the running one
+        self._queues = {}
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, key, func, args, on_done=None):
+        """run ``func(*args)`` after every earlier call with the same ``key``
+
+        ``on_done(future)`` is called when it has finished.
+        """
+        self._slots.acquire()
+        task = (func, args, on_done)
+        with self._lock:
+            self._pending += 1
+            waiting = self._queues.get(key)
+            if waiting is not None:
+                waiting.append(task)
+                return
+            self._queues[key] = deque()
+        self._run(key, task)
+
+    def _run(self, key, task):
+        func, args, on_done = task
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception as e:
+            logging.error("submit callback failed: %s", e)
+            self._next(key)
+            return
+        future.add_done_callback(lambda f: self._done(key, on_done, f))
+
+    def _done(self, key, on_done, future):
+        if future.exception() is not None:
+            logging.error("message callback occur error: %s", future.exception())
+        if on_done:
+            try:
+                on_done(future)
+            except Exception as e:
+                logging.error("message callback occur error: %s", e)
+        self._next(key)
+
+    def _next(self, key):
+        with self._lock:
+            self._pending -= 1
+            waiting = self._queues[key]
+            task = waiting.popleft() if waiting else None
+            if task is None:
+                del self._queues[key]
+        self._slots.release()
+        if task is not None:
+            self._run(key, task)
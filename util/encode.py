@@ -1,13 +1,14 @@
 def encode_remaining_length(remaining_length):
     ba = bytearray()
-    while remaining_length > 0:
+    while True:
         byte = remaining_length % 128
         remaining_length = remaining_length // 128
         if remaining_length > 0:
             # 说明还需要更多的字节去编码，因此将本字节的最高位置为1
             byte = byte | 128
         ba.append(byte)
-    return bytes(ba)
+        if remaining_length == 0:
+            return bytes(ba)
 
 
 def encode_string(string):
@@ -0,0 +1,117 @@
+# events of a streamed PUBLISH, after the 16 packet types
+PUBLISH_HEAD = 16
+PUBLISH_CHUNK = 17
+PUBLISH_END = 18
+
+
+class FrameDecoder:
+    """Incremental MQTT frame decoder
+
+    Bytes are read with ``recv_into`` into one reusable buffer and split into complete frames. A frame that is split
+    across reads is kept until the rest of it arrives, so one read can yield many packets or none at all.
+
+    Decoders read from the same thread may share one ``buffer``, frames and leftovers are always copied out of it.
+
+    PUBLISH packets with a remaining length of at least ``stream_threshold`` are not collected: as soon as their
+    topic and packet id have arrived ``(PUBLISH_HEAD, payload_length, header_bytes)`` is returned, then
+    ``(PUBLISH_CHUNK, 0, chunk)`` for every piece of payload read and ``(PUBLISH_END, 0, b'')``.
+
+    ``capture``, if set, is a CaptureWriter recording every read.
+    """
+
+    def __init__(self, buffer_size=65536, buffer=None, stream_threshold=None):
+        self._recv_buffer = bytearray(buffer_size) if buffer is None else buffer
+        self._recv_view = memoryview(self._recv_buffer)
+        # bytes of an incomplete frame left over from previous reads
+        self._pending = bytearray()
+        self.stream_threshold = stream_threshold
+        # payload bytes of the streamed PUBLISH still to come
+        self._stream_remaining = 0
+        self.capture = None
+
+    def recv_from(self, sock):
+        """Read once from ``sock`` and return the list of complete frames"""
+        n = sock.recv_into(self._recv_view)
+        if not n:
+            raise ConnectionError('connection is closed')
+        if self.capture is not None:
+            self.capture.received(self._recv_view[:n])
+        return self.feed(self._recv_view[:n])
+
+    def feed(self, data):
+        """Feed raw bytes, return a list of ``(packet_type, flags, packet_bytes)`` for every complete frame"""
+        frames = []
+        if self._stream_remaining:
+            n = min(len(data), self._stream_remaining)
+            frames.append((PUBLISH_CHUNK, 0, bytes(data[:n])))
+            self._stream_remaining -= n
+            if not self._stream_remaining:
+                frames.append((PUBLISH_END, 0, b''))
+            data = data[n:]
+            if not data:
+                return frames
+        if self._pending:
+            self._pending += data
+            consumed = self._split(self._pending, frames)
+            del self._pending[:consumed]
+        else:
+            # fast path: parse straight from the read buffer and only keep the tail
+            consumed = self._split(data, frames)
+            if consumed < len(data):
+                self._pending += data[consumed:]
+        return frames
+
+    def pending_bytes(self):
+        return len(self._pending)
+
+    def _split(self, data, frames):
+        """Append every complete frame of ``data`` to ``frames``, return the number of bytes consumed"""
+        start = 0
+        end = len(data)
+        while end - start >= 2:
+            # Remaining Length, 1 to 4 bytes
+            remaining_length = 0
+            multiplier = 1
+            offset = start + 1
+            while True:
+                if offset >= end:
+                    return start
+                byte = data[offset]
+                offset += 1
+                remaining_length += (byte & 0x7F) * multiplier
+                if not byte & 0x80:
+                    break
+                multiplier *= 128
+                if multiplier > 128 ** 3:
+                    raise ValueError('malformed remaining length')
+            frame_end = offset + remaining_length
+            first_byte = data[start]
+            if self.stream_threshold is not None and first_byte >> 4 == 3 and remaining_length >= self.stream_threshold:
+                header_end = self._publish_header_end(data, first_byte, offset, end)
+                if header_end is None:
+                    return start
+                frames.append((PUBLISH_HEAD, frame_end - header_end, bytes(data[start:header_end])))
+                chunk_end = min(frame_end, end)
+                if chunk_end > header_end:
+                    frames.append((PUBLISH_CHUNK, 0, bytes(data[header_end:chunk_end])))
+                if frame_end > end:
+                    self._stream_remaining = frame_end - end
+                    return end
+                frames.append((PUBLISH_END, 0, b''))
+                start = frame_end
+                continue
+            if frame_end > end:
+                return start
+            frames.append((first_byte >> 4, first_byte & 0x0F, bytes(data[start:frame_end])))
+            start = frame_end
+        return start
+
+    @staticmethod
+    def _publish_header_end(data, first_byte, offset, end):
+        """end of the topic and packet id of a PUBLISH, None if they have not all arrived"""
+        if offset + 2 > end:
+            return None
+        header_end = offset + 2 + ((data[offset] << 8) | data[offset + 1])
+        if (first_byte >> 1) & 0b11:
+            header_end += 2
+        return header_end if header_end <= end else None
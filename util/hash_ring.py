@@ -0,0 +1,47 @@
+import bisect
+import hashlib
+
+
+def _hash(key):
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring
+
+    Every node is placed on the ring ``replicas`` times. Removing a node only moves the keys it owned, the other
+    keys keep their node.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self._replicas = replicas
+        self._hashes = []
+        self._nodes = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def add(self, node):
+        for i in range(self._replicas):
+            h = _hash('{}#{}'.format(node, i))
+            index = bisect.bisect_left(self._hashes, h)
+            self._hashes.insert(index, h)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        keep = [(h, n) for h, n in zip(self._hashes, self._nodes) if n != node]
+        self._hashes = [h for h, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def get(self, key):
+        """the node owning ``key``, None when the ring is empty"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
@@ -0,0 +1,193 @@
+import bisect
+import json
+import threading
+import time
+from collections import defaultdict
+
+packet_type_names = {
+    1: 'CONNECT', 2: 'CONNACK', 3: 'PUBLISH', 4: 'PUBACK', 5: 'PUBREC', 6: 'PUBREL', 7: 'PUBCOMP',
+    8: 'SUBSCRIBE', 9: 'SUBACK', 10: 'UNSUBSCRIBE', 11: 'UNSUBACK', 12: 'PINGREQ', 13: 'PINGRESP', 14: 'DISCONNECT',
+}
+
+# histogram bucket upper bounds in seconds, 50us .. ~52s
+_default_buckets = tuple(0.00005 * 2 ** i for i in range(21))
+
+
+def _counter_names(direction, packet_type):
+    name = packet_type_names.get(packet_type, packet_type)
+    return 'packets_{}.{}'.format(direction, name), 'bytes_{}.{}'.format(direction, name)
+
+
+# (direction, packet type) -> names of its packets and bytes counters
+_packet_counter_names = {}
+
+
+class Histogram:
+    """Counts observations into fixed buckets"""
+
+    def __init__(self, buckets=_default_buckets):
+        self._bounds = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the ``q`` quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self._counts):
+            seen += n
+            if seen >= rank:
+                return self._bounds[i] if i < len(self._bounds) else self.max
+        return self.max
+
+    def merge(self, snapshot):
+        """add the observations of a snapshot taken with ``buckets=True``"""
+        if 'buckets' not in snapshot:
+            raise ValueError('snapshot has no buckets')
+        for i, n in enumerate(snapshot['buckets']):
+            self._counts[i] += n
+        self.count += snapshot['count']
+        self.sum += snapshot['sum']
+        if snapshot['min'] is not None and (self.min is None or snapshot['min'] < self.min):
+            self.min = snapshot['min']
+        if snapshot['max'] is not None and (self.max is None or snapshot['max'] > self.max):
+            self.max = snapshot['max']
+
+    def snapshot(self, buckets=False):
+        result = {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+        if buckets:
+            result['buckets'] = list(self._counts)
+        return result
+
+
+class Metrics:
+    """Counters, gauges and histograms of a client
+
+    Updates take no lock to stay cheap on the hot path, an update racing with another thread may rarely be lost.
+    Gauges are functions evaluated only when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._histograms = defaultdict(Histogram)
+
+    def inc(self, name, value=1):
+        self._counters[name] += value
+
+    def observe(self, name, value):
+        self._histograms[name].observe(value)
+
+    def gauge(self, name, func):
+        """register ``func()`` as the value of gauge ``name``"""
+        self._gauges[name] = func
+
+    def count_packet(self, direction, packet_type, size):
+        """count one packet of ``size`` bytes, direction is 'in' or 'out'"""
+        names = _packet_counter_names.get((direction, packet_type))
+        if names is None:
+            names = _packet_counter_names[(direction, packet_type)] = _counter_names(direction, packet_type)
+        counters = self._counters
+        counters[names[0]] += 1
+        counters[names[1]] += size
+
+    def snapshot(self, buckets=False):
+        """``buckets=True`` adds the bucket counts of the histograms, needed by merge_snapshots"""
+        return {
+            'time': time.time(),
+            'counters': dict(self._counters),
+            'gauges': {name: func() for name, func in list(self._gauges.items())},
+            'histograms': {name: h.snapshot(buckets) for name, h in list(self._histograms.items())},
+        }
+
+    def reset(self):
+        self._counters.clear()
+        self._histograms.clear()
+
+
+def merge_snapshots(snapshots):
+    """Combine the snapshots of several Metrics, e.g. one per worker process
+
+    Counters and gauges are summed, histograms are merged from their buckets.
+    """
+    counters = defaultdict(int)
+    gauges = defaultdict(int)
+    histograms = defaultdict(Histogram)
+    for snapshot in snapshots:
+        for name, value in snapshot['counters'].items():
+            counters[name] += value
+        for name, value in snapshot['gauges'].items():
+            gauges[name] += value
+        for name, histogram in snapshot['histograms'].items():
+            histograms[name].merge(histogram)
+    return {
+        'time': time.time(),
+        'counters': dict(counters),
+        'gauges': dict(gauges),
+        'histograms': {name: h.snapshot() for name, h in histograms.items()},
+    }
+
+
+class MetricsExporter:
+    """Exports ``metrics.snapshot()`` every ``interval`` seconds from a daemon thread
+
+    Snapshots are appended as JSON lines to ``path`` and/or passed to ``callback``.
+    """
+
+    def __init__(self, metrics, interval=10, path=None, callback=None):
+        if path is None and callback is None:
+            raise ValueError('path or callback is required')
+        self._metrics = metrics
+        self._interval = interval
+        self._path = path
+        self._callback = callback
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-metrics-exporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        # export the final state
+        self.export()
+
+    def export(self):
+        snapshot = self._metrics.snapshot()
+        if self._path:
+            with open(self._path, 'a') as f:
+                f.write(json.dumps(snapshot) + '\n')
+        if self._callback:
+            self._callback(snapshot)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.export()
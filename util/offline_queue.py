@@ -0,0 +1,318 @@
+import collections
+import os
+import queue
+import struct
+import threading
+import time
+
+# record of a spilled message: qos | retain << 2, length of the topic, length of the payload, topic, payload
+_record_header = struct.Struct('>BHI')
+
+_segment_suffix = '.seg'
+
+_policies = ('drop_oldest', 'drop_newest', 'block')
+
+
+def _message_size(topic, payload):
+    return _record_header.size + len(topic.encode('utf-8')) + len(payload)
+
+
+def _read_segment(path):
+    """the messages of a segment file and the length of its valid part"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    messages = []
+    offset = 0
+    end = len(data)
+    unpack_from = _record_header.unpack_from
+    header_size = _record_header.size
+    while offset + header_size <= end:
+        flags, topic_length, payload_length = unpack_from(data, offset)
+        start = offset + header_size
+        if start + topic_length + payload_length > end:
+            # torn by a crash
+            break
+        topic = data[start:start + topic_length].decode('utf-8')
+        payload = data[start + topic_length:start + topic_length + payload_length]
+        messages.append((topic, payload, flags & 0b11, bool(flags & 0b100)))
+        offset = start + topic_length + payload_length
+    return messages, offset
+
+
+class _Segment:
+    __slots__ = ('path', 'count', 'size')
+
+    def __init__(self, path, count=0, size=0):
+        self.path = path
+        self.count = count
+        self.size = size
+
+
+class OfflineQueue:
+    """Messages published while the client is disconnected, see the offline_queue option of Client
+
+    Up to ``max_messages`` messages or ``max_bytes`` bytes are kept in a ring in memory. With ``spill_dir``, a full
+    ring is appended in one write to a log of segment files of about ``segment_size`` bytes, so the disk holds the
+    oldest messages and the ring the newest, at most ``max_disk_bytes`` on disk. What does not fit is handled by
+    ``policy``:
+
+    * ``drop_oldest``: the oldest messages are dropped, a whole segment at a time once they are on disk
+    * ``drop_newest``: the new message is dropped
+    * ``block``: publish() waits up to ``block_timeout`` seconds for room, then raises queue.Full
+
+    The messages are sent again in order, ``batch_size`` per write. A segment file is deleted once all its messages
+    are sent, ``close()`` rewrites it with the ones left and spills the ring too, and segments left in ``spill_dir``
+    by a previous run are queued again, so the messages survive a restart. After a crash the messages of the segment
+    being sent may go out twice::
+
+        offline = OfflineQueue(max_messages=10000, spill_dir='/var/lib/app/offline', max_disk_bytes=1 << 30)
+        client = Client('127.0.0.1', offline_queue=offline, auto_reconnect=True)
+    """
+
+    def __init__(self, max_messages=10000, max_bytes=8 << 20, spill_dir=None, segment_size=4 << 20,
+                 max_disk_bytes=256 << 20, policy='drop_oldest', block_timeout=None, batch_size=1000, fsync=False):
+        if policy not in _policies:
+            raise ValueError('policy must be one of {}'.format(_policies))
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._spill_dir = spill_dir
+        self._segment_size = segment_size
+        self._max_disk_bytes = max_disk_bytes
+        self._policy = policy
+        self._block_timeout = block_timeout
+        self.batch_size = batch_size
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        # newest messages, (topic, payload, qos, retain)
+        self._memory = collections.deque()
+        self._memory_bytes = 0
+        # messages of the oldest segment, read back from the disk
+        self._head = collections.deque()
+        # the segment _head was read from, deleted once _head is sent
+        self._head_segment = None
+        # oldest first, the last one is appended to
+        self._segments = collections.deque()
+        self._tail_file = None
+        self._next_segment = 0
+        self._disk_count = 0
+        self._disk_bytes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.drained = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._recover()
+
+    def __len__(self):
+        return len(self._head) + self._disk_count + len(self._memory)
+
+    def put(self, topic: str, payload: bytes, qos=0, retain=False, block=True):
+        """queue a message, return False if it was dropped
+
+        raise queue.Full if the policy is ``block`` and no room was made in time (at once unless ``block``)
+        """
+        payload = bytes(payload)
+        size = _message_size(topic, payload)
+        deadline = None
+        with self._cond:
+            while not self._memory_fits(size):
+                if self._spill_dir is not None and (self._policy == 'drop_oldest'
+                                                    or self._disk_bytes + self._memory_bytes <= self._max_disk_bytes):
+                    self._spill()
+                    self._trim_disk()
+                    break
+                if self._policy == 'drop_oldest':
+                    _, old_payload, _, _ = old = self._memory.popleft()
+                    self._memory_bytes -= _message_size(old[0], old_payload)
+                    self.dropped += 1
+                    continue
+                if self._policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if not block:
+                    raise queue.Full('offline queue is full')
+                if deadline is None and self._block_timeout is not None:
+                    deadline = time.monotonic() + self._block_timeout
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0 or not self._cond.wait(timeout):
+                    raise queue.Full('offline queue is full')
+            self._memory.append((topic, payload, qos, retain))
+            self._memory_bytes += size
+            return True
+
+    def drain(self, send, limit=None):
+        """pop up to ``limit`` (at most batch_size) of the oldest messages and pass them to ``send`` as a list
+
+        ``send`` runs under the lock of the queue, so messages put meanwhile stay behind them. Return the number of
+        messages sent.
+        """
+        limit = min(limit or self.batch_size, self.batch_size)
+        with self._cond:
+            if not self._head and self._segments:
+                self._load_head()
+            source = self._head or self._memory
+            messages = []
+            while source and len(messages) < limit:
+                messages.append(source.popleft())
+            if source is self._memory:
+                for topic, payload, _, _ in messages:
+                    self._memory_bytes -= _message_size(topic, payload)
+            elif not self._head and self._head_segment is not None:
+                os.remove(self._head_segment.path)
+                self._head_segment = None
+            if messages:
+                send(messages)
+                self.drained += len(messages)
+                self._cond.notify_all()
+            return len(messages)
+
+    def flush(self):
+        """write the spilled messages to the disk"""
+        with self._cond:
+            if self._tail_file is not None:
+                self._tail_file.flush()
+                if self._fsync:
+                    os.fsync(self._tail_file.fileno())
+
+    def close(self):
+        """write the ring and the messages left of the oldest segment to the disk when spilling and close the
+        segment, put() opens it again"""
+        with self._cond:
+            if self._head_segment is not None:
+                self._rewrite_head()
+            if self._spill_dir is not None and self._memory:
+                self._spill()
+                self._trim_disk()
+            if self._tail_file is not None:
+                self.flush()
+                self._tail_file.close()
+                self._tail_file = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self),
+                'memory_messages': len(self._memory) + len(self._head),
+                'memory_bytes': self._memory_bytes,
+                'disk_messages': self._disk_count,
+                'disk_bytes': self._disk_bytes,
+                'segments': len(self._segments),
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'drained': self.drained,
+            }
+
+    def _memory_fits(self, size):
+        if not self._memory:
+            return True
+        return len(self._memory) < self._max_messages and self._memory_bytes + size <= self._max_bytes
+
+    def _encode(self, messages):
+        records = []
+        for topic, payload, qos, retain in messages:
+            topic_bytes = topic.encode('utf-8')
+            records.append(_record_header.pack(qos | retain << 2, len(topic_bytes), len(payload)))
+            records.append(topic_bytes)
+            records.append(payload)
+        return b''.join(records)
+
+    def _rewrite_head(self):
+        """replace the segment of _head by the messages of _head that are not sent yet"""
+        path = self._head_segment.path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._encode(self._head))
+            f.flush()
+            if self._fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _spill(self):
+        """append the whole ring to the segment log"""
+        records = []
+        records_size = 0
+        for topic, payload, qos, retain in self._memory:
+            topic_bytes = topic.encode('utf-8')
+            records.append(_record_header.pack(qos | retain << 2, len(topic_bytes), len(payload)))
+            records.append(topic_bytes)
+            records.append(payload)
+            records_size += _record_header.size + len(topic_bytes) + len(payload)
+            segment = self._tail_segment()
+            segment.count += 1
+            if segment.size + records_size >= self._segment_size:
+                self._write_records(segment, records, records_size)
+                records = []
+                records_size = 0
+                # the next record starts a new segment
+                self._tail_file.close()
+                self._tail_file = None
+        if records:
+            self._write_records(self._tail_segment(), records, records_size)
+        self.flush()
+        self.spilled += len(self._memory)
+        self._disk_count += len(self._memory)
+        self._memory.clear()
+        self._memory_bytes = 0
+
+    def _write_records(self, segment, records, records_size):
+        self._tail_file.write(b''.join(records))
+        segment.size += records_size
+        self._disk_bytes += records_size
+
+    def _tail_segment(self):
+        if self._tail_file is None:
+            if self._segments and self._segments[-1].size < self._segment_size:
+                segment = self._segments[-1]
+            else:
+                segment = _Segment(os.path.join(self._spill_dir, '{:012d}{}'.format(self._next_segment,
+                                                                                    _segment_suffix)))
+                self._next_segment += 1
+                self._segments.append(segment)
+            self._tail_file = open(segment.path, 'ab')
+        return self._segments[-1]
+
+    def _trim_disk(self):
+        while self._disk_bytes > self._max_disk_bytes and len(self._segments) > 1:
+            segment = self._segments.popleft()
+            os.remove(segment.path)
+            self._disk_count -= segment.count
+            self._disk_bytes -= segment.size
+            self.dropped += segment.count
+
+    def _load_head(self):
+        segment = self._segments.popleft()
+        if not self._segments and self._tail_file is not None:
+            self._tail_file.close()
+            self._tail_file = None
+        messages, _ = _read_segment(segment.path)
+        if messages:
+            # the file is kept until the messages are sent
+            self._head_segment = segment
+        else:
+            os.remove(segment.path)
+        self._disk_count -= segment.count
+        self._disk_bytes -= segment.size
+        self._head.extend(messages)
+
+    def _recover(self):
+        """queue the segments of a previous run"""
+        names = []
+        for name in sorted(os.listdir(self._spill_dir)):
+            if name.endswith(_segment_suffix):
+                names.append(name)
+            elif name.endswith(_segment_suffix + '.tmp'):
+                # a rewrite of the oldest segment interrupted by a crash, the segment itself is intact
+                os.remove(os.path.join(self._spill_dir, name))
+        for name in names:
+            path = os.path.join(self._spill_dir, name)
+            messages, valid = _read_segment(path)
+            if valid < os.path.getsize(path):
+                os.truncate(path, valid)
+            if not messages:
+                os.remove(path)
+                continue
+            self._segments.append(_Segment(path, len(messages), valid))
+            self._disk_count += len(messages)
+            self._disk_bytes += valid
+        if names:
+            self._next_segment = int(names[-1][:-len(_segment_suffix)]) + 1
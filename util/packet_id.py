@@ -0,0 +1,56 @@
+from collections import deque
+
+
+class PacketIdAllocator:
+    """Allocates packet ids in 1..65535
+
+    Ids that have never been used are handed out in order, released ids go to a free-list and are recycled first, so
+    both ``allocate`` and ``release`` are O(1).
+    """
+
+    def __init__(self, max_id=0xFFFF):
+        self._max_id = max_id
+        # every id >= _next has never been handed out
+        self._next = 1
+        self._free = deque()
+        self._in_use = set()
+
+    def __len__(self):
+        return len(self._in_use)
+
+    def __contains__(self, packet_id):
+        return packet_id in self._in_use
+
+    @property
+    def available(self):
+        return self._max_id - len(self._in_use)
+
+    def allocate(self):
+        """return an unused packet id, raise RuntimeError when all of them are in use"""
+        while self._free:
+            packet_id = self._free.popleft()
+            # skip ids taken by reserve() while they were in the free-list
+            if packet_id not in self._in_use:
+                self._in_use.add(packet_id)
+                return packet_id
+        while self._next <= self._max_id:
+            packet_id = self._next
+            self._next += 1
+            if packet_id not in self._in_use:
+                self._in_use.add(packet_id)
+                return packet_id
+        raise RuntimeError('no packet id is available')
+
+    def reserve(self, packet_id):
+        """mark a known packet id as in use, e.g. one restored from a session"""
+        self._in_use.add(packet_id)
+
+    def release(self, packet_id):
+        if packet_id in self._in_use:
+            self._in_use.remove(packet_id)
+            self._free.append(packet_id)
+
+    def clear(self):
+        self._next = 1
+        self._free.clear()
+        self._in_use.clear()
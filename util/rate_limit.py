@@ -0,0 +1,197 @@
+import collections
+import queue
+import threading
+import time
+
+from util.topic_router import TopicRouter
+
+_policies = ('block', 'reject', 'queue')
+
+
+class TokenBucket:
+    """``rate`` tokens per second, up to ``burst`` of them saved up
+
+    A reservation may take the bucket below zero, the caller then waits until the debt is paid back.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'queued', 'releasing', 'allowed', 'delayed', 'rejected',
+                 'delay_seconds')
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = max(burst or rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # (due, func, args) of the messages waiting for their turn with the queue policy, due in order
+        self.queued = collections.deque()
+        # a timer releasing the queued messages is scheduled
+        self.releasing = False
+        self.allowed = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.delay_seconds = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def snapshot(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': self.tokens,
+            'allowed': self.allowed,
+            'delayed': self.delayed,
+            'rejected': self.rejected,
+            'delay_seconds': self.delay_seconds,
+            'queued': len(self.queued),
+        }
+
+
+class RateLimiter:
+    """Token buckets per topic filter and for all topics together
+
+    A message takes a token from the global bucket (``rate`` per second, if set) and from the bucket of the most
+    specific topic filter matching its topic. Matches are cached per topic, so the lookup costs O(1) whatever the
+    number of filters. When a bucket is empty ``policy`` decides:
+
+    * ``block``: the caller sleeps until the tokens are there
+    * ``reject``: publish() raises queue.Full, a received message is dropped (and acknowledged)
+    * ``queue``: the message is sent or dispatched later by the client's timers, in order per bucket; at most
+      ``max_queued`` messages per bucket, then publish() raises queue.Full and receiving blocks
+
+    The network thread never blocks on its own publishes, they are queued instead::
+
+        limiter = RateLimiter(rate=1000, policy='queue')
+        limiter.add_limit('sensor/+/raw', 50, burst=100)
+        client = Client('127.0.0.1', publish_rate_limit=limiter)
+    """
+
+    def __init__(self, rate=None, burst=None, policy='block', max_queued=10000, cache_size=4096):
+        if policy not in _policies:
+            raise ValueError('policy must be one of {}'.format(_policies))
+        self.policy = policy
+        self.max_queued = max_queued
+        self._global = TokenBucket(rate, burst) if rate else None
+        self._limits = TopicRouter(cache_size)
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        """number of messages waiting with the queue policy"""
+        return sum(len(bucket.queued) for bucket in self._buckets())
+
+    def add_limit(self, topic_filter, rate, burst=None):
+        """limit the topics matching ``topic_filter`` to ``rate`` messages per second together"""
+        with self._lock:
+            self._limits.add(topic_filter, (topic_filter, TokenBucket(rate, burst)))
+
+    def remove_limit(self, topic_filter):
+        with self._lock:
+            self._limits.remove(topic_filter)
+
+    def try_acquire(self, topic, n=1):
+        """take ``n`` tokens for a message of ``topic`` if every bucket has them, return whether it did"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._match(topic)
+            for bucket in buckets:
+                bucket.refill(now)
+            if any(bucket.tokens < n for bucket in buckets):
+                for bucket in buckets:
+                    bucket.rejected += 1
+                return False
+            for bucket in buckets:
+                bucket.tokens -= n
+                bucket.allowed += 1
+            return True
+
+    def reserve(self, topic, n=1):
+        """take ``n`` tokens for a message of ``topic``, return ``(bucket, delay)``
+
+        ``delay`` is the number of seconds to wait before the message may go, ``bucket`` is the one holding the
+        queue of the message, None when no limit applies.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._match(topic)
+            if not buckets:
+                return None, 0
+            delay = 0
+            for bucket in buckets:
+                bucket.refill(now)
+                bucket.tokens -= n
+                if bucket.tokens < 0:
+                    delay = max(delay, -bucket.tokens / bucket.rate)
+            for bucket in buckets:
+                if delay > 0:
+                    bucket.delayed += 1
+                    bucket.delay_seconds += delay
+                else:
+                    bucket.allowed += 1
+            return buckets[0], delay
+
+    def defer(self, bucket, delay, func, args):
+        """queue ``func(*args)`` behind the messages of ``bucket``, return True if a release must be scheduled
+
+        raise queue.Full when ``max_queued`` messages are already waiting
+        """
+        with self._lock:
+            if len(bucket.queued) >= self.max_queued:
+                raise queue.Full('rate limit queue is full')
+            bucket.queued.append((time.monotonic() + delay, func, args))
+            if bucket.releasing:
+                return False
+            bucket.releasing = True
+            return True
+
+    def pop_due(self, bucket):
+        """the queued ``(func, args)`` of ``bucket`` that are due and the delay of the next release, None if the
+        queue is empty"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            queued = bucket.queued
+            while queued and queued[0][0] <= now:
+                _, func, args = queued.popleft()
+                due.append((func, args))
+            if queued:
+                return due, queued[0][0] - now
+            bucket.releasing = False
+            return due, None
+
+    def push_back(self, bucket, calls):
+        """queue again the ``(func, args)`` popped by pop_due that could not run, ahead of the others"""
+        now = time.monotonic()
+        with self._lock:
+            bucket.queued.extendleft((now, func, args) for func, args in reversed(calls))
+            bucket.releasing = True
+
+    def stats(self):
+        """topic filter -> bucket state, 'global' for the global bucket"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for topic_filter in self._limits.filters():
+                bucket = self._limits.get(topic_filter)[1]
+                bucket.refill(now)
+                result[topic_filter] = bucket.snapshot()
+            if self._global is not None:
+                self._global.refill(now)
+                result['global'] = self._global.snapshot()
+            return result
+
+    def _match(self, topic):
+        """the buckets of ``topic``, the one holding its queue first"""
+        limits = self._limits.match(topic) if self._limits else ()
+        if limits:
+            bucket = limits[-1][1]
+            return (bucket, self._global) if self._global is not None else (bucket,)
+        return (self._global,) if self._global is not None else ()
+
+    def _buckets(self):
+        buckets = [self._limits.get(topic_filter)[1] for topic_filter in self._limits.filters()]
+        if self._global is not None:
+            buckets.append(self._global)
+        return buckets
@@ -0,0 +1,240 @@
+import mmap
+import os
+import struct
+import threading
+
+# record: op, packet id, length of data, data
+_record_header = struct.Struct('>BHI')
+
+_OP_PUBLISH = 1
+_OP_PUBREL = 2
+_OP_DONE = 3
+_OP_INBOUND = 4
+_OP_INBOUND_DONE = 5
+
+
+class SessionState:
+    """In-flight QoS 1/2 state of a session"""
+
+    def __init__(self):
+        # packet id -> encoded PUBLISH waiting for PUBACK/PUBREC, in publish order
+        self.publishes = {}
+        # packet ids of sent QoS 2 messages waiting for PUBCOMP
+        self.pubrels = set()
+        # packet ids of received QoS 2 messages waiting for PUBREL
+        self.inbound = set()
+
+    def __len__(self):
+        return len(self.publishes) + len(self.pubrels) + len(self.inbound)
+
+
+class SessionStore:
+    """Keeps the in-flight state of a client session
+
+    The client records every change, ``load`` returns the state to replay when a persistent session is resumed.
+    This base class keeps nothing.
+    """
+
+    def add_publish(self, packet_id, packet_bytes):
+        """a QoS 1/2 PUBLISH was sent"""
+
+    def add_pubrel(self, packet_id):
+        """PUBREC was received, PUBREL is sent"""
+
+    def remove(self, packet_id):
+        """PUBACK or PUBCOMP was received"""
+
+    def add_inbound(self, packet_id):
+        """a QoS 2 PUBLISH was received"""
+
+    def remove_inbound(self, packet_id):
+        """PUBREL of a received QoS 2 PUBLISH was received"""
+
+    def load(self):
+        return SessionState()
+
+    def clear(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSessionStore(SessionStore):
+    """Session store backed by an append-only log file
+
+    Changes are appended as small records, ``load`` maps the file with mmap and replays it in one pass. Once the
+    log holds ``compact_ratio`` times more dead records than live ones (and at least ``compact_min`` records), the
+    live records are copied into a new file that replaces the old one.
+    """
+
+    def __init__(self, path, fsync=False, compact_min=10000, compact_ratio=4):
+        self._path = path
+        self._fsync = fsync
+        self._compact_min = compact_min
+        self._compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._state = SessionState()
+        # packet id -> (offset, length) of the live PUBLISH record
+        self._offsets = {}
+        self._records = 0
+        self._file = None
+        self._size = 0
+        self._open()
+
+    def add_publish(self, packet_id, packet_bytes):
+        with self._lock:
+            self._offsets[packet_id] = (self._size, _record_header.size + len(packet_bytes))
+            self._state.publishes[packet_id] = None
+            self._append(_OP_PUBLISH, packet_id, packet_bytes)
+
+    def add_pubrel(self, packet_id):
+        with self._lock:
+            self._forget_publish(packet_id)
+            self._state.pubrels.add(packet_id)
+            self._append(_OP_PUBREL, packet_id)
+
+    def remove(self, packet_id):
+        with self._lock:
+            self._forget_publish(packet_id)
+            self._state.pubrels.discard(packet_id)
+            self._append(_OP_DONE, packet_id)
+            self._maybe_compact()
+
+    def add_inbound(self, packet_id):
+        with self._lock:
+            self._state.inbound.add(packet_id)
+            self._append(_OP_INBOUND, packet_id)
+
+    def remove_inbound(self, packet_id):
+        with self._lock:
+            self._state.inbound.discard(packet_id)
+            self._append(_OP_INBOUND_DONE, packet_id)
+            self._maybe_compact()
+
+    def load(self):
+        """return the SessionState with the encoded PUBLISH packets"""
+        with self._lock:
+            self._file.flush()
+            state = SessionState()
+            state.pubrels = set(self._state.pubrels)
+            state.inbound = set(self._state.inbound)
+            if self._offsets:
+                with open(self._path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for packet_id, (offset, length) in self._offsets.items():
+                        state.publishes[packet_id] = mm[offset + _record_header.size:offset + length]
+            return state
+
+    def clear(self):
+        with self._lock:
+            self._file.close()
+            self._file = open(self._path, 'wb')
+            self._reset()
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        """replay the existing log into memory and open it for appending"""
+        self._reset()
+        if os.path.exists(self._path) and os.path.getsize(self._path):
+            with open(self._path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                valid = self._replay(mm)
+            if valid < os.path.getsize(self._path):
+                # drop a record torn by a crash
+                os.truncate(self._path, valid)
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+
+    def _replay(self, mm):
+        state = self._state
+        offsets = self._offsets
+        offset = 0
+        end = len(mm)
+        unpack_from = _record_header.unpack_from
+        header_size = _record_header.size
+        while offset + header_size <= end:
+            op, packet_id, length = unpack_from(mm, offset)
+            record_length = header_size + length
+            if offset + record_length > end:
+                break
+            if op == _OP_PUBLISH:
+                offsets[packet_id] = (offset, record_length)
+                state.publishes.pop(packet_id, None)
+                state.publishes[packet_id] = None
+            elif op == _OP_PUBREL:
+                offsets.pop(packet_id, None)
+                state.publishes.pop(packet_id, None)
+                state.pubrels.add(packet_id)
+            elif op == _OP_DONE:
+                offsets.pop(packet_id, None)
+                state.publishes.pop(packet_id, None)
+                state.pubrels.discard(packet_id)
+            elif op == _OP_INBOUND:
+                state.inbound.add(packet_id)
+            elif op == _OP_INBOUND_DONE:
+                state.inbound.discard(packet_id)
+            offset += record_length
+            self._records += 1
+        # keep the publish order of the offsets
+        self._offsets = {packet_id: offsets[packet_id] for packet_id in state.publishes}
+        return offset
+
+    def _reset(self):
+        self._state = SessionState()
+        self._offsets = {}
+        self._records = 0
+        self._size = 0
+
+    def _forget_publish(self, packet_id):
+        self._offsets.pop(packet_id, None)
+        self._state.publishes.pop(packet_id, None)
+
+    def _append(self, op, packet_id, data=b''):
+        self._file.write(_record_header.pack(op, packet_id, len(data)))
+        if data:
+            self._file.write(data)
+        self._size += _record_header.size + len(data)
+        self._records += 1
+
+    def _maybe_compact(self):
+        live = len(self._state)
+        if self._records < self._compact_min or self._records < live * self._compact_ratio:
+            return
+        self._file.flush()
+        tmp_path = self._path + '.compact'
+        offsets = {}
+        with open(self._path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                open(tmp_path, 'wb') as out:
+            size = 0
+            for packet_id, (offset, length) in self._offsets.items():
+                out.write(mm[offset:offset + length])
+                offsets[packet_id] = (size, length)
+                size += length
+            for packet_id in self._state.pubrels:
+                out.write(_record_header.pack(_OP_PUBREL, packet_id, 0))
+                size += _record_header.size
+            for packet_id in self._state.inbound:
+                out.write(_record_header.pack(_OP_INBOUND, packet_id, 0))
+                size += _record_header.size
+            out.flush()
+            if self._fsync:
+                os.fsync(out.fileno())
+        self._file.close()
+        os.replace(tmp_path, self._path)
+        self._file = open(self._path, 'ab')
+        self._offsets = offsets
+        self._size = size
+        self._records = live
@@ -0,0 +1,62 @@
+class StreamPayload:
+    """Payload of ``length`` bytes read in chunks from a file-like object or an iterable of bytes
+
+    A seekable file is read again from the same offset for a retransmission, an iterable only once.
+    """
+    __slots__ = ('_source', '_length', '_chunk_size', '_offset', '_consumed')
+
+    def __init__(self, source, length=None, chunk_size=65536):
+        self._source = source
+        self._chunk_size = chunk_size
+        self._offset = None
+        if hasattr(source, 'read') and hasattr(source, 'seek') and (not hasattr(source, 'seekable')
+                                                                    or source.seekable()):
+            self._offset = source.tell()
+            if length is None:
+                length = source.seek(0, 2) - self._offset
+                source.seek(self._offset)
+        if length is None:
+            raise ValueError('the length of a stream that cannot seek must be declared')
+        if length > 268435455 - 65535:
+            raise ValueError('payload is too large for one packet')
+        self._length = length
+        self._consumed = False
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def seekable(self):
+        return self._offset is not None
+
+    def chunks(self):
+        """yield exactly ``length`` bytes in chunks, raise ValueError when the source does not hold as many"""
+        if self._offset is not None:
+            self._source.seek(self._offset)
+        elif self._consumed:
+            raise ValueError('the stream was already read')
+        self._consumed = True
+        remaining = self._length
+        if hasattr(self._source, 'read'):
+            while remaining:
+                chunk = self._source.read(min(self._chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            for chunk in self._source:
+                if len(chunk) > remaining:
+                    raise ValueError('stream is longer than its declared length {}'.format(self._length))
+                remaining -= len(chunk)
+                if chunk:
+                    yield chunk
+        if remaining:
+            raise ValueError('stream is shorter than its declared length {}'.format(self._length))
+
+    def __bytes__(self):
+        """the whole payload in memory, only for the rare paths that need it"""
+        return b''.join(self.chunks())
+
+    def __repr__(self):
+        return 'StreamPayload(length = {})'.format(self._length)
@@ -0,0 +1,97 @@
+import logging
+import math
+import threading
+import time
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', '_slot', '_lock')
+
+    def __init__(self, deadline, callback, args, lock):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self._slot = None
+        self._lock = lock
+
+    def cancel(self):
+        """cancel the timer, O(1)"""
+        with self._lock:
+            if self._slot is not None:
+                self._slot.discard(self)
+                self._slot = None
+
+    @property
+    def active(self):
+        return self._slot is not None
+
+
+class TimerWheel:
+    """Hashed timer wheel
+
+    A timer goes into slot ``deadline tick % slots``. Each tick only looks at one slot, so scheduling, cancelling
+    and ticking are O(1) no matter how many timers are outstanding. Timers run on the thread calling ``advance``,
+    there is no thread per timer.
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self._tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._origin = time.monotonic()
+        # last tick that was processed
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    @property
+    def tick(self):
+        return self._tick
+
+    def schedule(self, delay, callback, *args):
+        """call ``callback(*args)`` after ``delay`` seconds, return the Timer"""
+        deadline = math.ceil((time.monotonic() + delay - self._origin) / self._tick)
+        timer = Timer(deadline, callback, args, self._lock)
+        with self._lock:
+            slot = self._slots[max(deadline, self._current + 1) % len(self._slots)]
+            slot.add(timer)
+            timer._slot = slot
+        return timer
+
+    def next_timeout(self, now=None):
+        """seconds until the next tick"""
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self._origin + (self._current + 1) * self._tick - now)
+
+    def advance(self, now=None):
+        """run every timer that is due, return the number of timers run"""
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self._origin) / self._tick)
+        if target <= self._current:
+            return 0
+        expired = []
+        with self._lock:
+            slots = self._slots
+            if target - self._current >= len(slots):
+                # fell behind by more than one turn: look at every slot once
+                ticks = range(len(slots))
+            else:
+                ticks = range(self._current + 1, target + 1)
+            for tick in ticks:
+                slot = slots[tick % len(slots)]
+                if not slot:
+                    continue
+                for timer in [timer for timer in slot if timer.deadline <= target]:
+                    slot.discard(timer)
+                    timer._slot = None
+                    expired.append(timer)
+            self._current = target
+        for timer in expired:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logging.error("timer callback occur error: %s", e)
+        return len(expired)
@@ -0,0 +1,121 @@
+from util.lru import LRUCache
+
+
+class _Node:
+    __slots__ = ('children', 'value', 'has_value')
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+        self.has_value = False
+
+
+def validate_topic_filter(topic_filter: str):
+    if not topic_filter:
+        raise ValueError('topic filter must not be empty')
+    levels = topic_filter.split('/')
+    for i, level in enumerate(levels):
+        if '#' in level and (level != '#' or i != len(levels) - 1):
+            raise ValueError('"#" must be the last level of a topic filter: {}'.format(topic_filter))
+        if '+' in level and level != '+':
+            raise ValueError('"+" must occupy a whole level of a topic filter: {}'.format(topic_filter))
+    return levels
+
+
+class TopicRouter:
+    """Maps topic filters to values, matching topics against ``+`` and ``#`` wildcards
+
+    Filters are stored in a trie with one node per topic level, so a match costs O(topic depth) rather than
+    O(number of filters). Results are cached per concrete topic in a bounded LRU that is dropped on every change.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._root = _Node()
+        self._filters = {}
+        self._cache = LRUCache(cache_size)
+
+    def __len__(self):
+        return len(self._filters)
+
+    def __contains__(self, topic_filter):
+        return topic_filter in self._filters
+
+    def get(self, topic_filter, default=None):
+        return self._filters.get(topic_filter, default)
+
+    def filters(self):
+        return list(self._filters)
+
+    def add(self, topic_filter: str, value):
+        """add or replace the value of ``topic_filter``"""
+        node = self._root
+        for level in validate_topic_filter(topic_filter):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.value = value
+        node.has_value = True
+        self._filters[topic_filter] = value
+        self._cache.clear()
+
+    def remove(self, topic_filter: str):
+        """remove ``topic_filter``, return False if it was not added"""
+        if topic_filter not in self._filters:
+            return False
+        del self._filters[topic_filter]
+        path = [self._root]
+        levels = topic_filter.split('/')
+        for level in levels:
+            path.append(path[-1].children[level])
+        node = path[-1]
+        node.value = None
+        node.has_value = False
+        # prune the branch that no longer leads to a value
+        for i in range(len(levels) - 1, -1, -1):
+            node = path[i + 1]
+            if node.has_value or node.children:
+                break
+            del path[i].children[levels[i]]
+        self._cache.clear()
+        return True
+
+    def match(self, topic: str):
+        """return a tuple of the values whose filter matches ``topic``"""
+        result = self._cache.get(topic)
+        if result is None:
+            result = tuple(self._match(topic))
+            self._cache.put(topic, result)
+        return result
+
+    def _match(self, topic):
+        values = []
+        nodes = [self._root]
+        # wildcards in the first level do not match topics starting with "$"
+        wildcard = not topic.startswith('$')
+        for level in topic.split('/'):
+            next_nodes = []
+            for node in nodes:
+                children = node.children
+                if wildcard:
+                    multi = children.get('#')
+                    if multi is not None and multi.has_value:
+                        values.append(multi.value)
+                    single = children.get('+')
+                    if single is not None:
+                        next_nodes.append(single)
+                child = children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            if not next_nodes:
+                return values
+            nodes = next_nodes
+            wildcard = True
+        for node in nodes:
+            if node.has_value:
+                values.append(node.value)
+            # "sport/#" also matches "sport"
+            multi = node.children.get('#')
+            if multi is not None and multi.has_value:
+                values.append(multi.value)
+        return values
@@ -0,0 +1,199 @@
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+# max number of buffers passed to one sendmsg call
+_IOV_MAX = 1024
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+class WriteQueue:
+    """Outbound write queue
+
+    Encoded packets are collected and written together with one vectored ``sendmsg``. The queue flushes by itself
+    once ``flush_size`` bytes are pending or the oldest pending packet is older than ``flush_interval`` seconds, a
+    threshold of 0 is not checked; with both at 0, the defaults, every packet is written immediately. The thresholds
+    are only checked when a packet is queued, nothing is written on a timer.
+
+    On a non-blocking socket (``blocking=False``) the queue never waits for the socket, whatever it does not accept
+    stays queued and ``on_pending(queue)`` is called so an event loop can finish the write once it is writable.
+
+    ``post`` hands a packet over without taking the lock or touching the socket, so many producer threads do not
+    queue up behind the writer; posted packets are written in order by the next ``append``, ``flush`` or ``due``.
+
+    ``write_stream`` writes one large packet chunk by chunk, the packets queued meanwhile wait until it is complete.
+    """
+
+    def __init__(self, sock, flush_size=0, flush_interval=0, blocking=True, on_pending=None):
+        self._socket = sock
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._blocking = blocking
+        self._on_pending = on_pending
+        self._buffers = deque()
+        self._size = 0
+        # packets posted by other threads, deque appends are atomic
+        self._inbox = deque()
+        # a packet is being streamed, nothing may be written in the middle of it
+        self._streaming = False
+        # time of the oldest pending buffer
+        self._first_time = None
+        # the network loop flushes while other threads may be queueing
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._buffers)
+
+    @property
+    def pending_bytes(self):
+        return self._size
+
+    def post(self, data):
+        """queue one encoded packet without taking the lock, it is written by the next flush"""
+        self._inbox.append(data)
+
+    def post_many(self, datas):
+        self._inbox.extend(datas)
+
+    def append(self, data):
+        """queue one encoded packet, flush if a threshold is reached"""
+        with self._lock:
+            if self._streaming:
+                self._inbox.append(data)
+                return
+            self._take_inbox()
+            self._push(data)
+            self._flush_if_due()
+
+    def extend(self, datas):
+        """queue many encoded packets, check the thresholds once"""
+        with self._lock:
+            if self._streaming:
+                self._inbox.extend(datas)
+                return
+            self._take_inbox()
+            for data in datas:
+                self._push(data)
+            self._flush_if_due()
+
+    def due(self, now=None):
+        """whether the pending bytes should be written now"""
+        if self._inbox:
+            with self._lock:
+                self._take_inbox()
+        if not self._buffers:
+            return False
+        return self._due(now)
+
+    def flush(self):
+        """write every pending buffer, blocking until done, only as much as the socket accepts when non-blocking"""
+        with self._lock:
+            if not self._blocking:
+                self.flush_nowait()
+                return
+            self._take_inbox()
+            while self._buffers:
+                self._write_some()
+
+    def flush_nowait(self):
+        """write as much as the socket accepts, return True when nothing is left"""
+        with self._lock:
+            self._take_inbox()
+            try:
+                while self._buffers:
+                    if self._write_some() == 0:
+                        return False
+            except (BlockingIOError, InterruptedError):
+                return False
+            return True
+
+    def write_stream(self, header, chunks):
+        """Write ``header`` and then every chunk of ``chunks``, blocking until the last one is written
+
+        Only one chunk is buffered at a time and the lock is released between chunks, so the network thread can keep
+        flushing. If ``chunks`` raises, the packet on the wire is incomplete and the connection must be dropped.
+        """
+        with self._lock:
+            self._take_inbox()
+            self._streaming = True
+            self._push(header)
+        try:
+            for chunk in chunks:
+                with self._lock:
+                    self._push(chunk)
+                    self._write_all()
+            with self._lock:
+                self._write_all()
+        finally:
+            with self._lock:
+                self._streaming = False
+                self._take_inbox()
+        if self._buffers:
+            self.flush()
+
+    def _write_all(self):
+        while self._buffers:
+            try:
+                self._write_some()
+            except (BlockingIOError, InterruptedError):
+                # non-blocking socket, wait until it is writable
+                select.select([], [self._socket], [])
+
+    def _take_inbox(self):
+        if self._streaming:
+            return
+        inbox = self._inbox
+        while inbox:
+            self._push(inbox.popleft())
+
+    def _push(self, data):
+        if not self._buffers:
+            self._first_time = time.monotonic()
+        self._buffers.append(data)
+        self._size += len(data)
+
+    def _due(self, now=None):
+        if not self._flush_size and not self._flush_interval:
+            return True
+        if self._flush_size and self._size >= self._flush_size:
+            return True
+        if not self._flush_interval:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self._first_time >= self._flush_interval
+
+    def _flush_if_due(self):
+        if self._due():
+            self.flush()
+        if self._buffers and self._on_pending is not None:
+            self._on_pending(self)
+
+    def _write_some(self):
+        buffers = self._buffers
+        if len(buffers) == 1 or not _HAS_SENDMSG:
+            data = buffers[0] if len(buffers) == 1 else b''.join(buffers)
+            sent = self._socket.send(data)
+            if len(buffers) > 1:
+                buffers.clear()
+                buffers.append(data)
+        else:
+            sent = self._socket.sendmsg([buffers[i] for i in range(min(len(buffers), _IOV_MAX))])
+        self._consume(sent)
+        return sent
+
+    def _consume(self, sent):
+        """drop ``sent`` bytes from the head of the queue"""
+        self._size -= sent
+        buffers = self._buffers
+        while sent:
+            head = buffers[0]
+            if sent < len(head):
+                buffers[0] = memoryview(head)[sent:]
+                return
+            sent -= len(head)
+            buffers.popleft()
+        if not buffers:
+            self._first_time = None